@@ -1,8 +1,44 @@
-from fastapi import FastAPI
+import logging
+from typing import List, Optional, Union
+
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, ConfigDict, Field
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+class SearchFilters(BaseModel):
+    # Unknown filter keys are rejected with a 422 instead of failing the search
+    model_config = ConfigDict(extra='forbid')
+
+    symbol: Optional[Union[str, List[str]]] = None
+    source: Optional[Union[str, List[str]]] = None
+    since: Optional[Union[float, str]] = None
+    until: Optional[Union[float, str]] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    # Bounded so an empty or huge top-k never reaches FAISS
+    k: int = Field(5, gt=0, le=100)
+    threshold: Optional[float] = None
+    filters: Optional[SearchFilters] = None
+
+def get_vector_store():
+    """The running system's vector store, or None until it has started.
+
+    A system that failed to start is reported as not ready (503) too.
+    """
+    try:
+        from backend.main import livemarket_ai
+    except ImportError:
+        return None
+    except Exception as e:
+        logger.error(f"❌ System initialization failed: {e}")
+        raise HTTPException(status_code=503, detail="Vector store is not ready")
+    return livemarket_ai.vector_store
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -26,3 +62,16 @@ async def status():
         "agents": {"market_agent": "active", "reporter_agent": "active"},
         "vector_store": {"document_count": 0}
     }
+
+
+@app.post("/search/batch")
+async def search_batch(request: BatchSearchRequest):
+    vector_store = get_vector_store()
+    if vector_store is None:
+        raise HTTPException(status_code=503, detail="Vector store is not ready")
+
+    filters = request.filters.model_dump(exclude_none=True) if request.filters else None
+    results = await vector_store.asearch_batch(
+        request.queries, k=request.k, threshold=request.threshold, filters=filters or None
+    )
+    return {"results": results}
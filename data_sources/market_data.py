@@ -4,17 +4,98 @@ Market Data Source - Real-time Financial Data
 
 import logging
 import asyncio
+import os
+import time
 from typing import Dict, Any, List
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+class DeadbandFilter:
+    """Per-symbol change detection for market ticks.
+    
+    A tick passes when its price moved more than ``price_pct`` percent, its
+    percent change moved more than ``change_pct`` points or its volume moved
+    more than ``volume_pct`` percent since the symbol's last emitted tick, or
+    when that tick is older than ``max_staleness`` seconds. Every tick held
+    back is one embedding and index write saved.
+    """
+    
+    def __init__(self, price_pct: float = None, change_pct: float = None, volume_pct: float = None,
+                 max_staleness: float = None):
+        self.price_pct = float(os.getenv('MARKET_DEADBAND_PRICE_PCT', '0.1')) if price_pct is None else price_pct
+        self.change_pct = float(os.getenv('MARKET_DEADBAND_CHANGE_PCT', '0.25')) if change_pct is None else change_pct
+        self.volume_pct = float(os.getenv('MARKET_DEADBAND_VOLUME_PCT', '25')) if volume_pct is None else volume_pct
+        # Heartbeat: an unchanged symbol is still re-emitted this often
+        self.max_staleness = (float(os.getenv('MARKET_MAX_STALENESS', '300'))
+                              if max_staleness is None else max_staleness)
+        self._last = {}  # symbol -> (emitted tick, emitted at)
+        self.ticks = 0
+        self.suppressed = 0
+        self.emitted = 0
+        self.heartbeats = 0
+    
+    def filter(self, market_data: Dict[str, Dict[str, Any]], now: float = None) -> Dict[str, Dict[str, Any]]:
+        """Ticks of the symbols that moved past a threshold or are due a heartbeat.
+        
+        Nothing is recorded until ``commit`` is called with the ticks that were
+        written, so ticks of a failed write pass again on the next call.
+        """
+        now = time.monotonic() if now is None else now
+        changed = {}
+        for symbol, data in market_data.items():
+            self.ticks += 1
+            last = self._last.get(symbol)
+            if last is not None and not self._moved(last[0], data):
+                if now - last[1] < self.max_staleness:
+                    self.suppressed += 1
+                    continue
+                self.heartbeats += 1
+            changed[symbol] = data
+        return changed
+    
+    def commit(self, written: Dict[str, Dict[str, Any]], now: float = None):
+        """Record ticks returned by ``filter`` as emitted once they were stored"""
+        now = time.monotonic() if now is None else now
+        for symbol, data in written.items():
+            # Queued writes can land out of order; keep the most recent tick
+            if symbol not in self._last or self._last[symbol][1] <= now:
+                self._last[symbol] = (data, now)
+        self.emitted += len(written)
+    
+    def _moved(self, last: Dict[str, Any], data: Dict[str, Any]) -> bool:
+        return (self._relative_change(last['price'], data['price']) > self.price_pct
+                or abs(data['change_percent'] - last['change_percent']) > self.change_pct
+                or self._relative_change(last['volume'], data['volume']) > self.volume_pct)
+    
+    @staticmethod
+    def _relative_change(old: float, new: float) -> float:
+        """Percent change from old to new"""
+        if not old:
+            return float('inf') if new else 0.0
+        return abs(new - old) / abs(old) * 100
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "ticks": self.ticks,
+            "emitted": self.emitted,
+            "heartbeats": self.heartbeats,
+            "embeddings_saved": self.suppressed,
+            "price_pct": self.price_pct,
+            "change_pct": self.change_pct,
+            "volume_pct": self.volume_pct,
+            "max_staleness": self.max_staleness
+        }
+
 class MarketDataSource:
     """Source for real-time market data"""
     
-    def __init__(self, pipeline):
+    def __init__(self, pipeline, deadband: DeadbandFilter = None):
+        # A pipeline, or an IngestionQueue in front of one
         self.pipeline = pipeline
         self.symbols = ['AAPL', 'GOOGL', 'MSFT', 'TSLA', 'AMZN', 'META', 'NVDA', 'BTC-USD', 'ETH-USD']
+        # Only ticks that changed meaningfully are embedded and indexed
+        self.deadband = deadband or DeadbandFilter()
         self.is_running = False
         
     async def start_streaming(self):
@@ -26,23 +107,50 @@ class MarketDataSource:
             try:
                 # Simulate market data updates
                 market_data = self._generate_market_data()
+                changed = await self.publish(market_data)
                 
-                # Convert to document format and add to pipeline
-                for symbol, data in market_data.items():
-                    content = self._format_market_content(symbol, data)
-                    self.pipeline.add_document(
-                        content=content,
-                        source="market_data",
-                        symbol=symbol
-                    )
-                
-                logger.info(f"📈 Generated market data for {len(market_data)} symbols")
+                logger.info(f"📈 Generated market data for {len(market_data)} symbols, "
+                            f"{len(changed)} changed past the deadband")
                 await asyncio.sleep(10)  # Update every 10 seconds
                 
             except Exception as e:
                 logger.error(f"❌ Market data streaming error: {e}")
                 await asyncio.sleep(5)
     
+    async def publish(self, market_data: Dict[str, Dict[str, Any]], now: float = None) -> Dict[str, Dict[str, Any]]:
+        """Upsert the ticks that pass the deadband and return them.
+        
+        A tick becomes its symbol's deadband reference only once it is stored:
+        through an IngestionQueue that is when a worker has written it, so ticks
+        evicted from a full queue or lost in a failed write leave the reference
+        unchanged and the next tick of the symbol passes again.
+        """
+        now = time.monotonic() if now is None else now
+        changed = self.deadband.filter(market_data, now)
+        if not changed:
+            return changed
+        
+        # Convert to document format; each tick replaces the symbols' previous
+        # snapshots and is embedded and written as one batch
+        documents = [
+            {
+                "content": self._format_market_content(symbol, data),
+                "source": "market_data",
+                "symbol": symbol
+            }
+            for symbol, data in changed.items()
+        ]
+        if hasattr(self.pipeline, 'asubmit'):
+            # An IngestionQueue only queues the batch; its workers report each stored tick
+            def written(document):
+                self.deadband.commit({document["symbol"]: changed[document["symbol"]]}, now)
+            await self.pipeline.asubmit(documents, upsert=True, on_written=written)
+        else:
+            # A failed write raises before the commit
+            await self.pipeline.aupsert_documents(documents)
+            self.deadband.commit(changed, now)
+        return changed
+    
     def _generate_market_data(self) -> Dict[str, Dict[str, Any]]:
         """Generate simulated market data"""
         import random
@@ -93,4 +201,12 @@ class MarketDataSource:
     
     def get_available_symbols(self) -> List[str]:
         """Get list of available symbols"""
-        return self.symbols.copy()
\ No newline at end of file
+        return self.symbols.copy()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Deadband counters, including the embeddings saved by skipped ticks"""
+        return {
+            "symbols": len(self.symbols),
+            "is_running": self.is_running,
+            "deadband": self.deadband.get_stats()
+        }
\ No newline at end of file
@@ -14,6 +14,7 @@ class NewsFeedSource:
     """Source for financial news and articles"""
     
     def __init__(self, pipeline):
+        # A pipeline, or an IngestionQueue in front of one
         self.pipeline = pipeline
         self.sources = ['Bloomberg', 'Reuters', 'CNBC', 'Financial Times', 'Wall Street Journal']
         self.categories = ['markets', 'stocks', 'crypto', 'economy', 'technology', 'earnings']
@@ -29,13 +30,20 @@ class NewsFeedSource:
                 # Generate simulated news articles
                 news_articles = self._generate_news_articles()
                 
-                # Add to pipeline
-                for article in news_articles:
-                    self.pipeline.add_document(
-                        content=article['content'],
-                        source=article['source'],
-                        symbol=article.get('symbol')
-                    )
+                # Add the whole cycle to the pipeline as one batch
+                documents = [
+                    {
+                        "content": article['content'],
+                        "source": article['source'],
+                        "symbol": article.get('symbol')
+                    }
+                    for article in news_articles
+                ]
+                if hasattr(self.pipeline, 'asubmit'):
+                    # An IngestionQueue only queues the batch for its workers
+                    await self.pipeline.asubmit(documents)
+                else:
+                    await self.pipeline.aadd_documents(documents)
                 
                 logger.info(f"📝 Generated {len(news_articles)} news articles")
                 await asyncio.sleep(15)  # New articles every 15 seconds
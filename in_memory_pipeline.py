@@ -3,35 +3,35 @@ In-Memory Pipeline Fallback (FAISS-based)
 """
 
 import logging
+import threading
 import numpy as np
-from datetime import datetime
 from typing import Dict, Any, List
-import faiss
-import json
-import os
+from backend.rag.chunking import TextChunker
+from backend.rag.document_journal import DocumentJournal, place
+from backend.rag.ingest import BatchIngestion, write_batch
 
 logger = logging.getLogger(__name__)
 
-class InMemoryPipeline:
+class InMemoryPipeline(BatchIngestion):
     """In-memory FAISS-based pipeline for fallback mode"""
     
     def __init__(self, embedder, vector_store):
         self.embedder = embedder
         self.vector_store = vector_store
+        # Long documents are indexed as overlapping token windows
+        self.chunker = TextChunker()
         self.documents = []
+        self._snapshot_rows = {}  # (symbol, source) -> position of the upserted document
+        self.journal = DocumentJournal("./data")
+        # Async adds write from executor threads; batches reach the store and the log in one order
+        self._ingest_lock = threading.Lock()
         self.setup_pipeline()
         
     def setup_pipeline(self):
         """Setup in-memory FAISS index"""
         try:
-            # Load existing documents if any
-            data_file = "./data/processed_documents.json"
-            if os.path.exists(data_file):
-                with open(data_file, 'r') as f:
-                    for line in f:
-                        doc = json.loads(line.strip())
-                        self.documents.append(doc)
-                logger.info(f"📂 Loaded {len(self.documents)} existing documents")
+            # Map the last snapshot and replay the documents logged since
+            self.documents, self._snapshot_rows = self.journal.load()
             
             logger.info("✅ In-memory pipeline setup complete")
             
@@ -39,50 +39,54 @@ class InMemoryPipeline:
             logger.error(f"❌ In-memory pipeline setup failed: {e}")
             raise
     
-    def add_document(self, content: str, source: str, symbol: str = None) -> str:
-        """Add document to in-memory pipeline"""
+    def _ingest(self, documents: List[Dict[str, Any]], chunked: List[List[str]], embeddings: np.ndarray,
+                upsert: bool) -> List[str]:
+        """Embed the chunks unless embeddings are given, then write the batch to the
+        vector store and the log"""
         try:
-            doc_id = f"doc_{datetime.now().timestamp()}"
-            embedding = self.embedder.embed(content)
+            with self._ingest_lock:
+                batch = write_batch(self.embedder, self.vector_store, documents, chunked, embeddings, upsert)
+                if not batch:
+                    return []
+                
+                for document in batch:
+                    row, replaces = place(self._snapshot_rows, document, upsert, len(self.documents))
+                    if replaces:
+                        self.documents[row] = document
+                    else:
+                        self.documents.append(document)
+                
+                # Log metadata only for recovery, in one append per batch
+                self.journal.append(batch, upsert)
             
-            document = {
-                "content": content,
-                "embedding": embedding,
-                "metadata": {
-                    "source": source,
-                    "symbol": symbol,
-                    "timestamp": datetime.now().isoformat(),
-                    "id": doc_id
-                }
-            }
-            
-            # Add to vector store
-            self.vector_store.add_documents([document])
-            self.documents.append(document)
-            
-            # Save to file for persistence
-            with open("./data/processed_documents.json", "a") as f:
-                f.write(json.dumps(document) + "\n")
-            
-            logger.info(f"📄 Document added to in-memory pipeline: {doc_id}")
-            return doc_id
+            logger.info(f"📄 {len(batch)} documents {'upserted in' if upsert else 'added to'} in-memory pipeline")
+            return [document["metadata"]["id"] for document in batch]
             
         except Exception as e:
-            logger.error(f"❌ Failed to add document: {e}")
+            logger.error(f"❌ Failed to {'upsert' if upsert else 'add'} documents: {e}")
             raise
     
-    def query(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Query the in-memory index"""
+    def query(self, query: str, k: int = 5, symbol=None, source=None, since=None,
+              until=None) -> List[Dict[str, Any]]:
+        """Query the in-memory index, optionally filtered by symbol, source and time range"""
         try:
-            return self.vector_store.search(query, k=k)
+            return self.vector_store.search(query, k=k, symbol=symbol, source=source,
+                                            since=since, until=until)
         except Exception as e:
             logger.error(f"❌ Query failed: {e}")
             return []
+    
+    async def aquery(self, query: str, k: int = 5, symbol=None, source=None, since=None,
+                     until=None) -> List[Dict[str, Any]]:
+        """Async query that never blocks the event loop"""
+        return await self.vector_store.asearch(query, k=k, symbol=symbol, source=source,
+                                               since=since, until=until)
 
     def get_stats(self) -> Dict[str, Any]:
         """Get pipeline statistics"""
         return {
             "total_documents": len(self.documents),
             "pipeline_type": "in_memory",
+            "journal": self.journal.get_stats(),
             "status": "running"
         }
\ No newline at end of file
@@ -9,6 +9,7 @@ app = FastAPI()
 def status():
     return {"status": "ok"}
 import os
+import asyncio
 import logging
 from dotenv import load_dotenv
 
@@ -20,6 +21,10 @@ class LiveMarketAI:
         self.embedder = None
         self.vector_store = None
         self.pipeline = None
+        self.ingestion = None
+        self.market_data = None
+        self.news_feed = None
+        self._source_tasks = []
         self.market_agent = None
         self.reporter_agent = None
         self.setup_components()
@@ -32,7 +37,16 @@ class LiveMarketAI:
             from backend.agents.reporter_agent import ReporterAgent
             
             self.embedder = Embedder()
-            self.vector_store = VectorStore(self.embedder)
+            if os.getenv('EMBEDDING_MICRO_BATCHING', 'true').lower() == 'true':
+                from backend.rag.embedding_batcher import BatchingEmbedder
+                # Concurrent embed() calls from ingest and queries share one batched call
+                self.embedder = BatchingEmbedder(self.embedder)
+            if os.getenv('VECTOR_STORE_SHARDED', 'false').lower() == 'true':
+                from backend.rag.sharded_store import ShardedVectorStore
+                self.vector_store = ShardedVectorStore(self.embedder)
+                logger.info("🧩 Using time-sharded vector store")
+            else:
+                self.vector_store = VectorStore(self.embedder)
             
             use_pathway = os.getenv('USE_PATHWAY', 'false').lower() == 'true'
             if use_pathway:
@@ -49,6 +63,20 @@ class LiveMarketAI:
                 self.pipeline = InMemoryPipeline(self.embedder, self.vector_store)
                 logger.info("💾 Using in-memory pipeline")
             
+            from backend.rag.ingestion_queue import IngestionQueue
+            # Data sources submit through this queue; its workers feed the pipeline in batches
+            self.ingestion = IngestionQueue(self.pipeline)
+            
+            if os.getenv('MARKET_DATA_ENABLED', 'true').lower() == 'true':
+                from backend.data_sources.market_data import MarketDataSource
+                self.market_data = MarketDataSource(self.ingestion)
+                logger.info("📊 Market data source initialized")
+            
+            if os.getenv('NEWS_FEED_ENABLED', 'true').lower() == 'true':
+                from backend.data_sources.news_feeds import NewsFeedSource
+                self.news_feed = NewsFeedSource(self.ingestion)
+                logger.info("📰 News feed source initialized")
+            
             if os.getenv('MARKET_AGENT_ENABLED', 'true').lower() == 'true':
                 self.market_agent = MarketAgent(self.pipeline)
                 logger.info("🤖 Market agent initialized")
@@ -96,6 +124,21 @@ class LiveMarketAI:
     def add_document(self, content: str, source: str, symbol: str = None) -> str:
         return self.pipeline.add_document(content, source, symbol)
     
+    def start_sources(self):
+        """Start streaming the enabled data sources into the ingestion queue"""
+        self._source_tasks = [asyncio.create_task(source.start_streaming())
+                              for source in (self.market_data, self.news_feed) if source]
+    
+    async def stop_sources(self):
+        """Stop the data sources, so nothing is submitted while the queue drains"""
+        for source in (self.market_data, self.news_feed):
+            if source:
+                source.stop_streaming()
+        for task in self._source_tasks:
+            task.cancel()
+        await asyncio.gather(*self._source_tasks, return_exceptions=True)
+        self._source_tasks = []
+    
     def get_system_status(self) -> dict:
         return {
             "pipeline": self.pipeline.get_stats() if hasattr(self.pipeline, 'get_stats') else {"status": "active"},
@@ -104,8 +147,25 @@ class LiveMarketAI:
                 "reporter_agent": "active" if self.reporter_agent else "inactive"
             },
             "vector_store": {
-                "document_count": len(self.vector_store.documents) if hasattr(self.vector_store, 'documents') else 0
-            }
+                "document_count": self.vector_store.get_stats()["total_documents"] if self.vector_store else 0
+            },
+            "ingestion": self.ingestion.get_stats() if self.ingestion else None,
+            "market_data": self.market_data.get_stats() if self.market_data else None
         }
 
 livemarket_ai = LiveMarketAI()
+
+@app.on_event("startup")
+async def startup():
+    if livemarket_ai.ingestion:
+        await livemarket_ai.ingestion.start()
+    livemarket_ai.start_sources()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Stop the sources and write out queued documents, then make buffered vector store writes durable
+    await livemarket_ai.stop_sources()
+    if livemarket_ai.ingestion:
+        await livemarket_ai.ingestion.stop()
+    if livemarket_ai.vector_store:
+        livemarket_ai.vector_store.flush()
@@ -5,18 +5,23 @@ Pathway Streaming Pipeline for Real-Time Data Processing
 import pathway as pw
 import logging
 import os
+import numpy as np
 from datetime import datetime
 from typing import Dict, Any, List
 from pathway.stdlib.ml.index import KNNIndex
+from backend.rag.chunking import TextChunker
+from backend.rag.ingest import BatchIngestion, write_batch
 
 logger = logging.getLogger(__name__)
 
-class PathwayPipeline:
+class PathwayPipeline(BatchIngestion):
     """Real-time streaming pipeline using Pathway"""
     
     def __init__(self, embedder, vector_store):
         self.embedder = embedder
         self.vector_store = vector_store
+        # Long documents are indexed as overlapping token windows
+        self.chunker = TextChunker()
         self.setup_pipeline()
         
     def setup_pipeline(self):
@@ -45,7 +50,8 @@ class PathwayPipeline:
                     embedding = self.embedder.embed(doc.content)
                     return {
                         **doc,
-                        "embedding": embedding,
+                        # Pathway tables and the JSON output take plain lists
+                        "embedding": embedding.tolist(),
                         "metadata": {
                             "source": doc.source,
                             "symbol": doc.symbol,
@@ -80,48 +86,39 @@ class PathwayPipeline:
             logger.error(f"❌ Pathway pipeline setup failed: {e}")
             raise
     
-    def add_document(self, content: str, source: str, symbol: str = None) -> str:
-        """Add document to streaming pipeline"""
+    def _ingest(self, documents: List[Dict[str, Any]], chunked: List[List[str]], embeddings: np.ndarray,
+                upsert: bool) -> List[str]:
+        """Embed the chunks unless embeddings are given, then write the batch to the vector store"""
         try:
-            doc_id = f"doc_{datetime.now().timestamp()}"
-            document = {
-                "id": doc_id,
-                "content": content,
-                "timestamp": datetime.now().isoformat(),
-                "source": source,
-                "symbol": symbol
-            }
-            
             # In a real implementation, this would write to Pathway input
             # For demo, we'll directly add to vector store
-            embedding = self.embedder.embed(content)
-            self.vector_store.add_documents([{
-                "content": content,
-                "embedding": embedding,
-                "metadata": {
-                    "source": source,
-                    "symbol": symbol,
-                    "timestamp": datetime.now().isoformat(),
-                    "id": doc_id
-                }
-            }])
+            batch = write_batch(self.embedder, self.vector_store, documents, chunked, embeddings, upsert)
+            doc_ids = [document["metadata"]["id"] for document in batch]
             
-            logger.info(f"📄 Document added to pipeline: {doc_id}")
-            return doc_id
+            logger.info(f"📄 {len(doc_ids)} documents {'upserted in' if upsert else 'added to'} pipeline")
+            return doc_ids
             
         except Exception as e:
-            logger.error(f"❌ Failed to add document: {e}")
+            logger.error(f"❌ Failed to {'upsert' if upsert else 'add'} documents: {e}")
             raise
     
-    def query(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Query the streaming index"""
+    def query(self, query: str, k: int = 5, symbol=None, source=None, since=None,
+              until=None) -> List[Dict[str, Any]]:
+        """Query the streaming index, optionally filtered by symbol, source and time range"""
         try:
             # For demo, use vector store directly
             # In full implementation, this would use Pathway's real-time query
-            return self.vector_store.search(query, k=k)
+            return self.vector_store.search(query, k=k, symbol=symbol, source=source,
+                                            since=since, until=until)
         except Exception as e:
             logger.error(f"❌ Query failed: {e}")
             return []
+    
+    async def aquery(self, query: str, k: int = 5, symbol=None, source=None, since=None,
+                     until=None) -> List[Dict[str, Any]]:
+        """Async query that never blocks the event loop"""
+        return await self.vector_store.asearch(query, k=k, symbol=symbol, source=source,
+                                               since=since, until=until)
 
     def run(self):
         """Run the Pathway pipeline"""
@@ -0,0 +1,133 @@
+"""
+Recall, Latency and Memory Benchmarks for Vector Index Backends
+
+Usage:
+    python -m backend.rag.benchmark --rows 200000 --dimension 384
+    python -m backend.rag.benchmark --data-dir ./data --dimension 1536
+    python -m backend.rag.benchmark --rows 100000 --dimension 1536 --index-types sq_fp16,sq_int8,pq
+"""
+
+import argparse
+import logging
+import os
+import time
+import numpy as np
+import faiss
+from typing import List, Dict, Any, Sequence
+from . import index_factory
+from .storage import SegmentStore
+
+logger = logging.getLogger(__name__)
+
+def synthetic_vectors(n_rows: int, dimension: int, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Normalized vectors drawn around random centroids, closer to real embeddings than pure noise"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(n_clusters, dimension)).astype('float32')
+    assignments = rng.integers(0, n_clusters, n_rows)
+    vectors = centroids[assignments] + 0.5 * rng.normal(size=(n_rows, dimension)).astype('float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def sample_queries(vectors: np.ndarray, n_queries: int, seed: int = 1) -> np.ndarray:
+    """Perturbed copies of stored vectors, so every query has true near neighbours"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = np.array(vectors[np.sort(rows)], dtype='float32')
+    queries += 0.1 * rng.normal(size=queries.shape).astype('float32') / np.sqrt(queries.shape[1])
+    faiss.normalize_L2(queries)
+    return queries
+
+def recall_at_k(ground_truth: np.ndarray, labels: np.ndarray, k: int) -> float:
+    """Fraction of the exact top-k that the approximate search returned"""
+    hits = sum(len(set(truth[:k]) & set(found[:k])) for truth, found in zip(ground_truth, labels))
+    return hits / float(len(ground_truth) * k)
+
+def timed_search(index, queries: np.ndarray, k: int):
+    """Search one query at a time, as the API does, returning labels and mean latency in ms"""
+    labels = np.empty((len(queries), k), dtype='int64')
+    started = time.perf_counter()
+    for i in range(len(queries)):
+        labels[i] = index.search(queries[i:i + 1], k)[1][0]
+    return labels, (time.perf_counter() - started) * 1000 / len(queries)
+
+def index_bytes(index) -> int:
+    """Serialized size of an index, a close proxy for its resident memory"""
+    return len(faiss.serialize_index(index))
+
+def recall_latency_report(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+                          index_types: Sequence[str] = index_factory.INDEX_TYPES,
+                          rerank_factor: int = 4) -> List[Dict[str, Any]]:
+    """Compare recall@k, query latency and memory per document of each index type
+    against the exact flat baseline.
+
+    Quantized types also report recall after re-scoring the top
+    ``k * rerank_factor`` candidates with the float32 vectors.
+    """
+    dimension = vectors.shape[1]
+    results = []
+    ground_truth = None
+    baseline_latency = None
+
+    for index_type in ['flat'] + [t for t in index_types if t != 'flat']:
+        started = time.perf_counter()
+        index = index_factory.build_index(index_type, dimension, vectors)
+        build_seconds = time.perf_counter() - started
+
+        labels, latency_ms = timed_search(index, queries, k)
+        if index_type == 'flat':
+            ground_truth, baseline_latency = labels, latency_ms
+
+        reranked_recall = None
+        if index_type in index_factory.QUANTIZED_TYPES:
+            candidates = index.search(queries, k * rerank_factor)[1]
+            reranked = index_factory.rerank(queries, candidates, lambda rows: vectors[rows], k)[1]
+            reranked_recall = round(recall_at_k(ground_truth, reranked, k), 4)
+
+        results.append({
+            "index_type": index_type,
+            "factory": index_factory.factory_string(index_type, dimension, len(vectors)),
+            "rows": len(vectors),
+            "build_seconds": round(build_seconds, 2),
+            "latency_ms": round(latency_ms, 3),
+            "speedup": round(baseline_latency / latency_ms, 1) if latency_ms else None,
+            "bytes_per_doc": round(index_bytes(index) / len(vectors), 1),
+            f"recall_at_{k}": round(recall_at_k(ground_truth, labels, k), 4),
+            "reranked_recall": reranked_recall
+        })
+        logger.info(f"📏 {index_type}: {results[-1]}")
+
+    return results
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    """Render report rows as a fixed-width table"""
+    if not results:
+        return ""
+    columns = list(results[0].keys())
+    widths = [max(len(column), *(len(str(row[column])) for row in results)) for column in columns]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    for row in results:
+        lines.append("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k vs latency and memory for FAISS index backends")
+    parser.add_argument("--data-dir", help="Benchmark the vectors persisted in this vector store directory")
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic rows when no data dir is given")
+    parser.add_argument("--dimension", type=int, default=int(os.getenv('VECTOR_DIMENSION', '384')))
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--index-types", default=",".join(index_factory.INDEX_TYPES))
+    parser.add_argument("--rerank-factor", type=int, default=int(os.getenv('VECTOR_RERANK_FACTOR', '4')))
+    args = parser.parse_args()
+
+    if args.data_dir:
+        vectors = np.ascontiguousarray(SegmentStore(args.data_dir, args.dimension).read_vectors())
+    else:
+        vectors = synthetic_vectors(args.rows, args.dimension)
+    queries = sample_queries(vectors, args.queries)
+
+    results = recall_latency_report(vectors, queries, args.k, args.index_types.split(","), args.rerank_factor)
+    print(format_report(results))
+
+if __name__ == "__main__":
+    main()
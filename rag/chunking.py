@@ -0,0 +1,122 @@
+"""
+Token-Aware Document Chunking and Embedding Request Packing
+"""
+
+import logging
+import os
+import re
+import numpy as np
+from typing import List, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Without tiktoken, a deliberately high token estimate: ASCII letters in runs of
+# at most three, digits in runs of three (as BPE splits numbers) and any other
+# character on its own, which covers tickers, numbers and non-English text
+_TOKEN = re.compile(r"[A-Za-z]{1,3}|\d{1,3}|\S")
+
+class TextChunker:
+    """Splits text into windows of at most ``chunk_tokens`` tokens, each
+    overlapping the previous one by ``overlap`` tokens.
+
+    Tokens come from tiktoken's ``encoding_name`` encoding when tiktoken is
+    installed, otherwise from a conservative approximation that counts at
+    least one token per three characters, so limits are not overrun. Chunks
+    are cut from the original text, so their content keeps its formatting.
+    """
+
+    def __init__(self, chunk_tokens: int = None, overlap: int = None, encoding_name: str = 'cl100k_base'):
+        if chunk_tokens is None:
+            chunk_tokens = int(os.getenv('CHUNK_TOKENS', '512'))
+        if overlap is None:
+            overlap = int(os.getenv('CHUNK_OVERLAP', '64'))
+        if chunk_tokens <= 0 or not 0 <= overlap < chunk_tokens:
+            raise ValueError(f"Invalid chunking: {chunk_tokens} tokens with {overlap} overlap")
+        self.chunk_tokens = chunk_tokens
+        self.overlap = overlap
+        try:
+            import tiktoken
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            self.encoding = None
+            logger.warning("⚠️ tiktoken not available, estimating token counts conservatively")
+
+    def _spans(self, text: str) -> Tuple[List[int], List[int]]:
+        """Start and end character offsets of every token"""
+        if self.encoding is None:
+            matches = list(_TOKEN.finditer(text))
+            return [m.start() for m in matches], [m.end() for m in matches]
+        _, starts = self.encoding.decode_with_offsets(self.encoding.encode(text))
+        return starts, starts[1:] + [len(text)]
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text"""
+        if self.encoding is None:
+            return len(_TOKEN.findall(text))
+        return len(self.encoding.encode(text))
+
+    def split(self, text: str) -> List[str]:
+        """Overlapping chunks covering text; short text is returned whole"""
+        starts, ends = self._spans(text)
+        if len(starts) <= self.chunk_tokens:
+            return [text]
+        step = self.chunk_tokens - self.overlap
+        chunks = []
+        for first in range(0, len(starts), step):
+            last = min(first + self.chunk_tokens, len(starts))
+            chunks.append(text[starts[first]:ends[last - 1]])
+            if last == len(starts):
+                break
+        return chunks
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Text cut after its first max_tokens tokens"""
+        starts, ends = self._spans(text)
+        return text if len(starts) <= max_tokens else text[:ends[max_tokens - 1]]
+
+def pack_batches(token_counts: List[int], max_items: int, max_tokens: int) -> List[slice]:
+    """Split consecutive inputs into as few requests as possible, each holding
+    at most max_items inputs and max_tokens tokens (an input larger than
+    max_tokens gets a request of its own)"""
+    batches = []
+    start, tokens = 0, 0
+    for i, count in enumerate(token_counts):
+        if i > start and (i - start >= max_items or tokens + count > max_tokens):
+            batches.append(slice(start, i))
+            start, tokens = i, 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append(slice(start, len(token_counts)))
+    return batches
+
+def chunk_records(document: Dict[str, Any], chunks: List[str], embeddings) -> List[Dict[str, Any]]:
+    """Vector store records for a document split into chunks, one row of
+    embeddings per chunk. A single chunk is stored as the document itself;
+    otherwise every chunk carries the document id as ``parent_id`` so
+    searches can collapse chunks back into one hit per document."""
+    embeddings = np.reshape(embeddings, (len(chunks), -1))
+    if len(chunks) == 1:
+        return [{**document, "embedding": embeddings[0]}]
+    metadata = document.get('metadata') or {}
+    parent_id = metadata.get('id')
+    return [{
+        **document,
+        "content": chunk,
+        "embedding": embedding,
+        "metadata": {**metadata, "id": f"{parent_id}#{i}", "parent_id": parent_id,
+                     "chunk": i, "chunks": len(chunks)}
+    } for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))]
+
+def collapse_chunks(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep only the best scoring chunk of each parent document; results are
+    sorted by descending score"""
+    seen = set()
+    collapsed = []
+    for result in results:
+        parent_id = (result.get('metadata') or {}).get('parent_id')
+        if parent_id is not None:
+            if parent_id in seen:
+                continue
+            seen.add(parent_id)
+        collapsed.append(result)
+    return collapsed
@@ -0,0 +1,294 @@
+"""
+Snapshot plus Write-Ahead Log Recovery for Pipeline Documents
+"""
+
+import json
+import logging
+import mmap
+import os
+import threading
+import numpy as np
+from typing import List, Dict, Any, Tuple
+from .document_records import shared_records
+from .document_table import DocumentTable
+from .storage import dump_record, fsync_file, strip_embedding, write_atomic
+
+logger = logging.getLogger(__name__)
+
+def place(keys: Dict[Tuple, int], document: Dict[str, Any], upsert: bool, size: int) -> Tuple[int, bool]:
+    """Row a document goes to among ``size`` rows and whether it replaces that row.
+
+    An upsert replaces the row holding the same (symbol, source), if any, and
+    otherwise becomes that key's row; everything else, including upserts
+    missing the symbol or the source, is appended, as in
+    ``VectorStore.upsert_documents``. ``keys`` is updated in place.
+    """
+    metadata = document.get('metadata') or {}
+    key = (metadata.get('symbol'), metadata.get('source'))
+    if not upsert or None in key:
+        return size, False
+    if key in keys:
+        return keys[key], True
+    keys[key] = size
+    return size, False
+
+def _decode_row(line: bytes) -> Dict[str, Any]:
+    """Snapshot row as the shared record the vector store holds for it, if any"""
+    document = json.loads(line)
+    return shared_records.find(document) or document
+
+class DocumentJournal:
+    """Pipeline documents persisted as a snapshot plus a write-ahead log (WAL).
+
+    The snapshot (``pipeline.<gen>.jsonl``, one compact record per row, with
+    a ``.offsets.npy`` line table) is memory-mapped at startup and decoded
+    lazily, so loading it costs the same at any size; only the WAL written
+    since, holding one line per added or upserted document, is parsed and
+    replayed. Once the WAL is large relative to the snapshot, appends move to
+    a new WAL file and a background thread folds the snapshot and the
+    retired WAL files into the next snapshot, copying unchanged rows as raw
+    bytes. The manifest rename is the commit point, so a crash at any moment
+    leaves a loadable snapshot and every WAL file written after it.
+    """
+
+    MANIFEST = "pipeline.json"
+    LEGACY_DOCUMENTS = "processed_documents.json"
+
+    def __init__(self, data_dir: str = './data', min_snapshot_rows: int = None, snapshot_ratio: float = None):
+        self.data_dir = data_dir
+        if min_snapshot_rows is None:
+            min_snapshot_rows = int(os.getenv('PIPELINE_SNAPSHOT_MIN_ROWS', '10000'))
+        self.min_snapshot_rows = min_snapshot_rows
+        if snapshot_ratio is None:
+            snapshot_ratio = float(os.getenv('PIPELINE_SNAPSHOT_RATIO', '0.5'))
+        self.snapshot_ratio = snapshot_ratio
+        self.generation = 0  # Snapshot in use; 0 means empty
+        self.wal_generation = 0  # WAL file receiving appends
+        self.snapshot_rows = 0
+        self.wal_rows = 0  # Records in every WAL file since the snapshot
+        self.snapshots = 0
+        self._keys = {}  # (symbol, source) -> row, as of the snapshot
+        self._lock = threading.Lock()
+        self._snapshot_thread = None
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name)
+
+    def _snapshot_path(self, generation: int) -> str:
+        return self._path(f"pipeline.{generation}.jsonl")
+
+    def _offsets_path(self, generation: int) -> str:
+        return self._path(f"pipeline.{generation}.offsets.npy")
+
+    def _wal_path(self, generation: int) -> str:
+        return self._path(f"pipeline.{generation}.wal")
+
+    def load(self) -> Tuple[DocumentTable, Dict[Tuple, int]]:
+        """Map the snapshot and replay the WAL on top of it.
+
+        Returns the documents in row order and the upsert key -> row map.
+        A legacy processed_documents.json is folded into a first snapshot.
+        """
+        manifest_path = self._path(self.MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self.generation = manifest['generation']
+            self._keys = {(symbol, source): row for symbol, source, row in manifest['keys']}
+        elif os.path.exists(self._path(self.LEGACY_DOCUMENTS)):
+            self._migrate_legacy()
+
+        documents = DocumentTable(_decode_row)
+        if self.generation:
+            documents.attach(self._snapshot_path(self.generation), np.load(self._offsets_path(self.generation)))
+        self.snapshot_rows = len(documents)
+        keys = dict(self._keys)
+
+        # WAL files left by snapshots that did not commit are replayed too, in order
+        self.wal_generation = max([self.generation] + self._wal_generations())
+        self.wal_rows = 0
+        for generation in self._wal_generations():
+            for record in self._read_wal(generation):
+                # Replayed rows share the record the vector store loaded for the same document
+                document = shared_records.record(record['document'])
+                row, replaces = place(keys, document, record['upsert'], len(documents))
+                if replaces:
+                    documents[row] = document
+                else:
+                    documents.append(document)
+                self.wal_rows += 1
+        self._remove_stale()
+        logger.info(f"📂 Loaded {len(documents)} pipeline documents "
+                    f"({self.snapshot_rows} from snapshot {self.generation}, {self.wal_rows} replayed from WAL)")
+        return documents, keys
+
+    def _read_wal(self, generation: int) -> List[Dict[str, Any]]:
+        """Records of a WAL file, ignoring and truncating a torn trailing line"""
+        path = self._wal_path(generation)
+        if not os.path.exists(path):
+            return []
+        records = []
+        size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                records.append(json.loads(line))
+                size += len(line)
+        if size != os.path.getsize(path):
+            logger.warning(f"⚠️ Truncating torn pipeline WAL tail to {len(records)} records")
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+        return records
+
+    def _migrate_legacy(self):
+        """Turn processed_documents.json into snapshot 1 and remove it"""
+        legacy_path = self._path(self.LEGACY_DOCUMENTS)
+        with open(legacy_path, 'rb') as f:
+            # Older files carry the full embedding; it already lives in the vector store
+            lines = [dump_record(strip_embedding(json.loads(line))).encode() for line in f if line.strip()]
+        logger.info(f"📦 Migrating {len(lines)} documents from {self.LEGACY_DOCUMENTS}")
+        lengths = np.array([len(line) for line in lines], dtype=np.int64)
+        self._write_snapshot(1, lambda f: f.writelines(lines), lengths, {})
+        self.generation = 1
+        os.remove(legacy_path)
+
+    def append(self, documents: List[Dict[str, Any]], upsert: bool = False):
+        """Log a batch of added or upserted documents in one fsynced write, starting
+        a snapshot in the background once the WAL is due"""
+        lines = "".join(dump_record({"upsert": upsert, "document": document}) for document in documents)
+        with self._lock:
+            with open(self._wal_path(self.wal_generation), 'a') as f:
+                f.write(lines)
+                fsync_file(f)
+            self.wal_rows += len(documents)
+        if self.needs_snapshot():
+            self.snapshot()
+
+    def needs_snapshot(self) -> bool:
+        """Snapshot once the WAL is large relative to the snapshot, which keeps the
+        amortized snapshot cost per document constant"""
+        return self.wal_rows >= max(self.min_snapshot_rows, self.snapshot_ratio * self.snapshot_rows)
+
+    def snapshot(self, wait: bool = False):
+        """Retire the current WAL file and fold it into a new snapshot on a
+        background thread; appends continue in the next WAL file meanwhile"""
+        with self._lock:
+            if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+                thread = self._snapshot_thread
+            else:
+                base, target = self.generation, self.wal_generation + 1
+                self.wal_generation = target
+                thread = self._snapshot_thread = threading.Thread(
+                    target=self._fold, args=(base, target), name="pipeline-snapshot", daemon=True)
+                thread.start()
+        if wait:
+            thread.join()
+
+    def _fold(self, base: int, target: int):
+        """Write snapshot ``target`` from snapshot ``base`` and WAL files base..target-1"""
+        try:
+            keys = dict(self._keys)
+            buffer, offsets = b"", np.zeros(1, dtype=np.int64)
+            if base and os.path.getsize(self._snapshot_path(base)):
+                with open(self._snapshot_path(base), 'rb') as f:
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                offsets = np.load(self._offsets_path(base))
+            base_rows = len(offsets) - 1
+            replaced = {}  # base row -> new line
+            appended = []
+            folded = 0
+            for generation in range(base, target):
+                for record in self._read_wal(generation):
+                    line = dump_record(record['document']).encode()
+                    row, replaces = place(keys, record['document'], record['upsert'], base_rows + len(appended))
+                    if not replaces:
+                        appended.append(line)
+                    elif row < base_rows:
+                        replaced[row] = line
+                    else:
+                        appended[row - base_rows] = line
+                    folded += 1
+
+            def write(f):
+                # Unchanged runs of the previous snapshot are copied as raw bytes
+                start = 0
+                for row in sorted(replaced):
+                    f.write(buffer[offsets[start]:offsets[row]])
+                    f.write(replaced[row])
+                    start = row + 1
+                f.write(buffer[offsets[start]:offsets[base_rows]])
+                f.writelines(appended)
+
+            lengths = np.concatenate([np.diff(offsets), [len(line) for line in appended]]).astype(np.int64)
+            for row, line in replaced.items():
+                lengths[row] = len(line)
+            try:
+                self._write_snapshot(target, write, lengths, keys)
+            finally:
+                if isinstance(buffer, mmap.mmap):
+                    buffer.close()
+
+            with self._lock:
+                self.generation = target
+                self._keys = keys
+                self.snapshot_rows = len(lengths)
+                self.wal_rows -= folded
+                self.snapshots += 1
+            for generation in range(base, target):
+                self._remove(self._wal_path(generation))
+            if base:
+                self._remove(self._snapshot_path(base))
+                self._remove(self._offsets_path(base))
+            logger.info(f"🗜️ Wrote pipeline snapshot {target} ({len(lengths)} documents, {folded} from WAL)")
+        except Exception as e:
+            logger.error(f"❌ Pipeline snapshot failed: {e}")
+
+    def _write_snapshot(self, generation: int, writer, lengths: np.ndarray, keys: Dict[Tuple, int]):
+        """Write snapshot records and line offsets, then switch the manifest to them"""
+        write_atomic(self._snapshot_path(generation), writer)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        write_atomic(self._offsets_path(generation), lambda f: np.save(f, offsets))
+        manifest = {"generation": generation, "keys": [[symbol, source, row] for (symbol, source), row in keys.items()]}
+        write_atomic(self._path(self.MANIFEST), lambda f: f.write(json.dumps(manifest).encode()))
+
+    def _files(self) -> List[Tuple[int, str]]:
+        """(generation, name) of every pipeline.<generation>.* file"""
+        files = []
+        for name in os.listdir(self.data_dir):
+            parts = name.split('.')
+            if parts[0] == 'pipeline' and len(parts) > 2 and parts[1].isdigit():
+                files.append((int(parts[1]), name))
+        return files
+
+    def _wal_generations(self) -> List[int]:
+        """WAL files written since the snapshot, oldest first"""
+        return sorted(generation for generation, name in self._files()
+                      if name.endswith('.wal') and generation >= self.generation)
+
+    def _remove_stale(self):
+        """Drop superseded snapshots and WAL files, and snapshots that never committed"""
+        for generation, name in self._files():
+            wal = name.endswith('.wal')
+            if (generation < self.generation or name.endswith('.tmp')
+                    or (generation > self.generation and not wal)):
+                self._remove(self._path(name))
+
+    def _remove(self, path: str):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def close(self):
+        """Wait for a running snapshot"""
+        thread = self._snapshot_thread
+        if thread is not None:
+            thread.join()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "snapshot_rows": self.snapshot_rows,
+            "wal_rows": self.wal_rows,
+            "snapshots": self.snapshots
+        }
@@ -0,0 +1,121 @@
+"""
+Compact Document Records Shared by the Pipeline and the Vector Store
+"""
+
+import sys
+import threading
+import weakref
+from collections.abc import Mapping
+from typing import Dict, Any, Iterator, Optional
+
+_ABSENT = object()
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class DocumentRecord(Mapping):
+    """Read-only document with its content and common metadata in slots.
+
+    Behaves like the ``{"content": ..., "metadata": {...}}`` dict it was built
+    from (``metadata`` is assembled on access), but takes a fraction of the
+    memory of two nested dicts. Source, symbol and timestamp strings, which
+    repeat across documents, are interned so every record shares one copy.
+    Metadata keys beyond the common ones (``parent_id``, ``chunk``, ...) and
+    extra top-level keys are kept in small dicts, and never the embedding.
+    """
+
+    __slots__ = ('content', 'source', 'symbol', 'timestamp', 'id', 'extra', 'fields', '__weakref__')
+
+    def __init__(self, document: Dict[str, Any]):
+        metadata = dict(document.get('metadata') or {})
+        self.content = document.get('content', _ABSENT)
+        self.source = _intern(metadata.pop('source', _ABSENT))
+        self.symbol = _intern(metadata.pop('symbol', _ABSENT))
+        self.timestamp = _intern(metadata.pop('timestamp', _ABSENT))
+        self.id = metadata.pop('id', _ABSENT)
+        self.extra = metadata or None
+        fields = {key: value for key, value in document.items()
+                  if key not in ('content', 'metadata', 'embedding')}
+        self.fields = fields or None
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        metadata = {key: value for key, value in (('source', self.source), ('symbol', self.symbol),
+                                                  ('timestamp', self.timestamp), ('id', self.id))
+                    if value is not _ABSENT}
+        if self.extra:
+            metadata.update(self.extra)
+        return metadata
+
+    def __getitem__(self, key: str):
+        if key == 'content' and self.content is not _ABSENT:
+            return self.content
+        if key == 'metadata':
+            return self.metadata
+        if self.fields and key in self.fields:
+            return self.fields[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.content is not _ABSENT:
+            yield 'content'
+        yield 'metadata'
+        if self.fields:
+            yield from self.fields
+
+    def __len__(self) -> int:
+        return (self.content is not _ABSENT) + 1 + len(self.fields or ())
+
+    def __repr__(self) -> str:
+        return f"DocumentRecord({dict(self)!r})"
+
+    def matches(self, document: Dict[str, Any]) -> bool:
+        """Whether the record holds the content, metadata and fields of a document dict"""
+        fields = {key: value for key, value in document.items()
+                  if key not in ('content', 'metadata', 'embedding')}
+        return (self.content == document.get('content', _ABSENT)
+                and self.metadata == (document.get('metadata') or {})
+                and (self.fields or {}) == fields)
+
+class DocumentRecords:
+    """Registry handing out one shared DocumentRecord per document id.
+
+    The pipeline and the vector store both store the record returned by
+    ``record``, so a document ingested through the pipeline is held once no
+    matter how many layers reference it. Records are tracked weakly and
+    disappear once no layer holds them anymore; documents without an id
+    always get a record of their own. A document whose content or metadata
+    differs from the registered record replaces it with a new record, so an
+    id reused with new metadata is never indexed under the old one.
+    """
+
+    def __init__(self):
+        self._records = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def record(self, document: Dict[str, Any]) -> DocumentRecord:
+        """Shared compact record for a document dict (an embedding is dropped)"""
+        if isinstance(document, DocumentRecord):
+            return document
+        doc_id = (document.get('metadata') or {}).get('id')
+        if doc_id is None:
+            return DocumentRecord(document)
+        with self._lock:
+            record = self._records.get(doc_id)
+            if record is None or not record.matches(document):
+                record = self._records[doc_id] = DocumentRecord(document)
+            return record
+
+    def find(self, document: Dict[str, Any]) -> Optional[DocumentRecord]:
+        """The live shared record equal to a document dict, without registering one"""
+        doc_id = (document.get('metadata') or {}).get('id')
+        record = self._records.get(doc_id) if doc_id is not None else None
+        if record is not None and record.matches(document):
+            return record
+        return None
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+# Default registry, shared by every pipeline and vector store in the process
+shared_records = DocumentRecords()
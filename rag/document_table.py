@@ -0,0 +1,116 @@
+"""
+Lazily Loaded Document Table Addressed by Row Id
+"""
+
+import json
+import logging
+import mmap
+import os
+import numpy as np
+from typing import List, Dict, Any, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+def line_offsets(buffer) -> np.ndarray:
+    """Byte offsets delimiting each complete line: row i spans [offsets[i], offsets[i + 1])"""
+    newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == ord("\n"))
+    return np.concatenate([[0], newlines + 1]).astype(np.int64)
+
+class DocumentTable:
+    """Document records served from memory-mapped JSON-lines segments.
+
+    Opening a segment maps the file and its line offsets without parsing it;
+    a record is decoded only when its row is read. Documents added after
+    startup are kept in memory as a tail behind the mapped segments, and
+    mapped rows that are replaced are shadowed by their in-memory record.
+    ``decode`` turns a mapped line into the record returned for its row.
+    """
+
+    SCAN_BLOCK_ROWS = 65536
+
+    def __init__(self, decode: Callable[[bytes], Dict[str, Any]] = json.loads):
+        self.decode = decode
+        self._segments = []  # (mmap, offsets) per attached file
+        self._segment_ends = []  # cumulative row count after each segment
+        self._mapped_rows = 0
+        self._tail = []
+        self._overrides = {}  # mapped row -> replacement record
+
+    def attach(self, path: str, offsets: Optional[np.ndarray] = None):
+        """Map a JSON-lines file as the next segment of rows"""
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if offsets is None:
+            offsets = line_offsets(buffer)
+        rows = len(offsets) - 1
+        if rows <= 0:
+            return
+        self._segments.append((buffer, offsets))
+        self._mapped_rows += rows
+        self._segment_ends.append(self._mapped_rows)
+
+    def __len__(self) -> int:
+        return self._mapped_rows + len(self._tail)
+
+    def _check_row(self, row: int) -> int:
+        if row < 0:
+            row += len(self)
+        if row < 0 or row >= len(self):
+            raise IndexError("document row out of range")
+        return row
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = self._check_row(row)
+        if row >= self._mapped_rows:
+            return self._tail[row - self._mapped_rows]
+        if row in self._overrides:
+            return self._overrides[row]
+
+        segment = int(np.searchsorted(self._segment_ends, row, side='right'))
+        start_row = self._segment_ends[segment - 1] if segment else 0
+        buffer, offsets = self._segments[segment]
+        local = row - start_row
+        return self.decode(buffer[offsets[local]:offsets[local + 1]])
+
+    def __setitem__(self, row: int, document: Dict[str, Any]):
+        row = self._check_row(row)
+        if row >= self._mapped_rows:
+            self._tail[row - self._mapped_rows] = document
+        else:
+            self._overrides[row] = document
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        # Sequential scans split mapped segments in blocks of lines instead of
+        # locating every row on its own
+        row = 0
+        for buffer, offsets in self._segments:
+            rows = len(offsets) - 1
+            for start in range(0, rows, self.SCAN_BLOCK_ROWS):
+                end = min(start + self.SCAN_BLOCK_ROWS, rows)
+                lines = buffer[offsets[start]:offsets[end]].split(b"\n")
+                for line in lines[:end - start]:
+                    yield self._overrides[row] if row in self._overrides else self.decode(line)
+                    row += 1
+        yield from self._tail
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def append(self, document: Dict[str, Any]):
+        self._tail.append(document)
+
+    def extend(self, documents):
+        self._tail.extend(documents)
+
+    def clear(self):
+        for buffer, _ in self._segments:
+            buffer.close()
+        self._segments = []
+        self._segment_ends = []
+        self._mapped_rows = 0
+        self._tail = []
+        self._overrides = {}
@@ -0,0 +1,124 @@
+"""
+Micro-Batching Embedder that Coalesces Concurrent embed() Calls
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+from typing import List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+class BatchingEmbedder:
+    """Drop-in wrapper around an Embedder that turns concurrent single-text
+    requests into batched calls.
+
+    Callers enqueue their text and wait on a future. A background thread
+    takes the first waiting request, keeps collecting for up to
+    ``max_wait_ms`` or until ``max_batch_size`` texts are queued, embeds them
+    all with one ``embed_batch`` call and resolves every future. A lone
+    caller pays at most the wait window; under concurrent ingest and query
+    load, one round trip or forward pass serves the whole batch.
+    """
+
+    def __init__(self, embedder, max_batch_size: int = None, max_wait_ms: float = None):
+        self.embedder = embedder
+        if max_batch_size is None:
+            max_batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+        self.max_batch_size = max(1, max_batch_size)
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', '5'))
+        self.max_wait = max_wait_ms / 1000.0
+        self._requests = queue.Queue()
+        self._stop = threading.Event()
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        # dimension, embedder_type, cache, ... of the wrapped embedder
+        if name == 'embedder':
+            raise AttributeError(name)
+        return getattr(self.embedder, name)
+
+    def submit(self, text: str) -> Future:
+        """Queue one text and return a future resolving to its embedding"""
+        if self._stop.is_set():
+            raise RuntimeError("Embedding batcher is closed")
+        future = Future()
+        self._requests.put((text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        """Generate embedding for text, batched with concurrent callers"""
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> np.ndarray:
+        """Await an embedding without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Callers that already have a batch go straight to the embedder"""
+        return self.embedder.embed_batch(texts)
+
+    async def aembed_batch(self, texts: List[str]) -> np.ndarray:
+        return await self.embedder.aembed_batch(texts)
+
+    def _collect(self) -> List:
+        """Block for the first request, then gather more until the window closes or the batch is full"""
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._requests.get(timeout=remaining) if remaining > 0
+                             else self._requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        closing = False
+        while not closing:
+            batch = self._collect()
+            # close() enqueues a (None, None) marker behind every request submitted before it
+            closing = any(future is None for _, future in batch)
+            batch = [(text, future) for text, future in batch
+                     if future is not None and future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeddings = self.embedder.embed_batch([text for text, _ in batch])
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                logger.error(f"❌ Batched embedding failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.requests += len(batch)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Embedder statistics plus batching counters"""
+        stats = self.embedder.get_stats()
+        stats["batching"] = {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "queued": self._requests.qsize()
+        }
+        return stats
+
+    def close(self):
+        """Stop the batching thread once the queued requests are served"""
+        self._stop.set()
+        self._requests.put((None, None))
+        self._thread.join()
@@ -0,0 +1,171 @@
+"""
+Content-Hash Embedding Cache with In-Memory LRU and SQLite Tiers
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Embeddings keyed by (provider, model, sha256(text)).
+
+    Lookups go to a bounded in-memory LRU first and then to an optional
+    SQLite file, where vectors are stored as raw float32 blobs; disk hits are
+    promoted into memory. Only embeddings produced by a real provider should
+    be stored, never fallbacks.
+    """
+
+    def __init__(self, provider: str, model: str, max_entries: int = None, path: str = None):
+        self.provider = provider
+        self.model = model
+        if max_entries is None:
+            max_entries = int(os.getenv('EMBEDDING_CACHE_SIZE', '10000'))
+        self.max_entries = max_entries
+        if path is None:
+            path = os.getenv('EMBEDDING_CACHE_PATH', './data/embedding_cache.sqlite')
+        self.path = path or None  # An empty path keeps the cache in memory only
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.setup_disk()
+
+    def setup_disk(self):
+        """Open or create the on-disk tier"""
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "provider TEXT NOT NULL, model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (provider, model, text_hash))")
+            self._db.commit()
+        except Exception as e:
+            logger.error(f"❌ Embedding cache disk tier unavailable: {e}")
+            self._db = None
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode('utf-8')).digest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Cached embedding for text, or None"""
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached read-only float32 embeddings in input order, None where missing"""
+        hashes = [self.text_hash(text) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(hashes):
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(i)
+                else:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+            self.hits += len(texts) - len(missing)
+
+            if missing and self._db is not None:
+                found = self._read_disk([hashes[i] for i in missing])
+                still_missing = []
+                for i in missing:
+                    vector = found.get(hashes[i])
+                    if vector is None:
+                        still_missing.append(i)
+                    else:
+                        self._remember(hashes[i], vector)
+                        results[i] = vector
+                self.disk_hits += len(missing) - len(still_missing)
+                missing = still_missing
+            self.misses += len(missing)
+        return results
+
+    def put(self, text: str, embedding: np.ndarray):
+        self.put_many([text], [embedding])
+
+    def put_many(self, texts: List[str], embeddings):
+        """Store embeddings (rows of a matrix or a list of vectors) in both tiers"""
+        hashes = [self.text_hash(text) for text in texts]
+        embeddings = [self._frozen(embedding) for embedding in embeddings]
+        with self._lock:
+            for key, embedding in zip(hashes, embeddings):
+                self._remember(key, embedding)
+            if self._db is not None:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                        [(self.provider, self.model, key, embedding.tobytes())
+                         for key, embedding in zip(hashes, embeddings)])
+                    self._db.commit()
+                except Exception as e:
+                    logger.error(f"❌ Embedding cache write failed: {e}")
+
+    @staticmethod
+    def _frozen(embedding) -> np.ndarray:
+        """Private read-only float32 copy, so callers cannot alter cached vectors"""
+        embedding = np.array(embedding, dtype='float32')
+        embedding.setflags(write=False)
+        return embedding
+
+    def _remember(self, key: bytes, embedding: np.ndarray):
+        """Insert into the LRU, evicting the least recently used entries; caller holds the lock"""
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        found = {}
+        try:
+            # Stay well below SQLite's bound parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = self._db.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE provider = ? AND model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [self.provider, self.model, *chunk]).fetchall()
+                for key, blob in rows:
+                    found[bytes(key)] = np.frombuffer(blob, dtype='float32')
+        except Exception as e:
+            logger.error(f"❌ Embedding cache read failed: {e}")
+        return found
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "path": self.path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+        }
+
+    def clear(self):
+        """Drop every cached embedding of this provider and model"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings WHERE provider = ? AND model = ?",
+                                 (self.provider, self.model))
+                self._db.commit()
@@ -0,0 +1,101 @@
+"""
+Multi-Process Embedding Pool with Shared-Memory Results
+"""
+
+import logging
+import math
+import os
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+from typing import List, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+_worker_model = None
+
+def load_sentence_transformer(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+def _init_worker(model_factory: Callable):
+    """Load one model replica per worker process"""
+    global _worker_model
+    _worker_model = model_factory()
+
+def _encode_into(shm_name: str, start: int, dimension: int, texts: List[str]) -> int:
+    """Encode texts and write their vectors into rows [start, start + len(texts)) of the shared block"""
+    embeddings = np.asarray(_worker_model.encode(texts), dtype='float32')
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray((start + len(texts), dimension), dtype='float32', buffer=shm.buf)
+        out[start:] = embeddings
+        del out
+    finally:
+        shm.close()
+    return len(texts)
+
+class EmbeddingPool:
+    """Model replicas in separate processes behind a SentenceTransformer-like ``encode``.
+
+    Large batches are split into one shard per worker; each worker writes
+    its vectors straight into a shared-memory block allocated by the caller,
+    so results cross the process boundary without pickling. Inference runs
+    outside the API process, free of its GIL, and throughput scales with the
+    number of workers up to the core count.
+    """
+
+    def __init__(self, model_name: str, dimension: int, workers: int = None, min_chunk: int = None,
+                 model_factory: Callable = None):
+        self.model_name = model_name
+        self.dimension = dimension
+        if workers is None:
+            workers = int(os.getenv('EMBEDDING_WORKERS', str(os.cpu_count() or 1)))
+        self.workers = max(1, workers)
+        # Batches are not split below this many texts per shard
+        if min_chunk is None:
+            min_chunk = int(os.getenv('EMBEDDING_POOL_MIN_CHUNK', '16'))
+        self.min_chunk = max(1, min_chunk)
+        if model_factory is None:
+            model_factory = partial(load_sentence_transformer, model_name)
+        # Spawned workers do not inherit the parent's threads or FAISS state
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(model_factory,))
+        self.batches = 0
+        self.texts = 0
+        logger.info(f"✅ Started embedding pool with {self.workers} {model_name} workers")
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Float32 embeddings for texts, one row per text, computed across the workers"""
+        if not texts:
+            return np.empty((0, self.dimension), dtype='float32')
+        chunk = max(self.min_chunk, math.ceil(len(texts) / self.workers))
+        shm = shared_memory.SharedMemory(create=True, size=len(texts) * self.dimension * 4)
+        try:
+            futures = [self.executor.submit(_encode_into, shm.name, start, self.dimension,
+                                            texts[start:start + chunk])
+                       for start in range(0, len(texts), chunk)]
+            for future in futures:
+                future.result()
+            embeddings = np.ndarray((len(texts), self.dimension), dtype='float32', buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        self.batches += 1
+        self.texts += len(texts)
+        return embeddings
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "min_chunk": self.min_chunk,
+            "batches": self.batches,
+            "texts": self.texts
+        }
+
+    def close(self):
+        """Stop the worker processes"""
+        self.executor.shutdown(wait=True)
@@ -1,15 +1,25 @@
 """
-Embedding Service with OpenAI and Local Fallback
+Embedding Service with OpenAI, Local Models and a Feature-Hashing Fallback
 """
 
 import os
+import asyncio
 import logging
+import weakref
 import numpy as np
-from typing import List
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+from openai import OpenAI, AsyncOpenAI
+from .chunking import TextChunker, pack_batches
+from .embedding_cache import EmbeddingCache
+from .hashing_embedder import HashingEmbedder, is_fallback, mark_fallback
 
 logger = logging.getLogger(__name__)
 
+def as_matrix(embeddings) -> np.ndarray:
+    """C-contiguous float32 matrix, without copying when the input already is one"""
+    return np.ascontiguousarray(embeddings, dtype='float32')
+
 class Embedder:
     """Unified embedding service with multiple providers"""
     
@@ -18,87 +28,222 @@ class Embedder:
         self.dimension = int(os.getenv('VECTOR_DIMENSION', 
                                      '1536' if self.embedder_type == 'openai' else '384'))
         
-        if self.embedder_type == 'openai':
+        self.model = None
+        # Bounds in-flight async embedding calls per event loop
+        self.max_concurrency = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '4'))
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._executor = None
+        # Deterministic offline embeddings, also used whenever a provider fails
+        self.hashing = HashingEmbedder(self.dimension)
+        if self.embedder_type == 'hashing':
+            self.model_name = f"feature-hashing-{self.dimension}"
+            logger.info("✅ Using feature-hashing embeddings")
+        elif self.embedder_type == 'openai':
             self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+            self.async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+            self.model_name = "text-embedding-ada-002"
+            # Provider limits: tokens per input, and inputs and tokens per request
+            self.max_input_tokens = int(os.getenv('EMBEDDING_MAX_INPUT_TOKENS', '8191'))
+            self.max_batch_items = int(os.getenv('EMBEDDING_MAX_BATCH_ITEMS', '2048'))
+            self.max_batch_tokens = int(os.getenv('EMBEDDING_MAX_BATCH_TOKENS', '300000'))
+            self.chunker = TextChunker()
             logger.info("✅ Using OpenAI embeddings")
         else:
+            self.model_name = 'all-MiniLM-L6-v2'
+            # With more than one worker, model replicas run in separate processes
+            workers = int(os.getenv('EMBEDDING_WORKERS', '0'))
             try:
                 from sentence_transformers import SentenceTransformer
-                self.model = SentenceTransformer('all-MiniLM-L6-v2')
+                if workers > 1:
+                    from .embedding_pool import EmbeddingPool
+                    self.model = EmbeddingPool(self.model_name, self.dimension, workers)
+                else:
+                    self.model = SentenceTransformer(self.model_name)
                 logger.info("✅ Using local sentence-transformers embeddings")
             except ImportError:
-                logger.warning("❌ sentence-transformers not available, falling back to random embeddings")
-                self.model = None
+                logger.warning("❌ sentence-transformers not available, falling back to feature-hashing embeddings")
+            # Local inference runs off the event loop on a small dedicated pool
+            self._executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('EMBEDDING_EXECUTOR_WORKERS', '1')),
+                thread_name_prefix="embedding")
+        
+        # Identical text is embedded once; fallback embeddings are never cached
+        self.cache = None
+        if os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true' and (
+                self.embedder_type == 'openai' or self.model is not None):
+            self.cache = EmbeddingCache(self.embedder_type, self.model_name)
     
-    def embed(self, text: str) -> List[float]:
-        """Generate embedding for text"""
+    def embed(self, text: str) -> np.ndarray:
+        """Generate a float32 embedding for text"""
+        if self.cache is not None:
+            cached = self.cache.get(text)
+            if cached is not None:
+                return cached
         try:
             if self.embedder_type == 'openai':
-                return self._openai_embed(text)
+                embedding = self._openai_embed(text)
             else:
-                return self._local_embed(text)
+                embedding = self._local_embed(text)
+            if self.cache is not None:
+                self.cache.put(text, embedding)
+            return embedding
         except Exception as e:
-            logger.error(f"❌ Embedding failed: {e}")
-            # Return random embedding as fallback
-            return list(np.random.normal(0, 0.1, self.dimension))
+            logger.error(f"❌ Embedding failed, using feature-hashing fallback: {e}")
+            return mark_fallback(self._fallback_embed_batch([text]))[0]
     
-    def _openai_embed(self, text: str) -> List[float]:
+    def _openai_embed(self, text: str) -> np.ndarray:
         """Generate embedding using OpenAI"""
         try:
             response = self.client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
+                model=self.model_name,
+                input=self._request_batches([text])[0]
             )
-            return response.data[0].embedding
+            # The JSON response is the only place vectors arrive as lists
+            return np.asarray(response.data[0].embedding, dtype='float32')
         except Exception as e:
             logger.error(f"❌ OpenAI embedding failed: {e}")
             raise
     
-    def _local_embed(self, text: str) -> List[float]:
+    def _local_embed(self, text: str) -> np.ndarray:
         """Generate embedding using local model"""
         if self.model is None:
-            # Fallback to random embeddings
-            return list(np.random.normal(0, 0.1, self.dimension))
+            return self._fallback_embed_batch([text])[0]
         
         try:
-            embedding = self.model.encode([text])[0]
-            return embedding.tolist()
+            return as_matrix(self.model.encode([text]))[0]
         except Exception as e:
             logger.error(f"❌ Local embedding failed: {e}")
-            # Fallback to random
-            return list(np.random.normal(0, 0.1, self.dimension))
+            raise
+    
+    async def aembed(self, text: str) -> np.ndarray:
+        """Generate embedding for text without blocking the event loop"""
+        return (await self.aembed_batch([text]))[0]
+    
+    async def aembed_batch(self, texts: List[str]) -> np.ndarray:
+        """Async embed_batch: OpenAI through the async client, local models on
+        the bounded executor, at most ``max_concurrency`` calls in flight"""
+        if self.cache is None:
+            return await self._aembed_batch_uncached(texts)
+        
+        embeddings = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        computed = await self._aembed_batch_uncached(missing, cache=True) if missing else None
+        return self._merge_cached(texts, embeddings, missing, computed)
     
-    def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
+    async def _aembed_batch_uncached(self, texts: List[str], cache: bool = False) -> np.ndarray:
+        try:
+            async with self._semaphore():
+                if self.embedder_type == 'openai':
+                    embeddings = []
+                    for batch in self._request_batches(texts):
+                        response = await self.async_client.embeddings.create(model=self.model_name, input=batch)
+                        embeddings.extend(item.embedding for item in response.data)
+                    embeddings = as_matrix(embeddings)
+                elif self.model is None:
+                    # Feature hashing takes microseconds, no need to leave the loop
+                    embeddings = self._fallback_embed_batch(texts)
+                else:
+                    embeddings = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, self._local_embed_batch, texts)
+            if cache:
+                self.cache.put_many(texts, embeddings)
+            return embeddings
+        except Exception as e:
+            logger.error(f"❌ Async embedding failed, using feature-hashing fallback: {e}")
+            return mark_fallback(self._fallback_embed_batch(texts))
+    
+    def _semaphore(self) -> asyncio.Semaphore:
+        """Concurrency limit for the running event loop; semaphores cannot be shared across loops"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+    
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Generate a float32 matrix of embeddings, one row per text, embedding
+        only distinct uncached texts"""
+        if self.cache is None:
+            return self._embed_batch_uncached(texts)
+        
+        embeddings = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        computed = self._embed_batch_uncached(missing, cache=True) if missing else None
+        return self._merge_cached(texts, embeddings, missing, computed)
+    
+    def _merge_cached(self, texts: List[str], cached: List, missing: List[str], computed: np.ndarray) -> np.ndarray:
+        """Batch matrix from cached rows and the rows computed for the missing texts"""
+        if not missing:
+            return as_matrix(cached) if cached else np.empty((0, self.dimension), dtype='float32')
+        if len(missing) == len(texts):
+            return computed
+        rows = dict(zip(missing, computed))
+        merged = np.stack([rows[text] if embedding is None else embedding
+                           for text, embedding in zip(texts, cached)])
+        return mark_fallback(merged) if is_fallback(computed) else merged
+    
+    def _embed_batch_uncached(self, texts: List[str], cache: bool = False) -> np.ndarray:
         try:
             if self.embedder_type == 'openai':
-                return self._openai_embed_batch(texts)
+                embeddings = self._openai_embed_batch(texts)
             else:
-                return self._local_embed_batch(texts)
+                embeddings = self._local_embed_batch(texts)
+            if cache:
+                self.cache.put_many(texts, embeddings)
+            return embeddings
         except Exception as e:
-            logger.error(f"❌ Batch embedding failed: {e}")
-            return [list(np.random.normal(0, 0.1, self.dimension)) for _ in texts]
+            logger.error(f"❌ Batch embedding failed, using feature-hashing fallback: {e}")
+            return mark_fallback(self._fallback_embed_batch(texts))
     
-    def _openai_embed_batch(self, texts: List[str]) -> List[List[float]]:
+    def _openai_embed_batch(self, texts: List[str]) -> np.ndarray:
         """Generate batch embeddings using OpenAI"""
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=texts
-            )
-            return [item.embedding for item in response.data]
+            embeddings = []
+            for batch in self._request_batches(texts):
+                response = self.client.embeddings.create(
+                    model=self.model_name,
+                    input=batch
+                )
+                embeddings.extend(item.embedding for item in response.data)
+            return as_matrix(embeddings)
         except Exception as e:
             logger.error(f"❌ OpenAI batch embedding failed: {e}")
             raise
     
-    def _local_embed_batch(self, texts: List[str]) -> List[List[float]]:
+    def _request_batches(self, texts: List[str]) -> List[List[str]]:
+        """Texts packed into as few OpenAI requests as the provider limits allow,
+        each text truncated to the per-input token limit instead of failing"""
+        counts = [self.chunker.count(text) for text in texts]
+        truncated = sum(count > self.max_input_tokens for count in counts)
+        if truncated:
+            logger.warning(f"⚠️ Truncating {truncated} embedding inputs to {self.max_input_tokens} tokens")
+        texts = [self.chunker.truncate(text, self.max_input_tokens) if count > self.max_input_tokens else text
+                 for text, count in zip(texts, counts)]
+        counts = [min(count, self.max_input_tokens) for count in counts]
+        return [texts[batch] for batch in pack_batches(counts, self.max_batch_items, self.max_batch_tokens)]
+    
+    def _local_embed_batch(self, texts: List[str]) -> np.ndarray:
         """Generate batch embeddings using local model"""
         if self.model is None:
-            return [list(np.random.normal(0, 0.1, self.dimension)) for _ in texts]
+            return self._fallback_embed_batch(texts)
         
         try:
-            embeddings = self.model.encode(texts)
-            return [embedding.tolist() for embedding in embeddings]
+            return as_matrix(self.model.encode(texts))
         except Exception as e:
             logger.error(f"❌ Local batch embedding failed: {e}")
-            return [list(np.random.normal(0, 0.1, self.dimension)) for _ in texts]
\ No newline at end of file
+            raise
+    
+    def _fallback_embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Feature-hashing embeddings, used without a local model or when a provider fails"""
+        return self.hashing.embed_batch(texts)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Embedder settings and cache hit/miss statistics"""
+        return {
+            "type": self.embedder_type,
+            "model": self.model_name,
+            "dimension": self.dimension,
+            "max_concurrency": self.max_concurrency,
+            "pool": self.model.get_stats() if hasattr(self.model, 'get_stats') else None,
+            "cache": self.cache.get_stats() if self.cache is not None else None
+        }
@@ -0,0 +1,83 @@
+"""
+Deterministic Feature-Hashing Embedder for Offline Use
+"""
+
+import re
+import zlib
+import numpy as np
+from functools import lru_cache
+from typing import List, Tuple
+
+_WORD = re.compile(r"[a-z0-9$%.-]*[a-z0-9]")
+
+class HashingEmbedder:
+    """Feature-hashing text embedder with no model and no network.
+
+    Each text becomes a bag of word unigrams, word bigrams and character
+    n-grams of every word, hashed with CRC32 into ``dimension`` signed
+    buckets (the sign keeps collisions from always adding up) and
+    L2-normalized. Vectors are identical across processes and runs, texts
+    sharing words or word fragments get high cosine similarity, and the
+    per-word hashes are memoized, so a typical document embeds in tens of
+    microseconds.
+    """
+
+    def __init__(self, dimension: int = 384, char_ngrams: Tuple[int, ...] = (3, 4)):
+        self.dimension = dimension
+        self.char_ngrams = char_ngrams
+        self._word_features = lru_cache(maxsize=65536)(self._hash_word)
+
+    def _signed(self, hashes: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Bucket and signed weight per hash; the top hash bit picks the sign"""
+        return (hashes % self.dimension).astype(np.int64), np.where(hashes >> 31, -weights, weights)
+
+    def _hash_word(self, word: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Buckets and weights of the word itself and its character n-grams"""
+        padded = f"<{word}>"
+        ngrams = [f"#{padded[i:i + n]}" for n in self.char_ngrams for i in range(len(padded) - n + 1)]
+        hashes = np.array([zlib.crc32(feature.encode('utf-8')) for feature in [word] + ngrams], dtype=np.uint32)
+        # The n-grams of a word together weigh as much as the whole word
+        weights = np.full(len(hashes), 1.0 / max(len(ngrams), 1), dtype='float32')
+        weights[0] = 1.0
+        return self._signed(hashes, weights)
+
+    def _features(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Buckets and signed weights of every feature of a text"""
+        words = _WORD.findall(text.lower())
+        bigrams = np.array([zlib.crc32(f"{a} {b}".encode('utf-8')) for a, b in zip(words, words[1:])],
+                           dtype=np.uint32)
+        features = [self._word_features(word) for word in words]
+        features.append(self._signed(bigrams, np.ones(len(bigrams), dtype='float32')))
+        return (np.concatenate([buckets for buckets, _ in features]),
+                np.concatenate([values for _, values in features]))
+
+    def embed(self, text: str) -> np.ndarray:
+        """Normalized float32 vector for one text"""
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Normalized float32 matrix, one row per text; also available as ``encode``,
+        so it can stand in for a SentenceTransformer model"""
+        matrix = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            buckets, values = self._features(text)
+            matrix[row] = np.bincount(buckets, weights=values, minlength=self.dimension)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    encode = embed_batch
+
+class FallbackEmbeddings(np.ndarray):
+    """Float32 embeddings computed by feature hashing because the configured
+    provider failed. Rows taken from them keep the type, so caches can tell
+    them apart and skip them until the provider recovers."""
+
+def mark_fallback(embeddings) -> FallbackEmbeddings:
+    return np.asarray(embeddings, dtype='float32').view(FallbackEmbeddings)
+
+def is_fallback(embeddings) -> bool:
+    """Whether embeddings, or any row of a list of them, came from a provider fallback"""
+    if isinstance(embeddings, FallbackEmbeddings):
+        return True
+    return isinstance(embeddings, (list, tuple)) and any(isinstance(e, FallbackEmbeddings) for e in embeddings)
@@ -0,0 +1,139 @@
+"""
+FAISS Index Factory for Exact and Approximate Search Backends
+"""
+
+import logging
+import math
+import os
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq_fp16', 'sq_int8', 'pq')
+
+# Index types storing lossy codes instead of float32 vectors
+QUANTIZED_TYPES = ('ivf_pq', 'sq_fp16', 'sq_int8', 'pq')
+
+# Rows copied per add() call so large or memory-mapped inputs are never
+# materialized in one piece
+ADD_CHUNK_SIZE = 65536
+
+def factory_string(index_type: str, dimension: int, n_rows: int) -> str:
+    """Translate an index type into a faiss.index_factory description"""
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'ivf_flat':
+        return f"IVF{ivf_nlist(n_rows)},Flat"
+    if index_type == 'ivf_pq':
+        return f"IVF{ivf_nlist(n_rows)},PQ{pq_subquantizers(dimension)}"
+    if index_type == 'hnsw':
+        return f"HNSW{int(os.getenv('VECTOR_HNSW_M', '32'))}"
+    if index_type == 'sq_fp16':
+        return "SQfp16"
+    if index_type == 'sq_int8':
+        return "SQ8"
+    if index_type == 'pq':
+        # Exhaustive PQ as a single-list IVF, since IndexPQ rejects ID-selector search parameters
+        return f"IVF1,PQ{pq_subquantizers(dimension)}"
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+def ivf_nlist(n_rows: int) -> int:
+    """Number of IVF lists: VECTOR_IVF_NLIST, or ~4*sqrt(n) with enough training points per list"""
+    if os.getenv('VECTOR_IVF_NLIST'):
+        return int(os.getenv('VECTOR_IVF_NLIST'))
+    nlist = int(4 * math.sqrt(max(n_rows, 1)))
+    return max(1, min(nlist, n_rows // 39, 65536))
+
+def pq_subquantizers(dimension: int) -> int:
+    """Largest divisor of the dimension not above VECTOR_PQ_M (default 64)"""
+    target = int(os.getenv('VECTOR_PQ_M', '64'))
+    return max(m for m in range(1, min(target, dimension) + 1) if dimension % m == 0)
+
+def create_index(index_type: str, dimension: int, n_rows: int = 0):
+    """Create an empty, possibly untrained, inner-product index"""
+    index = faiss.index_factory(dimension, factory_string(index_type, dimension, n_rows),
+                                faiss.METRIC_INNER_PRODUCT)
+    configure_search(index)
+    return index
+
+def training_rows(n_rows: int) -> np.ndarray:
+    """Sorted uniform sample of row ids used to train IVF centroids and PQ codebooks"""
+    max_rows = int(os.getenv('VECTOR_TRAINING_SAMPLE', '100000'))
+    if n_rows <= max_rows:
+        return np.arange(n_rows)
+    return np.sort(np.random.default_rng(0).choice(n_rows, max_rows, replace=False))
+
+def training_sample(vectors: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(vectors[training_rows(len(vectors))], dtype='float32')
+
+def build_index(index_type: str, dimension: int, vectors: np.ndarray):
+    """Create, train and fill an index from normalized vectors"""
+    index = create_index(index_type, dimension, len(vectors))
+    if not index.is_trained:
+        index.train(training_sample(vectors))
+    for start in range(0, len(vectors), ADD_CHUNK_SIZE):
+        index.add(np.ascontiguousarray(vectors[start:start + ADD_CHUNK_SIZE], dtype='float32'))
+    return index
+
+def configure_search(index):
+    """Apply query-time accuracy knobs (IVF nprobe, HNSW efSearch)"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(int(os.getenv('VECTOR_IVF_NPROBE', '16')), ivf.nlist)
+    if hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = int(os.getenv('VECTOR_HNSW_EF_SEARCH', '64'))
+
+def search_parameters(index, selector):
+    """Search parameters restricting a search to ``selector``, carrying the index's own
+    nprobe/efSearch since explicit parameters override them"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if hasattr(index, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def id_selector(ids: np.ndarray):
+    """ID selector for sorted label ids; contiguous runs (e.g. time ranges) use a cheap range check"""
+    if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+        return faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+    return faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype='int64'))
+
+def exclusion_selector(ids: np.ndarray):
+    """ID selector matching every label except the given ids"""
+    excluded = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype='int64'))
+    selector = faiss.IDSelectorNot(excluded)
+    selector.referenced_objects = [excluded]  # The wrapper does not own the inner selector
+    return selector
+
+def rerank(query_vectors: np.ndarray, indices: np.ndarray, read_rows, k: int):
+    """Re-score candidate labels with exact float32 inner products and keep the top-k.
+
+    ``read_rows`` maps sorted row ids to their float32 vectors; -1 labels
+    (missing candidates) stay at the bottom.
+    """
+    rows = np.unique(indices[indices >= 0])
+    if not len(rows):
+        return (np.full((len(query_vectors), k), -np.inf, dtype='float32'),
+                np.full((len(query_vectors), k), -1, dtype='int64'))
+    exact = query_vectors @ read_rows(rows).T
+    scores = np.take_along_axis(exact, np.searchsorted(rows, np.maximum(indices, 0)), axis=1)
+    scores = np.where(indices >= 0, scores, -np.inf).astype('float32')
+    order = np.argsort(-scores, axis=1)[:, :k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+def index_type_of(index) -> str:
+    """Best-effort reverse mapping from a FAISS index to its index type"""
+    if isinstance(index, faiss.IndexFlat):
+        return 'flat'
+    if hasattr(index, 'hnsw'):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'sq_fp16' if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq_int8'
+    ivf = faiss.try_extract_index_ivf(index)
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        return 'pq' if ivf.nlist == 1 else 'ivf_pq'
+    if ivf is not None:
+        return 'ivf_flat'
+    return type(index).__name__
@@ -0,0 +1,115 @@
+"""
+Batch Ingestion Shared by the Pipelines
+"""
+
+import asyncio
+import numpy as np
+from datetime import datetime
+from typing import List, Dict, Any
+from .chunking import chunk_records
+from .document_records import shared_records
+
+def write_batch(embedder, vector_store, documents: List[Dict[str, Any]], chunked: List[List[str]],
+                embeddings: np.ndarray = None, upsert: bool = False) -> List[Dict[str, Any]]:
+    """Embed the chunks of a batch of {"content", "source", "symbol"} documents
+    unless ``embeddings`` (one row per chunk, in order) are given, then add or
+    upsert all of them with one vector store write.
+
+    Returns one pipeline document record per input document, shared with the
+    vector store for unchunked documents.
+    """
+    if not documents:
+        return []
+    texts = [chunk for chunks in chunked for chunk in chunks]
+    if embeddings is None:
+        embeddings = embedder.embed_batch(texts)
+    embeddings = np.reshape(embeddings, (len(texts), -1))
+
+    timestamp = datetime.now()
+    batch = []
+    records = []
+    offset = 0
+    for i, (doc, chunks) in enumerate(zip(documents, chunked)):
+        # Documents of one batch share a timestamp, so later ones get a suffix
+        doc_id = f"doc_{timestamp.timestamp()}" + (f"_{i}" if i else "")
+        document = shared_records.record({
+            "content": doc["content"],
+            "metadata": {
+                "source": doc["source"],
+                "symbol": doc.get("symbol"),
+                "timestamp": timestamp.isoformat(),
+                "id": doc_id
+            }
+        })
+        batch.append(document)
+        records.extend(chunk_records(document, chunks, embeddings[offset:offset + len(chunks)]))
+        offset += len(chunks)
+
+    # The vector store keeps the only copy of the embeddings
+    if upsert:
+        vector_store.upsert_documents(records)
+    else:
+        vector_store.add_documents(records)
+    return batch
+
+class BatchIngestion:
+    """Single and batch, sync and async add/upsert methods shared by the pipelines.
+
+    Subclasses set ``embedder`` and ``chunker`` and implement ``_ingest``, which
+    writes one batch of split documents with its embeddings (or None to embed
+    it there) and returns the document ids. The async methods call it from
+    executor threads, so it must be thread-safe.
+    """
+
+    def add_document(self, content: str, source: str, symbol: str = None, embedding: np.ndarray = None) -> str:
+        """Add a document; ``embedding`` holds one row per chunk"""
+        return self.add_documents([{"content": content, "source": source, "symbol": symbol}], embedding)[0]
+
+    async def aadd_document(self, content: str, source: str, symbol: str = None) -> str:
+        """Add a document, embedding it without blocking the event loop"""
+        return (await self.aadd_documents([{"content": content, "source": source, "symbol": symbol}]))[0]
+
+    def upsert_document(self, content: str, source: str, symbol: str = None, embedding: np.ndarray = None) -> str:
+        """Add a document that replaces the previous one for the same (symbol, source)"""
+        return self.upsert_documents([{"content": content, "source": source, "symbol": symbol}], embedding)[0]
+
+    async def aupsert_document(self, content: str, source: str, symbol: str = None) -> str:
+        """Upsert a document, embedding it without blocking the event loop"""
+        return (await self.aupsert_documents([{"content": content, "source": source, "symbol": symbol}]))[0]
+
+    def add_documents(self, documents: List[Dict[str, Any]], embeddings: np.ndarray = None) -> List[str]:
+        """Add a batch of {"content", "source", "symbol"} documents with one
+        embed_batch call and one write.
+
+        ``embeddings`` optionally holds one row per chunk of every document, in order.
+        """
+        return self._ingest(documents, self._split(documents), embeddings, upsert=False)
+
+    async def aadd_documents(self, documents: List[Dict[str, Any]]) -> List[str]:
+        """Add a batch of documents, embedding it without blocking the event loop"""
+        return await self._aingest(documents, upsert=False)
+
+    def upsert_documents(self, documents: List[Dict[str, Any]], embeddings: np.ndarray = None) -> List[str]:
+        """Upsert a batch of documents, each replacing the previous one for its (symbol, source)"""
+        return self._ingest(documents, self._split(documents), embeddings, upsert=True)
+
+    async def aupsert_documents(self, documents: List[Dict[str, Any]]) -> List[str]:
+        """Upsert a batch of documents, embedding it without blocking the event loop"""
+        return await self._aingest(documents, upsert=True)
+
+    def _split(self, documents: List[Dict[str, Any]]) -> List[List[str]]:
+        """Chunks of every document"""
+        return [self.chunker.split(doc["content"]) for doc in documents]
+
+    async def _aingest(self, documents: List[Dict[str, Any]], upsert: bool) -> List[str]:
+        """Split and embed a batch on the async embedding path, then write it on the
+        default executor, so index, segment and journal writes never block the event loop"""
+        chunked = self._split(documents)
+        embeddings = await self.embedder.aembed_batch([chunk for chunks in chunked for chunk in chunks])
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._ingest, documents, chunked, embeddings, upsert)
+
+    def _ingest(self, documents: List[Dict[str, Any]], chunked: List[List[str]], embeddings: np.ndarray,
+                upsert: bool) -> List[str]:
+        """Write a batch of split documents and return their ids"""
+        raise NotImplementedError
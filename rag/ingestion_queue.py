@@ -0,0 +1,179 @@
+"""
+Bounded Async Ingestion Queue with Backpressure and a Worker Pool
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import List, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+class IngestionQueue:
+    """Decouples data sources from the pipeline.
+
+    Sources hand documents to ``asubmit``, which returns once they are
+    queued; the documents wait in a bounded asyncio queue and ``workers``
+    tasks drain up to ``batch_size`` of them at a time into the pipeline's
+    batched async adds and upserts. When the queue is full,
+    ``policy`` decides: ``block`` makes the source wait (backpressure),
+    ``drop_newest`` rejects the incoming documents and ``drop_oldest``
+    evicts the longest queued ones. Depth, drops and queueing lag are
+    reported by ``get_stats``.
+    """
+
+    def __init__(self, pipeline, max_size: int = None, workers: int = None, batch_size: int = None,
+                 batch_wait_ms: float = None, policy: str = None):
+        self.pipeline = pipeline
+        if max_size is None:
+            max_size = int(os.getenv('INGEST_QUEUE_SIZE', '1000'))
+        self.max_size = max(1, max_size)
+        if workers is None:
+            workers = int(os.getenv('INGEST_WORKERS', '2'))
+        self.workers = max(1, workers)
+        if batch_size is None:
+            batch_size = int(os.getenv('INGEST_BATCH_SIZE', '64'))
+        self.batch_size = max(1, batch_size)
+        # How long a worker waits for a partial batch to fill up
+        if batch_wait_ms is None:
+            batch_wait_ms = float(os.getenv('INGEST_BATCH_WAIT_MS', '50'))
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.policy = (policy or os.getenv('INGEST_QUEUE_POLICY', 'block')).lower()
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown ingestion policy '{self.policy}', expected one of {POLICIES}")
+        self._queue = None
+        self._tasks = []
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    async def start(self):
+        """Start the workers on the running event loop"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"ingest-worker-{i}")
+                       for i in range(self.workers)]
+        logger.info(f"✅ Started ingestion queue with {self.workers} workers ({self.policy} when full)")
+
+    async def stop(self, drain: bool = True):
+        """Stop the workers, first writing out the queued documents unless drain is False"""
+        if not self._tasks:
+            return
+        if drain:
+            await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("🛑 Ingestion queue stopped")
+
+    async def asubmit(self, documents: List[Dict[str, Any]], upsert: bool = False,
+                      on_written: Callable[[Dict[str, Any]], None] = None) -> int:
+        """Queue {"content", "source", "symbol"} documents for the pipeline's
+        aadd_documents, or aupsert_documents with ``upsert``.
+
+        Returns how many documents were accepted, not their ids: ids are
+        assigned when a worker writes the batch. With ``drop_newest`` the
+        accepted documents are always the first ones of the list. Accepted
+        documents can still be evicted or fail to write; ``on_written`` is
+        called on the event loop with each document once it is stored.
+        """
+        return await self._submit(documents, upsert, on_written)
+
+    async def _submit(self, documents: List[Dict[str, Any]], upsert: bool, on_written) -> int:
+        if not self._tasks:
+            await self.start()
+        accepted = 0
+        for document in documents:
+            item = (time.monotonic(), upsert, document, on_written)
+            if self.policy == 'block':
+                await self._queue.put(item)
+            elif self._queue.full() and self.policy == 'drop_newest':
+                self.dropped += 1
+                continue
+            else:
+                if self._queue.full():
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped += 1
+                self._queue.put_nowait(item)
+            accepted += 1
+        self.enqueued += accepted
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        if accepted < len(documents):
+            logger.warning(f"⚠️ Ingestion queue full, dropped {len(documents) - accepted} documents")
+        return accepted
+
+    async def _next_batch(self) -> list:
+        """Wait for a document, then collect up to batch_size within the wait window"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            if self._queue.empty():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                # Upserts and adds each go to the pipeline as one batch
+                for upsert in (False, True):
+                    items = [item for item in batch if item[1] == upsert]
+                    if not items:
+                        continue
+                    documents = [document for _, _, document, _ in items]
+                    try:
+                        if upsert:
+                            await self.pipeline.aupsert_documents(documents)
+                        else:
+                            await self.pipeline.aadd_documents(documents)
+                        self.processed += len(documents)
+                    except Exception as e:
+                        self.failed += len(documents)
+                        logger.error(f"❌ Ingestion batch failed: {e}")
+                        continue
+                    for _, _, document, on_written in items:
+                        if on_written:
+                            on_written(document)
+                self.batches += 1
+                self.last_lag = time.monotonic() - min(item[0] for item in batch)
+                self.max_lag = max(self.max_lag, self.last_lag)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, throughput counters and the seconds from enqueue until the
+        oldest document of the latest batch was written"""
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "max_depth": self.max_depth,
+            "policy": self.policy,
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "lag_seconds": round(self.last_lag, 4),
+            "max_lag_seconds": round(self.max_lag, 4)
+        }
@@ -0,0 +1,254 @@
+"""
+Metadata Index for Filtered Vector Search
+"""
+
+import bisect
+import json
+import logging
+import math
+import numpy as np
+from array import array
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Union, Iterable
+
+logger = logging.getLogger(__name__)
+
+def to_epoch(value: Union[str, float, int, datetime, None]) -> float:
+    """Convert an ISO string, datetime or epoch seconds to epoch seconds (NaN if unknown)"""
+    if value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return math.nan
+    return value.timestamp()
+
+def _to_numpy(values: array, dtype) -> np.ndarray:
+    # Copy rather than view: an array exporting its buffer cannot grow
+    return np.frombuffer(values, dtype=dtype).copy()
+
+class MetadataIndex:
+    """Inverted row-id sets per symbol and source plus a timestamp-sorted row list.
+
+    Row ids are the vector store's FAISS labels. Postings are kept as compact
+    int64 arrays in insertion (hence sorted) order, so they convert to numpy
+    with a single copy and intersect cheaply.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.symbols = _Column()
+        self.sources = _Column()
+        self.timestamps = array('d')  # per row, NaN when unknown
+        self._sorted_timestamps = array('d')
+        self._sorted_rows = array('q')
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def add(self, metadata: Dict[str, Any]):
+        """Index the metadata of the next row"""
+        row = self.rows
+        self.symbols.add(row, metadata.get('symbol'))
+        self.sources.add(row, metadata.get('source'))
+
+        timestamp = to_epoch(metadata.get('timestamp'))
+        self.timestamps.append(timestamp)
+        if not math.isnan(timestamp):
+            # Documents arrive roughly in time order, so this is almost always an append
+            if not self._sorted_timestamps or timestamp >= self._sorted_timestamps[-1]:
+                self._sorted_timestamps.append(timestamp)
+                self._sorted_rows.append(row)
+            else:
+                position = bisect.bisect_right(self._sorted_timestamps, timestamp)
+                self._sorted_timestamps.insert(position, timestamp)
+                self._sorted_rows.insert(position, row)
+        self.rows += 1
+
+    def extend(self, documents: Iterable[Dict[str, Any]]):
+        for document in documents:
+            self.add(document.get('metadata') or {})
+
+    def select(self, symbol: Union[str, List[str]] = None, source: Union[str, List[str]] = None,
+               since=None, until=None) -> Optional[np.ndarray]:
+        """Sorted row ids matching every given filter, or None when no filter is set.
+
+        ``symbol`` and ``source`` accept one value or a list (matched as a
+        union); ``since``/``until`` bound the timestamp inclusively.
+        """
+        candidates = []
+        if symbol is not None:
+            candidates.append(self.symbols.rows(symbol))
+        if source is not None:
+            candidates.append(self.sources.rows(source))
+        if since is not None or until is not None:
+            candidates.append(self._time_range(since, until))
+        if not candidates:
+            return None
+
+        candidates.sort(key=len)
+        selected = candidates[0]
+        for rows in candidates[1:]:
+            if not len(selected):
+                break
+            selected = np.intersect1d(selected, rows, assume_unique=True)
+        return selected
+
+    def _time_range(self, since, until) -> np.ndarray:
+        start = 0
+        end = len(self._sorted_timestamps)
+        if since is not None:
+            start = bisect.bisect_left(self._sorted_timestamps, to_epoch(since))
+        if until is not None:
+            end = bisect.bisect_right(self._sorted_timestamps, to_epoch(until))
+        if end <= start:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(_to_numpy(self._sorted_rows[start:end], np.int64))
+
+    def older_than(self, cutoff: float) -> np.ndarray:
+        """Sorted rows with a timestamp strictly before ``cutoff`` (epoch seconds)"""
+        end = bisect.bisect_left(self._sorted_timestamps, cutoff)
+        return np.sort(_to_numpy(self._sorted_rows[:end], np.int64))
+
+    def timestamps_of(self, rows: np.ndarray) -> np.ndarray:
+        return np.fromiter((self.timestamps[row] for row in rows), dtype=np.float64, count=len(rows))
+
+    def keys(self) -> set:
+        """(symbol, source) pairs of the rows that have both"""
+        symbols = _to_numpy(self.symbols.row_codes, np.int32)
+        sources = _to_numpy(self.sources.row_codes, np.int32)
+        known = (symbols >= 0) & (sources >= 0)
+        pairs = np.unique(np.stack([symbols[known], sources[known]], axis=1), axis=0)
+        return {(self.symbols.values[symbol], self.sources.values[source]) for symbol, source in pairs}
+
+    def take(self, rows: np.ndarray) -> 'MetadataIndex':
+        """New index over the given sorted rows, renumbered from 0"""
+        return self.from_columns(_to_numpy(self.symbols.row_codes, np.int32)[rows],
+                                 _to_numpy(self.sources.row_codes, np.int32)[rows],
+                                 _to_numpy(self.timestamps, np.float64)[rows],
+                                 self.symbols.values, self.sources.values)
+
+    def clear(self):
+        self.__init__()
+
+    def save(self, f):
+        """Write the per-row columns together with the postings and the time order,
+        so loading needs no sort"""
+        symbol_rows, symbol_bounds = self.symbols.flat_postings()
+        source_rows, source_bounds = self.sources.flat_postings()
+        np.savez(f, symbol_codes=_to_numpy(self.symbols.row_codes, np.int32),
+                 source_codes=_to_numpy(self.sources.row_codes, np.int32),
+                 timestamps=_to_numpy(self.timestamps, np.float64),
+                 symbol_rows=symbol_rows, symbol_bounds=symbol_bounds,
+                 source_rows=source_rows, source_bounds=source_bounds,
+                 sorted_rows=_to_numpy(self._sorted_rows, np.int64),
+                 vocabulary=np.frombuffer(json.dumps([self.symbols.values, self.sources.values]).encode(),
+                                          dtype=np.uint8))
+
+    @classmethod
+    def load(cls, f) -> 'MetadataIndex':
+        """Read the saved index; files without postings are rebuilt from the columns"""
+        data = np.load(f)
+        symbols, sources = json.loads(data['vocabulary'].tobytes())
+        if 'sorted_rows' not in data:
+            return cls.from_columns(data['symbol_codes'], data['source_codes'], data['timestamps'],
+                                    symbols, sources)
+        index = cls()
+        timestamps = data['timestamps']
+        sorted_rows = data['sorted_rows']
+        index.rows = len(timestamps)
+        index.symbols = _Column.from_postings(data['symbol_codes'], symbols,
+                                              data['symbol_rows'], data['symbol_bounds'])
+        index.sources = _Column.from_postings(data['source_codes'], sources,
+                                              data['source_rows'], data['source_bounds'])
+        index.timestamps = array('d', timestamps.astype(np.float64).tobytes())
+        index._sorted_timestamps = array('d', timestamps[sorted_rows].astype(np.float64).tobytes())
+        index._sorted_rows = array('q', sorted_rows.astype(np.int64).tobytes())
+        return index
+
+    @classmethod
+    def from_columns(cls, symbol_codes: np.ndarray, source_codes: np.ndarray, timestamps: np.ndarray,
+                     symbols: List[str], sources: List[str]) -> 'MetadataIndex':
+        """Build the index from per-row columns with vectorized sorts instead of per-row inserts"""
+        index = cls()
+        index.rows = len(timestamps)
+        index.symbols = _Column.from_codes(symbol_codes, symbols)
+        index.sources = _Column.from_codes(source_codes, sources)
+        index.timestamps = array('d', timestamps.astype(np.float64).tobytes())
+
+        known = np.flatnonzero(~np.isnan(timestamps))
+        order = known[np.argsort(timestamps[known], kind='stable')]
+        index._sorted_timestamps = array('d', timestamps[order].astype(np.float64).tobytes())
+        index._sorted_rows = array('q', order.astype(np.int64).tobytes())
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "symbols": len(self.symbols.values),
+            "sources": len(self.sources.values)
+        }
+
+class _Column:
+    """Dictionary-encoded string column with an inverted posting list per value"""
+
+    def __init__(self):
+        self.values = []  # code -> value
+        self.codes = {}  # value -> code
+        self.row_codes = array('i')  # per row, -1 when missing
+        self.postings = []  # code -> array of rows
+
+    def add(self, row: int, value: Optional[str]):
+        if value is None:
+            self.row_codes.append(-1)
+            return
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            self.postings.append(array('q'))
+        self.row_codes.append(code)
+        self.postings[code].append(row)
+
+    def rows(self, values: Union[str, List[str]]) -> np.ndarray:
+        if isinstance(values, str):
+            values = [values]
+        postings = [_to_numpy(self.postings[self.codes[value]], np.int64)
+                    for value in values if value in self.codes]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def flat_postings(self):
+        """Postings concatenated in code order, with the bounds of each code's run"""
+        lengths = [len(rows) for rows in self.postings]
+        bounds = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        rows = np.concatenate([np.empty(0, dtype=np.int64)] + [_to_numpy(rows, np.int64) for rows in self.postings])
+        return rows, bounds
+
+    @classmethod
+    def from_postings(cls, codes: np.ndarray, values: List[str], rows: np.ndarray, bounds: np.ndarray) -> '_Column':
+        column = cls()
+        column.values = list(values)
+        column.codes = {value: code for code, value in enumerate(column.values)}
+        column.row_codes = array('i', codes.astype(np.int32).tobytes())
+        column.postings = [array('q', rows[bounds[code]:bounds[code + 1]].astype(np.int64).tobytes())
+                           for code in range(len(values))]
+        return column
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray, values: List[str]) -> '_Column':
+        column = cls()
+        column.values = list(values)
+        column.codes = {value: code for code, value in enumerate(column.values)}
+        column.row_codes = array('i', codes.astype(np.int32).tobytes())
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        column.postings = [array('q', order[bounds[code]:bounds[code + 1]].astype(np.int64).tobytes())
+                           for code in range(len(values))]
+        return column
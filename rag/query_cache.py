@@ -0,0 +1,140 @@
+"""
+Query-Vector Cache with Normalized Query Keys
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import numpy as np
+import faiss
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from .hashing_embedder import is_fallback
+
+logger = logging.getLogger(__name__)
+
+# Company names and symbol spellings that mean the same ticker in a query
+TICKER_ALIASES = {
+    'apple': 'aapl', 'alphabet': 'googl', 'google': 'googl', 'goog': 'googl', 'microsoft': 'msft',
+    'tesla': 'tsla', 'amazon': 'amzn', 'facebook': 'meta', 'nvidia': 'nvda',
+    'bitcoin': 'btc-usd', 'btc': 'btc-usd', 'btcusd': 'btc-usd',
+    'ethereum': 'eth-usd', 'eth': 'eth-usd', 'ethusd': 'eth-usd'
+}
+
+_TOKEN = re.compile(r"\$?[\w.-]+|[^\w\s]")
+
+def parse_aliases(spec: Optional[str]) -> Dict[str, str]:
+    """Parse 'alphabet=GOOGL,Berkshire=BRK-B' into lowercase alias -> ticker"""
+    aliases = {}
+    for entry in (spec or '').split(','):
+        if not entry.strip():
+            continue
+        alias, _, ticker = entry.partition('=')
+        if not ticker:
+            raise ValueError(f"Invalid alias entry '{entry}', expected alias=TICKER")
+        aliases[alias.strip().lower()] = ticker.strip().lower()
+    return aliases
+
+class QueryCache:
+    """Normalized query embeddings keyed by normalized query text.
+
+    Keys ignore case and whitespace, and map company names and symbol
+    spellings to one ticker (``$AAPL``, ``apple`` and ``AAPL`` share a key).
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted beyond ``max_entries``. Kept apart from the document embedding
+    cache, so query traffic never evicts ingest embeddings.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, aliases: Dict[str, str] = None):
+        if max_entries is None:
+            max_entries = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+        self.max_entries = max_entries
+        if ttl is None:
+            ttl = float(os.getenv('QUERY_CACHE_TTL', '300'))
+        self.ttl = ttl
+        if aliases is None:
+            aliases = {**TICKER_ALIASES, **parse_aliases(os.getenv('QUERY_CACHE_ALIASES'))}
+        self.aliases = aliases
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, vector)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, query: str) -> str:
+        """Cache key for a query"""
+        tokens = []
+        for token in _TOKEN.findall(query.lower()):
+            token = token.lstrip('$') or token
+            tokens.append(self.aliases.get(token, token))
+        return " ".join(tokens)
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        """Cached normalized query vector, or None if missing or expired"""
+        if self.max_entries <= 0:
+            return None
+        key = self.normalize(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, vector: np.ndarray):
+        """Cache a normalized query vector"""
+        if self.max_entries <= 0:
+            return
+        vector = np.array(vector, dtype='float32')
+        vector.setflags(write=False)
+        key = self.normalize(query)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, queries: List[str]) -> Tuple[List[Optional[np.ndarray]], List[str]]:
+        """Cached vectors per query (None if missing) and the distinct queries to embed"""
+        vectors = [self.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+        return vectors, missing
+
+    def complete(self, queries: List[str], vectors: List[Optional[np.ndarray]], missing: List[str],
+                 embeddings) -> np.ndarray:
+        """Normalize and cache the embeddings of the missing queries, returning the
+        full normalized query matrix in query order. Embeddings from a provider
+        fallback are used but not cached, so the query is embedded again once
+        the provider recovers."""
+        computed = {}
+        if missing:
+            # Copied, since normalization is in place and the embeddings may be cached
+            embedded = np.array(embeddings, dtype='float32')
+            faiss.normalize_L2(embedded)
+            if not is_fallback(embeddings):
+                for query, vector in zip(missing, embedded):
+                    self.put(query, vector)
+            computed = dict(zip(missing, embedded))
+        return np.array([computed[query] if vector is None else vector
+                         for query, vector in zip(queries, vectors)], dtype='float32')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
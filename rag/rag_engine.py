@@ -3,7 +3,7 @@ RAG Engine - Core Retrieval Augmented Generation Logic
 """
 
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -42,13 +42,17 @@ class RAGEngine:
                 "timestamp": datetime.now().isoformat()
             }
     
-    def retrieve(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Retrieve relevant documents for query"""
+    def retrieve(self, query: Union[str, List[str]], k: int = 5,
+                 filters: Dict[str, Any] = None) -> Union[List[Dict[str, Any]], List[List[Dict[str, Any]]]]:
+        """Retrieve relevant documents for a query, or one result list per query
+        when given a list, which is embedded and searched as a single batch"""
         try:
-            return self.vector_store.search(query, k=k)
+            if isinstance(query, list):
+                return self.vector_store.search_batch(query, k=k, filters=filters)
+            return self.vector_store.search(query, k=k, **(filters or {}))
         except Exception as e:
             logger.error(f"❌ Retrieval failed: {e}")
-            return []
+            return [[] for _ in query] if isinstance(query, list) else []
     
     def _enhance_response(self, response: Dict[str, Any], retrieved_docs: List[Dict]) -> Dict[str, Any]:
         """Enhance response with RAG-specific metadata"""
@@ -93,14 +97,23 @@ class RAGEngine:
         """Add document to RAG system"""
         return self.pipeline.add_document(content, source, symbol)
     
+    def upsert_document(self, content: str, source: str, symbol: str = None) -> str:
+        """Add a document replacing the previous one for the same (symbol, source)"""
+        return self.pipeline.upsert_document(content, source, symbol)
+    
+    def add_documents(self, documents: List[Dict[str, Any]]) -> List[str]:
+        """Add a batch of {"content", "source", "symbol"} documents in one pipeline write"""
+        return self.pipeline.add_documents(documents)
+    
+    def upsert_documents(self, documents: List[Dict[str, Any]]) -> List[str]:
+        """Upsert a batch of documents, each replacing the previous one for its (symbol, source)"""
+        return self.pipeline.upsert_documents(documents)
+    
     def get_system_health(self) -> Dict[str, Any]:
         """Get RAG system health status"""
         return {
             "vector_store": self.vector_store.get_stats(),
             "pipeline": self.pipeline.get_stats() if hasattr(self.pipeline, 'get_stats') else {"status": "active"},
-            "embedder": {
-                "type": self.embedder.embedder_type,
-                "dimension": self.embedder.dimension
-            },
+            "embedder": self.embedder.get_stats(),
             "timestamp": datetime.now().isoformat()
         }
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Pipeline Restart-Time Benchmark: Legacy JSON Replay vs Snapshot plus WAL
+
+Usage:
+    python -m backend.rag.restart_benchmark --documents 1000000
+    python -m backend.rag.restart_benchmark --documents 1000000 --wal-fraction 0.05
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Dict, Any
+from .benchmark import format_report
+from .document_journal import DocumentJournal
+from .storage import dump_record
+
+SYMBOLS = ['AAPL', 'GOOGL', 'MSFT', 'TSLA', 'AMZN', 'META', 'NVDA', 'BTC-USD', 'ETH-USD']
+
+def synthetic_documents(start: int, count: int) -> List[Dict[str, Any]]:
+    """News-sized pipeline document records"""
+    return [{
+        "content": f"Article {i}: {SYMBOLS[i % len(SYMBOLS)]} shares moved as analysts revised their outlook "
+                   f"after the latest quarterly results and guidance.",
+        "metadata": {
+            "source": "Reuters",
+            "symbol": SYMBOLS[i % len(SYMBOLS)],
+            "timestamp": "2024-01-02T09:30:00",
+            "id": f"doc_{i}"
+        }
+    } for i in range(start, start + count)]
+
+def legacy_replay(path: str) -> list:
+    """The former startup path: parse every line of processed_documents.json"""
+    documents = []
+    with open(path, 'r') as f:
+        for line in f:
+            documents.append(json.loads(line.strip()))
+    return documents
+
+def restart_report(n_documents: int, wal_fraction: float = 0.01, batch_size: int = 10000) -> List[Dict[str, Any]]:
+    """Startup time and the cost of reading every document afterwards, for the
+    legacy replay and for a journal holding ``wal_fraction`` of the documents
+    in its WAL"""
+    data_dir = tempfile.mkdtemp(prefix="restart-benchmark-")
+    try:
+        legacy_path = os.path.join(data_dir, "legacy.json")
+        journal = DocumentJournal(data_dir, min_snapshot_rows=n_documents + 1)
+        snapshot_rows = n_documents - int(n_documents * wal_fraction)
+        with open(legacy_path, 'w') as f:
+            for first, last in [(0, snapshot_rows), (snapshot_rows, n_documents)]:
+                for start in range(first, last, batch_size):
+                    documents = synthetic_documents(start, min(batch_size, last - start))
+                    f.write("".join(dump_record(document) for document in documents))
+                    journal.append(documents)
+                if first == 0:
+                    journal.snapshot(wait=True)
+
+        results = []
+        started = time.perf_counter()
+        documents = legacy_replay(legacy_path)
+        load_seconds = time.perf_counter() - started
+        results.append({"method": "legacy_json_replay", "documents": len(documents),
+                        "load_seconds": round(load_seconds, 3), "speedup": 1.0,
+                        "full_scan_seconds": 0.0})
+        baseline = load_seconds
+        del documents
+
+        restarted = DocumentJournal(data_dir)
+        started = time.perf_counter()
+        documents, _ = restarted.load()
+        load_seconds = time.perf_counter() - started
+        # Snapshot rows are decoded on access, so report what touching all of them costs
+        started = time.perf_counter()
+        for _ in documents:
+            pass
+        results.append({"method": f"snapshot_plus_wal ({restarted.wal_rows} WAL rows)", "documents": len(documents),
+                        "load_seconds": round(load_seconds, 3),
+                        "speedup": round(baseline / load_seconds, 1) if load_seconds else None,
+                        "full_scan_seconds": round(time.perf_counter() - started, 3)})
+        documents.clear()
+        return results
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline restart time: JSON replay vs snapshot plus WAL")
+    parser.add_argument("--documents", type=int, default=1000000)
+    parser.add_argument("--wal-fraction", type=float, default=0.01,
+                        help="Share of the documents still in the WAL at restart")
+    args = parser.parse_args()
+    print(format_report(restart_report(args.documents, args.wal_fraction)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Per-Source Retention Policy for the Vector Store
+"""
+
+import logging
+import numpy as np
+from typing import Dict, Optional
+from .metadata_index import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE = '*'
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_duration(value: str) -> float:
+    """Parse '90', '30s', '15m', '1h', '7d' or '2w' into seconds"""
+    value = value.strip().lower()
+    if value and value[-1] in _UNITS:
+        return float(value[:-1]) * _UNITS[value[-1]]
+    return float(value)
+
+def parse_retention(spec: Optional[str]) -> Dict[str, float]:
+    """Parse 'market_data=1h,Reuters=7d,*=30d' into seconds per source.
+
+    ``*`` applies to every source without its own entry; sources matching no
+    entry are kept forever.
+    """
+    retention = {}
+    for entry in (spec or '').split(','):
+        if not entry.strip():
+            continue
+        source, _, duration = entry.partition('=')
+        if not duration:
+            raise ValueError(f"Invalid retention entry '{entry}', expected source=duration")
+        retention[source.strip()] = parse_duration(duration)
+    return retention
+
+def expired_rows(metadata_index: MetadataIndex, retention: Dict[str, float], now: float) -> np.ndarray:
+    """Sorted rows whose timestamp is older than their source's retention window.
+
+    Only rows older than the shortest window are considered, read from the
+    index's time order, so the cost tracks the number of old rows rather
+    than the store size. Rows without a timestamp never expire.
+    """
+    if not retention:
+        return np.empty(0, dtype=np.int64)
+
+    candidates = metadata_index.older_than(now - min(retention.values()))
+    if not len(candidates):
+        return candidates
+
+    expired = []
+    explicit = [source for source in retention if source != DEFAULT_SOURCE]
+    for source in explicit:
+        rows = np.intersect1d(candidates, metadata_index.sources.rows(source), assume_unique=True)
+        expired.append(rows[metadata_index.timestamps_of(rows) < now - retention[source]])
+
+    if DEFAULT_SOURCE in retention:
+        rows = candidates
+        if explicit:
+            rows = rows[~np.isin(rows, metadata_index.sources.rows(explicit), assume_unique=True)]
+        expired.append(rows[metadata_index.timestamps_of(rows) < now - retention[DEFAULT_SOURCE]])
+
+    if not expired:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(expired))
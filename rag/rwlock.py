@@ -0,0 +1,48 @@
+"""
+Reader-Writer Lock for Concurrent Search and Ingest
+"""
+
+import threading
+from contextlib import contextmanager
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer.
+
+    Writers are preferred: once a writer is waiting, new readers queue behind
+    it, so a steady query load cannot starve ingest. Not reentrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
@@ -0,0 +1,387 @@
+"""
+Time-Partitioned Sharded Vector Store with Parallel Fan-out Search
+"""
+
+import asyncio
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import faiss
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple
+from . import retention
+from .metadata_index import to_epoch
+from .query_cache import QueryCache
+from .rwlock import ReadWriteLock
+from .vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+class ShardedVectorStore:
+    """Vector store split into time-bucketed shards, each a VectorStore of its own.
+
+    Documents are routed by source group and timestamp into buckets whose
+    width is set per source (``VECTOR_SHARD_WIDTH``, e.g. hourly for ticks,
+    daily for the rest). A query fans out over the shards overlapping its
+    time window on a thread pool, which FAISS searches in parallel since it
+    releases the GIL, and the per-shard top-k lists are merged. Shards whose
+    bucket has closed are compacted once and left read-mostly; retention
+    drops whole shards, which only means deleting their directory.
+    """
+
+    def __init__(self, embedder, dimension: int = None, data_dir: str = './data', mmap: bool = None,
+                 index_type: str = None, shard_widths: Dict[str, float] = None,
+                 retention_policy: Dict[str, float] = None):
+        self.embedder = embedder
+        self.dimension = dimension or int(os.getenv('VECTOR_DIMENSION', '1536'))
+        self.data_dir = data_dir
+        self.shards_dir = os.path.join(data_dir, 'shards')
+        self.mmap = mmap
+        self.index_type = index_type
+        # Bucket width in seconds per source ('*' for the rest)
+        if shard_widths is None:
+            shard_widths = retention.parse_retention(os.getenv('VECTOR_SHARD_WIDTH', 'market_data=1h,*=1d'))
+        self.shard_widths = {retention.DEFAULT_SOURCE: 86400.0, **shard_widths}
+        if retention_policy is None:
+            retention_policy = retention.parse_retention(os.getenv('VECTOR_RETENTION'))
+        self.retention_policy = retention_policy
+        self.maintenance_interval = float(os.getenv('VECTOR_RETENTION_INTERVAL', '60'))
+        self.query_cache = QueryCache()
+        self.shards: Dict[str, VectorStore] = {}
+        self.bounds: Dict[str, Tuple[str, float, float]] = {}  # name -> (group, start, end)
+        self.sealed = set()
+        self.key_shards: Dict[Tuple[str, str], set] = {}  # (symbol, source) -> shards holding a version
+        self._shards_lock = threading.RLock()
+        # Serializes upserts, which may move keys between shards
+        self._upsert_lock = threading.Lock()
+        # Held exclusively while an upsert moves a key between shards, shared by fan-out searches
+        self._state_lock = ReadWriteLock()
+        workers = int(os.getenv('VECTOR_SHARD_WORKERS', str(min(8, os.cpu_count() or 1))))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vector-shard")
+        self._maintenance_thread = None
+        self._stop_maintenance = threading.Event()
+        self.setup_shards()
+
+    def setup_shards(self):
+        """Open every shard found on disk"""
+        try:
+            os.makedirs(self.shards_dir, exist_ok=True)
+            for name in sorted(os.listdir(self.shards_dir)):
+                group, _, start = name.rpartition('-')
+                if not group or not start.isdigit():
+                    continue
+                group = retention.DEFAULT_SOURCE if group == 'default' else group
+                self._open_shard(name, group, float(start))
+
+            logger.info(f"✅ Opened {len(self.shards)} vector store shards")
+            self.maintain()
+            self._start_maintenance()
+
+        except Exception as e:
+            logger.error(f"❌ Shard setup failed: {e}")
+
+    def _group(self, source: str) -> str:
+        return source if source in self.shard_widths else retention.DEFAULT_SOURCE
+
+    def _shard_name(self, group: str, start: float) -> str:
+        return f"{'default' if group == retention.DEFAULT_SOURCE else group}-{int(start)}"
+
+    def _open_shard(self, name: str, group: str, start: float) -> VectorStore:
+        shard = VectorStore(self.embedder, dimension=self.dimension,
+                            data_dir=os.path.join(self.shards_dir, name), mmap=self.mmap,
+                            index_type=self.index_type, retention_policy={})
+        self.shards[name] = shard
+        self.bounds[name] = (group, start, start + self.shard_widths[group])
+        for key in shard.metadata_index.keys():
+            self.key_shards.setdefault(key, set()).add(name)
+        return shard
+
+    def _track_keys(self, name: str, documents: List[Dict[str, Any]]) -> set:
+        """Record the (symbol, source) keys written to a shard and return them"""
+        keys = set()
+        for doc in documents:
+            metadata = doc.get('metadata') or {}
+            key = (metadata.get('symbol'), metadata.get('source'))
+            if key[0] is not None and key[1] is not None:
+                keys.add(key)
+                self.key_shards.setdefault(key, set()).add(name)
+        return keys
+
+    def _forget_shard(self, name: str):
+        for key in [key for key, names in self.key_shards.items() if name in names]:
+            self.key_shards[key].discard(name)
+            if not self.key_shards[key]:
+                del self.key_shards[key]
+
+    def _route(self, documents: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        """Group documents by target shard, creating shards as needed"""
+        routed = {}
+        now = time.time()
+        with self._shards_lock:
+            for doc in documents:
+                metadata = doc.get('metadata') or {}
+                group = self._group(metadata.get('source'))
+                timestamp = to_epoch(metadata.get('timestamp'))
+                if math.isnan(timestamp):
+                    timestamp = now
+                width = self.shard_widths[group]
+                start = math.floor(timestamp / width) * width
+                name = self._shard_name(group, start)
+                if name not in self.shards:
+                    self._open_shard(name, group, start)
+                routed.setdefault(name, []).append(doc)
+        return routed
+
+    def add_documents(self, documents: List[Dict[str, Any]]):
+        """Add documents to the shards covering their timestamps"""
+        for name, shard_documents in self._route(documents).items():
+            self.shards[name].add_documents(shard_documents)
+            with self._shards_lock:
+                self._track_keys(name, shard_documents)
+
+    def upsert_documents(self, documents: List[Dict[str, Any]]):
+        """Upsert by (symbol, source) across shards: the document lands in its
+        time bucket and older versions in other buckets of the group are removed.
+
+        The new rows are persisted first; only publishing them and removing
+        the older versions happens under the exclusive state lock, as one step,
+        so a search never sees two versions of a key and only waits for that
+        step. Only the shards known to hold a key are visited.
+        """
+        with self._upsert_lock:
+            for name, shard_documents in self._route(documents).items():
+                with self._shards_lock:
+                    shard = self.shards[name]
+                    group = self.bounds[name][0]
+                    stale = [(other, self.shards[other], key)
+                             for key in self._track_keys(name, shard_documents)
+                             for other in self.key_shards[key]
+                             if other != name and self.bounds[other][0] == group]
+                removed = []
+                shard.upsert_documents(shard_documents, publish=lambda: self._replacing(stale, removed))
+                with self._shards_lock:
+                    for other, _, key in removed:
+                        self.key_shards[key].discard(other)
+
+    @contextmanager
+    def _replacing(self, stale: list, removed: list):
+        """Publish a shard's upserted rows, then remove the older versions of their
+        keys from the ``stale`` shards, while searches wait; collects the removals"""
+        with self._state_lock.write():
+            yield
+            for other, shard, key in stale:
+                shard.remove_documents(symbol=key[0], source=key[1])
+                removed.append((other, shard, key))
+
+    def search(self, query: str, k: int = 5, threshold: float = None, symbol=None, source=None,
+               since=None, until=None) -> List[Dict[str, Any]]:
+        """Search the shards overlapping the time window; same arguments as VectorStore.search"""
+        try:
+            vectors, missing = self.query_cache.lookup([query])
+            query_vector = self.query_cache.complete([query], vectors, missing,
+                                                     [self.embedder.embed(text) for text in missing])
+            results = self.search_vectors(query_vector, k, threshold, filters={
+                "symbol": symbol, "source": source, "since": since, "until": until})[0]
+
+            logger.info(f"🔍 Search found {len(results)} results for query: {query}")
+            return results
+
+        except Exception as e:
+            logger.error(f"❌ Search failed: {e}")
+            return []
+
+    def search_batch(self, queries: List[str], k: int = 5, threshold: float = None,
+                     filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Search several queries with one embedding call and one fan-out"""
+        try:
+            if not queries:
+                return []
+            vectors, missing = self.query_cache.lookup(queries)
+            query_matrix = self.query_cache.complete(queries, vectors, missing,
+                                                     self.embedder.embed_batch(missing) if missing else [])
+            return self.search_vectors(query_matrix, k, threshold, filters)
+
+        except Exception as e:
+            logger.error(f"❌ Batch search failed: {e}")
+            return [[] for _ in queries]
+
+    async def asearch(self, query: str, k: int = 5, threshold: float = None, symbol=None, source=None,
+                      since=None, until=None) -> List[Dict[str, Any]]:
+        """Async search: embeds with ``aembed`` and fans out off the event loop"""
+        try:
+            vectors, missing = self.query_cache.lookup([query])
+            query_vector = self.query_cache.complete([query], vectors, missing,
+                                                     [await self.embedder.aembed(text) for text in missing])
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, self.search_vectors, query_vector, k, threshold,
+                {"symbol": symbol, "source": source, "since": since, "until": until})
+            return results[0]
+
+        except Exception as e:
+            logger.error(f"❌ Search failed: {e}")
+            return []
+
+    async def asearch_batch(self, queries: List[str], k: int = 5, threshold: float = None,
+                            filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Async search_batch, embedding with ``aembed_batch``"""
+        try:
+            if not queries:
+                return []
+            vectors, missing = self.query_cache.lookup(queries)
+            query_matrix = self.query_cache.complete(queries, vectors, missing,
+                                                     await self.embedder.aembed_batch(missing) if missing else [])
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.search_vectors, query_matrix, k, threshold, filters)
+
+        except Exception as e:
+            logger.error(f"❌ Batch search failed: {e}")
+            return [[] for _ in queries]
+
+    def search_vectors(self, query_vectors: np.ndarray, k: int = 5, threshold: float = None,
+                       filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Fan normalized query vectors out to the relevant shards and merge their top-k"""
+        filters = filters or {}
+        with self._state_lock.read():
+            shards = self._shards_for(filters.get('since'), filters.get('until'))
+            if not shards:
+                return [[] for _ in query_vectors]
+            if len(shards) == 1:
+                return shards[0].search_vectors(query_vectors, k, threshold, filters)
+
+            futures = [self.executor.submit(shard.search_vectors, query_vectors, k, threshold, filters)
+                       for shard in shards]
+            shard_results = [future.result() for future in futures]
+
+        merged = []
+        for row in range(len(query_vectors)):
+            results = [doc for per_shard in shard_results for doc in per_shard[row]]
+            results.sort(key=lambda x: x['similarity_score'], reverse=True)
+            merged.append(results[:k])
+        return merged
+
+    def _shards_for(self, since=None, until=None) -> List[VectorStore]:
+        """Shards whose bucket overlaps [since, until]"""
+        since = -math.inf if since is None else to_epoch(since)
+        until = math.inf if until is None else to_epoch(until)
+        with self._shards_lock:
+            return [self.shards[name] for name, (_, start, end) in self.bounds.items()
+                    if end > since and start <= until and self.shards[name].documents]
+
+    def maintain(self, now: float = None):
+        """Drop shards past retention and compact shards whose bucket has closed"""
+        now = time.time() if now is None else now
+        self.evict_expired(now)
+        with self._shards_lock:
+            closed = [(name, self.shards[name]) for name, (_, _, end) in self.bounds.items()
+                      if end <= now and name not in self.sealed]
+        for name, shard in closed:
+            # A late write into the bucket waits until the shard is flushed and compacted
+            with shard._write_lock:
+                shard.flush()
+                if shard.storage.wal_rows or len(shard.removed):
+                    shard.compact()
+            # Stops the shard's flusher; a late write restarts it
+            shard.close()
+            with self._shards_lock:
+                if self.shards.get(name) is shard:
+                    self.sealed.add(name)
+
+    def evict_expired(self, now: float = None) -> int:
+        """Drop every shard whose whole bucket is older than its group's retention.
+
+        Retention applies at shard granularity, so documents may outlive their
+        window by up to one bucket width. Returns the number of documents dropped.
+        """
+        now = time.time() if now is None else now
+        dropped = 0
+        with self._shards_lock:
+            for name, (group, _, end) in list(self.bounds.items()):
+                ttl = self._group_retention(group)
+                if ttl is None or end > now - ttl:
+                    continue
+                shard = self.shards.pop(name)
+                del self.bounds[name]
+                self.sealed.discard(name)
+                self._forget_shard(name)
+                dropped += len(shard.documents) - len(shard.removed)
+                shard.clear()
+                shard.close()
+                shutil.rmtree(shard.data_dir, ignore_errors=True)
+                logger.info(f"🗑️ Dropped expired shard {name}")
+        return dropped
+
+    def _group_retention(self, group: str):
+        """Longest retention of any source routed to the group, or None if some are kept forever"""
+        if group != retention.DEFAULT_SOURCE:
+            return self.retention_policy.get(group, self.retention_policy.get(retention.DEFAULT_SOURCE))
+        if retention.DEFAULT_SOURCE not in self.retention_policy:
+            return None
+        return max(ttl for source, ttl in self.retention_policy.items() if source not in self.shard_widths
+                   or source == retention.DEFAULT_SOURCE)
+
+    def _start_maintenance(self):
+        if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+            return
+        self._stop_maintenance.clear()
+        self._maintenance_thread = threading.Thread(target=self._maintenance_loop,
+                                                    name="vector-shard-maintenance", daemon=True)
+        self._maintenance_thread.start()
+
+    def _maintenance_loop(self):
+        while not self._stop_maintenance.wait(self.maintenance_interval):
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error(f"❌ Shard maintenance failed: {e}")
+
+    def stop_retention(self):
+        """Stop the background maintenance thread"""
+        self._stop_maintenance.set()
+
+    def flush(self) -> int:
+        """Flush every shard's pending writes; call on graceful shutdown"""
+        return sum(shard.flush() for shard in list(self.shards.values()))
+
+    def compact(self):
+        for shard in list(self.shards.values()):
+            shard.compact()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get vector store statistics, aggregated over shards"""
+        shards = {name: shard.get_stats() for name, shard in list(self.shards.items())}
+        return {
+            "total_documents": sum(stats["total_documents"] for stats in shards.values()),
+            "removed_documents": sum(stats["removed_documents"] for stats in shards.values()),
+            "index_size": sum(stats["index_size"] for stats in shards.values()),
+            "dimension": self.dimension,
+            "storage_path": self.data_dir,
+            "shard_count": len(shards),
+            "sealed_shards": len(self.sealed),
+            "shard_widths": self.shard_widths,
+            "retention_policy": self.retention_policy,
+            "query_cache": self.query_cache.get_stats(),
+            "shards": shards
+        }
+
+    def clear(self):
+        """Remove every shard"""
+        try:
+            with self._shards_lock:
+                for shard in self.shards.values():
+                    shard.clear()
+                    shard.close()
+                    shutil.rmtree(shard.data_dir, ignore_errors=True)
+                self.shards.clear()
+                self.bounds.clear()
+                self.sealed.clear()
+                self.key_shards.clear()
+
+            logger.info("🗑️ Sharded vector store cleared")
+
+        except Exception as e:
+            logger.error(f"❌ Failed to clear vector store: {e}")
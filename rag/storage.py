@@ -0,0 +1,526 @@
+"""
+Append-only Segment Storage for the Vector Store
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import numpy as np
+import faiss
+from typing import List, Dict, Any, Optional, Tuple
+from .document_table import DocumentTable, line_offsets
+from .index_factory import ADD_CHUNK_SIZE
+from .metadata_index import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+def dump_record(record: Dict[str, Any]) -> str:
+    """Serialize a document record as one compact JSON line"""
+    # Shared DocumentRecords are mappings rather than dicts
+    return json.dumps(record, separators=(',', ':'), default=dict) + "\n"
+
+def strip_embedding(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the document without its embedding, which lives in the vector files"""
+    if 'embedding' not in document:
+        return document
+    return {key: value for key, value in document.items() if key != 'embedding'}
+
+def fsync_file(f):
+    """Flush a file object and fsync it"""
+    f.flush()
+    os.fsync(f.fileno())
+
+def fsync_dir(directory: str):
+    """Make renames in a directory durable (not supported on every platform)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_atomic(path: str, writer):
+    """Write to a temporary file, fsync it, rename it over ``path`` and fsync the directory"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        writer(f)
+        fsync_file(f)
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(path) or '.')
+
+class SegmentStore:
+    """Base segment plus append-only write-ahead log (WAL) for vectors and documents.
+
+    Vectors are kept as raw float32 (``vectors.<gen>.npy`` for the base, a flat
+    binary file for the WAL) and document metadata as compact JSON lines
+    without embeddings, with a line offset table so rows can be read lazily.
+    With ``persist_index`` the base FAISS index is also written so it can be
+    memory-mapped at startup. Every add appends to the WAL, so ingest cost only
+    depends on the batch size. Compaction folds the WAL into a new base
+    generation and switches the manifest over to it in a single rename.
+
+    Appends and tombstones are buffered in memory and written by ``flush``,
+    which fsyncs the WAL; until then they are visible through ``read_rows``
+    but not durable. Every other file is written to a temporary path, fsynced
+    and renamed into place, so a crash never leaves a torn segment behind.
+    """
+
+    MANIFEST = "manifest.json"
+    LEGACY_INDEX = "vector_index.faiss"
+    LEGACY_DOCUMENTS = "documents.json"
+
+    def __init__(self, data_dir: str, dimension: int, persist_index: bool = False):
+        self.data_dir = data_dir
+        self.dimension = dimension
+        self.persist_index = persist_index
+        self.generation = 0
+        self.base_rows = 0
+        self.wal_rows = 0  # WAL rows including those not flushed yet
+        self.flushed_rows = 0
+        self._base_vectors = None  # (generation, mapped base vectors) for read_rows
+        self._pending = []  # (vectors, documents) batches appended since the last flush
+        self._pending_removed = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.min_compaction_rows = int(os.getenv('VECTOR_COMPACTION_MIN_ROWS', '5000'))
+        self.compaction_ratio = float(os.getenv('VECTOR_COMPACTION_RATIO', '0.5'))
+        self.max_wal_rows = None  # Upper bound on the WAL regardless of the base size
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name)
+
+    def _vectors_path(self, generation: int) -> str:
+        return self._path(f"vectors.{generation}.npy")
+
+    def _documents_path(self, generation: int) -> str:
+        return self._path(f"documents.{generation}.jsonl")
+
+    def _offsets_path(self, generation: int) -> str:
+        return self._path(f"documents.{generation}.offsets.npy")
+
+    def _metadata_path(self, generation: int) -> str:
+        return self._path(f"documents.{generation}.meta.npz")
+
+    def _index_path(self, generation: int) -> str:
+        return self._path(f"vector_index.{generation}.faiss")
+
+    def _wal_vectors_path(self, generation: int) -> str:
+        return self._path(f"vectors.{generation}.wal")
+
+    def _wal_documents_path(self, generation: int) -> str:
+        return self._path(f"documents.{generation}.wal")
+
+    def _removed_path(self, generation: int) -> str:
+        return self._path(f"removed.{generation}.wal")
+
+    def load(self) -> Tuple[Any, List[Dict[str, Any]]]:
+        """Load the base segment followed by the WAL written since it.
+
+        Returns an index holding every row and the matching document records
+        in insertion order. A persisted base index (e.g. a trained IVF/HNSW
+        index) is read as-is; otherwise a flat index is rebuilt from the
+        base vectors.
+        """
+        self._read_manifest()
+        if self.generation == 0:
+            base_vectors, base_documents = self._read_legacy()
+            index = self._flat_index(base_vectors)
+        else:
+            base_documents = self._read_records(self._documents_path(self.generation))
+            if os.path.exists(self._index_path(self.generation)):
+                index = faiss.read_index(self._index_path(self.generation))
+            else:
+                index = self._flat_index(np.load(self._vectors_path(self.generation)))
+        self.base_rows = len(base_documents)
+
+        wal_vectors, wal_documents = self._read_wal()
+        self.wal_rows = self.flushed_rows = len(wal_documents)
+        if len(wal_vectors):
+            index.add(wal_vectors)
+        return index, base_documents + wal_documents
+
+    def open_mapped(self) -> Tuple[Any, DocumentTable, np.ndarray]:
+        """Open the store without reading the base segment into memory.
+
+        The base index is memory-mapped read-only and documents are decoded
+        lazily by row, so startup cost is independent of the corpus size and
+        the page cache is shared by every process mapping the same files.
+        Returns (base_index, documents, wal_vectors); WAL vectors still have to
+        be added to a mutable index by the caller.
+        """
+        self._read_manifest()
+        if self.generation == 0 and os.path.exists(self._path(self.LEGACY_INDEX)):
+            self.compact()
+
+        documents = DocumentTable()
+        if self.generation == 0:
+            index = faiss.IndexFlatIP(self.dimension)
+        else:
+            index_path = self._index_path(self.generation)
+            if not os.path.exists(index_path):
+                vectors = np.load(self._vectors_path(self.generation), mmap_mode='r')
+                write_atomic(index_path, lambda f: self._write_index(self._flat_index(vectors), f))
+            try:
+                flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+                index = faiss.read_index(index_path, flags)
+            except RuntimeError:
+                # Not every index type can be mapped; fall back to reading it
+                index = faiss.read_index(index_path)
+
+            offsets_path = self._offsets_path(self.generation)
+            offsets = np.load(offsets_path, mmap_mode='r') if os.path.exists(offsets_path) else None
+            documents.attach(self._documents_path(self.generation), offsets)
+        self.base_rows = len(documents)
+
+        wal_vectors, wal_offsets = self._wal_extent()
+        documents.attach(self._wal_documents_path(self.generation), wal_offsets)
+        self.wal_rows = self.flushed_rows = len(wal_vectors)
+        return index, documents, wal_vectors
+
+    def load_metadata(self) -> Optional[MetadataIndex]:
+        """Metadata index saved with the base generation, if any"""
+        path = self._metadata_path(self.generation)
+        if self.generation == 0 or not os.path.exists(path):
+            return None
+        return MetadataIndex.load(path)
+
+    def read_vectors(self) -> np.ndarray:
+        """All persisted vectors, base followed by WAL, in row order"""
+        self._read_manifest()
+        if self.generation == 0:
+            base_vectors = self._read_legacy()[0]
+        else:
+            base_vectors = np.load(self._vectors_path(self.generation), mmap_mode='r')
+        return np.concatenate([base_vectors, self._wal_extent()[0]])
+
+    def read_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Float32 vectors for sorted row ids, read from the mapped base file, the
+        WAL and the appends not flushed yet.
+
+        Only the requested rows are paged in, so exact re-ranking works
+        without keeping full-precision vectors in memory. Requires a segment
+        generation (>= 1) for base rows.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._pending_lock:
+            flushed_rows = self.flushed_rows
+            pending = [vectors for vectors, _ in self._pending]
+        base_rows = rows[rows < self.base_rows]
+        wal_rows = rows[rows >= self.base_rows] - self.base_rows
+        pending_rows = wal_rows[wal_rows >= flushed_rows] - flushed_rows
+        wal_rows = wal_rows[wal_rows < flushed_rows]
+        parts = [np.empty((0, self.dimension), dtype='float32')]
+        if len(base_rows):
+            if self._base_vectors is None or self._base_vectors[0] != self.generation:
+                self._base_vectors = (self.generation,
+                                      np.load(self._vectors_path(self.generation), mmap_mode='r'))
+            parts.append(self._base_vectors[1][base_rows])
+        if len(wal_rows):
+            wal = np.memmap(self._wal_vectors_path(self.generation), dtype='float32', mode='r',
+                            shape=(flushed_rows, self.dimension))
+            parts.append(wal[wal_rows])
+        if len(pending_rows):
+            parts.append(np.concatenate(pending)[pending_rows])
+        return np.ascontiguousarray(np.concatenate(parts), dtype='float32')
+
+    def read_removed(self) -> np.ndarray:
+        """Sorted rows removed since the base generation was written"""
+        path = self._removed_path(self.generation)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=np.int64)
+        raw = np.fromfile(path, dtype=np.uint8)
+        # Ignore a torn trailing entry
+        return np.unique(raw[:len(raw) // 8 * 8].view(np.int64))
+
+    def append_removed(self, rows: np.ndarray):
+        """Record removed rows; they stay in the files until a compaction drops them.
+        Buffered until the next flush."""
+        with self._pending_lock:
+            self._pending_removed.append(np.array(rows, dtype=np.int64))
+
+    def _read_manifest(self):
+        manifest_path = self._path(self.MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                self.generation = json.load(f)['generation']
+            # A crash between the manifest switch and the cleanup leaves the previous generation behind
+            self._remove_generation(self.generation - 1)
+
+    def _read_legacy(self) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        """Read the pre-segment vector_index.faiss / documents.json layout"""
+        index_path = self._path(self.LEGACY_INDEX)
+        documents_path = self._path(self.LEGACY_DOCUMENTS)
+        if not os.path.exists(index_path):
+            return np.empty((0, self.dimension), dtype='float32'), []
+
+        index = faiss.read_index(index_path)
+        vectors = index.reconstruct_n(0, index.ntotal)
+        documents = []
+        if os.path.exists(documents_path):
+            with open(documents_path, 'r') as f:
+                documents = [strip_embedding(doc) for doc in json.load(f)]
+        rows = min(len(documents), len(vectors))
+        logger.info(f"📦 Migrating {rows} documents from legacy index files")
+        return vectors[:rows], documents[:rows]
+
+    def _wal_extent(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return WAL vectors and record line offsets, dropping any torn tail
+        left by an interrupted append"""
+        vectors_path = self._wal_vectors_path(self.generation)
+        documents_path = self._wal_documents_path(self.generation)
+
+        offsets = np.zeros(1, dtype=np.int64)
+        documents_bytes = 0
+        if os.path.exists(documents_path):
+            documents_bytes = os.path.getsize(documents_path)
+            offsets = line_offsets(np.fromfile(documents_path, dtype=np.uint8))
+
+        vectors = np.empty((0, self.dimension), dtype='float32')
+        vector_bytes = 0
+        if os.path.exists(vectors_path):
+            vector_bytes = os.path.getsize(vectors_path)
+            raw = np.fromfile(vectors_path, dtype='float32')
+            rows = raw.size // self.dimension
+            vectors = raw[:rows * self.dimension].reshape(rows, self.dimension)
+
+        rows = min(len(offsets) - 1, len(vectors))
+        if documents_bytes != offsets[rows] or vector_bytes != rows * self.dimension * 4:
+            logger.warning(f"⚠️ Truncating torn WAL tail to {rows} rows")
+            self._truncate(documents_path, int(offsets[rows]))
+            self._truncate(vectors_path, rows * self.dimension * 4)
+
+        return vectors[:rows], offsets[:rows + 1]
+
+    def _read_records(self, path: str) -> List[Dict[str, Any]]:
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            return [json.loads(line) for line in f]
+
+    def _read_wal(self) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        """Read the WAL vectors and parsed document records"""
+        vectors, _ = self._wal_extent()
+        documents = self._read_records(self._wal_documents_path(self.generation))
+        return vectors, documents
+
+    def _truncate(self, path: str, size: int):
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+    def append(self, vectors: np.ndarray, documents: List[Dict[str, Any]]):
+        """Append normalized vectors and their documents to the WAL buffer.
+
+        Nothing touches the disk here; the rows become durable on the next flush.
+        """
+        # The caller hands over ownership of the matrix, so buffer it without a copy
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(-1, self.dimension)
+        with self._pending_lock:
+            self._pending.append((vectors, documents))
+            self.wal_rows += len(documents)
+
+    @property
+    def dirty_rows(self) -> int:
+        """Appended and removed rows not flushed yet"""
+        with self._pending_lock:
+            return self.wal_rows - self.flushed_rows + sum(len(rows) for rows in self._pending_removed)
+
+    def flush(self) -> int:
+        """Write buffered appends and tombstones to the WAL and fsync it.
+
+        Documents are written before vectors, and a torn tail is dropped on
+        load, so a crash mid-flush loses at most the batches being flushed.
+        Appends may continue meanwhile. Returns the number of rows flushed.
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                pending = list(self._pending)
+                removed = list(self._pending_removed)
+            if not pending and not removed:
+                return 0
+
+            if pending:
+                with open(self._wal_documents_path(self.generation), 'a') as f:
+                    f.write("".join(dump_record(strip_embedding(doc))
+                                    for _, documents in pending for doc in documents))
+                    fsync_file(f)
+                with open(self._wal_vectors_path(self.generation), 'ab') as f:
+                    for vectors, _ in pending:
+                        f.write(vectors.tobytes())
+                    fsync_file(f)
+            if removed:
+                with open(self._removed_path(self.generation), 'ab') as f:
+                    for rows in removed:
+                        f.write(rows.tobytes())
+                    fsync_file(f)
+
+            rows = sum(len(documents) for _, documents in pending)
+            with self._pending_lock:
+                del self._pending[:len(pending)]
+                del self._pending_removed[:len(removed)]
+                self.flushed_rows += rows
+            return rows
+
+    def needs_compaction(self) -> bool:
+        """Compact once the WAL is large relative to the base.
+
+        Scaling the trigger with the base size keeps the amortized cost of
+        compaction per added document constant. ``max_wal_rows`` caps the
+        trigger for stores that replay the WAL on every startup.
+        """
+        threshold = max(self.min_compaction_rows, self.compaction_ratio * self.base_rows)
+        if self.max_wal_rows:
+            threshold = min(threshold, self.max_wal_rows)
+        return self.wal_rows >= threshold
+
+    def needs_purge(self, removed_rows: int) -> bool:
+        """Compact away removed rows once they exceed the minimum compaction size
+        or make up the compaction ratio of the store"""
+        total_rows = self.base_rows + self.wal_rows
+        return removed_rows > 0 and removed_rows >= min(self.min_compaction_rows,
+                                                        self.compaction_ratio * total_rows)
+
+    def compact(self, index=None, metadata: MetadataIndex = None, keep: np.ndarray = None):
+        """Write a new base generation and switch to it; see write_generation"""
+        self.commit(*self.write_generation(index, metadata, keep))
+
+    def write_generation(self, index=None, metadata: MetadataIndex = None,
+                         keep: np.ndarray = None) -> Tuple[int, int]:
+        """Write a new base generation from the current base and WAL.
+
+        Vectors and record lines are copied as raw bytes, so compaction never
+        decodes documents. ``keep``, when given, lists the sorted rows to
+        retain; the others are dropped and the survivors renumbered from 0.
+        ``index``, when given, must hold exactly the retained rows and is
+        persisted as the base index; otherwise a flat index is written only
+        if ``persist_index`` is set. ``metadata`` must also cover exactly the
+        retained rows.
+
+        The manifest is switched on disk, but this object keeps serving the
+        old generation until ``commit`` is called with the returned
+        (generation, rows), so readers can be moved over in one step.
+        """
+        self.flush()
+        old_generation = self.generation
+        new_generation = old_generation + 1
+
+        if old_generation == 0:
+            base_records = [dump_record(doc).encode() for doc in self._read_legacy()[1]]
+        else:
+            base_records = [self._documents_path(old_generation)]
+        vectors = self.read_vectors()
+        records = base_records + [self._wal_documents_path(old_generation)]
+        if keep is not None:
+            vectors = vectors[keep]
+
+        documents_path = self._documents_path(new_generation)
+        write_atomic(self._vectors_path(new_generation),
+                     lambda f: np.save(f, vectors))
+        write_atomic(documents_path,
+                     lambda f: self._copy_records(records, f, keep))
+        write_atomic(self._offsets_path(new_generation),
+                     lambda f: np.save(f, line_offsets(np.fromfile(documents_path, dtype=np.uint8))))
+        if index is not None or self.persist_index:
+            base_index = index if index is not None else self._flat_index(vectors)
+            write_atomic(self._index_path(new_generation),
+                         lambda f: self._write_index(base_index, f))
+        if metadata is not None:
+            write_atomic(self._metadata_path(new_generation), metadata.save)
+        if keep is None and os.path.exists(self._removed_path(old_generation)):
+            # Rows keep their numbers, so carry the tombstones over
+            write_atomic(self._removed_path(new_generation),
+                         lambda f: self._copy_records([self._removed_path(old_generation)], f))
+        # The manifest rename is the commit point for the new generation
+        write_atomic(self._path(self.MANIFEST),
+                     lambda f: f.write(json.dumps({"generation": new_generation}).encode()))
+        return new_generation, len(vectors)
+
+    def commit(self, generation: int, rows: int):
+        """Serve a generation written by write_generation and delete the previous one"""
+        old_generation = self.generation
+        with self._flush_lock:
+            self.generation = generation
+            self.base_rows = rows
+            self.wal_rows = self.flushed_rows = 0
+            self._base_vectors = None
+        self._remove_generation(old_generation)
+        logger.info(f"🗜️ Compacted vector store into generation {generation} ({rows} documents)")
+
+    def generation_vectors(self, generation: int) -> np.ndarray:
+        """Memory-mapped base vectors of a written generation"""
+        return np.load(self._vectors_path(generation), mmap_mode='r')
+
+    def _copy_records(self, records: List, f, keep: np.ndarray = None):
+        """Write record lines, given either as encoded lines or as files to copy.
+
+        With ``keep`` only those rows are written, one slice per run of
+        consecutive rows.
+        """
+        if keep is not None:
+            buffer = np.concatenate([np.empty(0, dtype=np.uint8)] + [
+                np.frombuffer(record, dtype=np.uint8) if isinstance(record, bytes)
+                else np.fromfile(record, dtype=np.uint8)
+                for record in records if isinstance(record, bytes) or os.path.exists(record)])
+            offsets = line_offsets(buffer)
+            for run in np.split(keep, np.flatnonzero(np.diff(keep) != 1) + 1):
+                if len(run):
+                    f.write(buffer[offsets[run[0]]:offsets[run[-1] + 1]].tobytes())
+            return
+        for record in records:
+            if isinstance(record, bytes):
+                f.write(record)
+            elif os.path.exists(record):
+                with open(record, 'rb') as source:
+                    shutil.copyfileobj(source, f)
+
+    def _flat_index(self, vectors: np.ndarray):
+        index = faiss.IndexFlatIP(self.dimension)
+        for start in range(0, len(vectors), ADD_CHUNK_SIZE):
+            index.add(np.ascontiguousarray(vectors[start:start + ADD_CHUNK_SIZE], dtype='float32'))
+        return index
+
+    def _write_index(self, index, f):
+        faiss.write_index(index, faiss.PyCallbackIOWriter(f.write))
+
+    def _remove_generation(self, generation: int):
+        paths = [self._wal_vectors_path(generation), self._wal_documents_path(generation),
+                 self._removed_path(generation)]
+        if generation == 0:
+            paths += [self._path(self.LEGACY_INDEX), self._path(self.LEGACY_DOCUMENTS)]
+        else:
+            paths += [self._vectors_path(generation), self._documents_path(generation),
+                      self._offsets_path(generation), self._index_path(generation),
+                      self._metadata_path(generation)]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """Remove every persisted generation, WAL and buffered append"""
+        with self._flush_lock:
+            self._remove_generation(self.generation)
+            manifest_path = self._path(self.MANIFEST)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            self.generation = 0
+            self.base_rows = 0
+            self.wal_rows = self.flushed_rows = 0
+            with self._pending_lock:
+                self._pending.clear()
+                self._pending_removed.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get storage statistics"""
+        return {
+            "generation": self.generation,
+            "base_rows": self.base_rows,
+            "wal_rows": self.wal_rows,
+            "dirty_rows": self.dirty_rows
+        }
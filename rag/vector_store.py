@@ -2,164 +2,762 @@
 Vector Store with FAISS for Efficient Similarity Search
 """
 
+import asyncio
+import atexit
 import logging
 import numpy as np
 import faiss
-import json
 import os
-from typing import List, Dict, Any
+import threading
+import time
+from contextlib import nullcontext
+from typing import List, Dict, Any, Callable
 from datetime import datetime
+from . import index_factory, retention
+from .chunking import collapse_chunks
+from .document_records import shared_records
+from .metadata_index import MetadataIndex
+from .query_cache import QueryCache
+from .rwlock import ReadWriteLock
+from .storage import SegmentStore
 
 logger = logging.getLogger(__name__)
 
 class VectorStore:
     """FAISS-based vector store for efficient similarity search"""
     
-    def __init__(self, embedder, dimension: int = None):
+    def __init__(self, embedder, dimension: int = None, data_dir: str = './data', mmap: bool = None,
+                 index_type: str = None, retention_policy: Dict[str, float] = None, rerank: bool = None,
+                 flush_interval: float = None):
         self.embedder = embedder
         self.dimension = dimension or int(os.getenv('VECTOR_DIMENSION', '1536'))
+        self.data_dir = data_dir
+        if mmap is None:
+            mmap = os.getenv('VECTOR_STORE_MMAP', 'false').lower() == 'true'
+        self.mmap = mmap
+        # Target backend; the store starts exact and is promoted past the threshold
+        self.index_type = (index_type or os.getenv('VECTOR_INDEX_TYPE', 'flat')).lower()
+        if self.index_type not in index_factory.INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{self.index_type}', expected one of {index_factory.INDEX_TYPES}")
+        self.promotion_threshold = int(os.getenv('VECTOR_INDEX_PROMOTION_THRESHOLD', '100000'))
+        # Filtered searches over at most this many rows score the candidates directly
+        self.exact_filter_rows = int(os.getenv('VECTOR_EXACT_FILTER_ROWS', '2048'))
+        # Re-score the top candidates of quantized indexes with the stored float32 vectors
+        if rerank is None:
+            rerank = os.getenv('VECTOR_RERANK', 'false').lower() == 'true'
+        self.rerank = rerank
+        self.rerank_factor = int(os.getenv('VECTOR_RERANK_FACTOR', '4'))
+        # Candidates fetched per requested hit, as chunks of one document collapse into one hit
+        self.chunk_overfetch = max(1, int(os.getenv('VECTOR_CHUNK_OVERFETCH', '4')))
         self.index = None
+        self.delta_index = None  # Mutable index for rows added on top of a mapped base
         self.documents = []
+        self.metadata_index = MetadataIndex()
+        self.query_cache = QueryCache()
+        # Seconds to keep documents per source ('*' for the rest), e.g. market_data=1h,*=7d
+        if retention_policy is None:
+            retention_policy = retention.parse_retention(os.getenv('VECTOR_RETENTION'))
+        self.retention_policy = retention_policy
+        self.retention_interval = float(os.getenv('VECTOR_RETENTION_INTERVAL', '60'))
+        self.removed = np.empty(0, dtype=np.int64)  # Expired or replaced rows hidden from search until purged
+        # Writes are flushed to disk in the background every interval seconds, or
+        # sooner once this many rows are dirty; an interval <= 0 flushes on every write
+        if flush_interval is None:
+            flush_interval = float(os.getenv('VECTOR_FLUSH_INTERVAL', '1.0'))
+        self.flush_interval = flush_interval
+        self.flush_rows = int(os.getenv('VECTOR_FLUSH_ROWS', '1000'))
+        # Writers serialize on _write_lock for their whole operation, including
+        # persistence; _state_lock is held exclusively only while the in-memory
+        # index, documents and metadata change, and shared by searches
+        self._write_lock = threading.RLock()
+        self._state_lock = ReadWriteLock()
+        self._promotion_thread = None
+        self._retention_thread = None
+        self._stop_retention = threading.Event()
+        self._flusher_thread = None
+        self._flush_requested = threading.Event()
+        self._stop_flusher = threading.Event()
+        self._exit_flush_registered = False
+        self._purges = 0  # Bumped whenever rows are renumbered
+        self.storage = SegmentStore(self.data_dir, self.dimension, persist_index=self.mmap)
+        if self.mmap:
+            # WAL rows are decoded at startup, so a mapped store bounds the WAL to keep startup flat
+            self.storage.max_wal_rows = int(os.getenv('VECTOR_MMAP_MAX_WAL_ROWS', '50000'))
         self.setup_index()
         
     def setup_index(self):
         """Initialize or load FAISS index"""
         try:
-            # Try to load existing index
-            if os.path.exists('./data/vector_index.faiss'):
-                self.index = faiss.read_index('./data/vector_index.faiss')
-                # Load documents metadata
-                if os.path.exists('./data/documents.json'):
-                    with open('./data/documents.json', 'r') as f:
-                        self.documents = json.load(f)
-                logger.info(f"✅ Loaded existing index with {len(self.documents)} documents")
+            if self.mmap:
+                self._open_mapped()
+                logger.info(f"✅ Mapped existing index with {len(self.documents)} documents")
             else:
-                # Create new index
-                self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
-                logger.info("✅ Created new FAISS index")
+                # Base index (flat rebuilt from vectors, or a persisted ANN index) plus the WAL
+                self.index, documents = self.storage.load()
+                self.documents = [shared_records.record(doc) for doc in documents]
+                index_factory.configure_search(self.index)
+                if self.rerank and self.storage.generation == 0 and self.storage.base_rows:
+                    # Re-ranking reads vectors from segment files, so migrate legacy ones now
+                    self.storage.compact()
+                
+                if self.documents:
+                    logger.info(f"✅ Loaded existing index with {len(self.documents)} documents "
+                                f"({self.storage.wal_rows} replayed from WAL)")
+                else:
+                    logger.info("✅ Created new FAISS index")
+            
+            self._load_metadata_index()
+            self._load_removed()
+            if self.mmap and self.storage.needs_compaction():
+                # A WAL grown beyond the bound (e.g. by a non-mapped run) is folded in once
+                self.compact()
+            self._maybe_promote()
+            
+            if self.retention_policy:
+                self.evict_expired()
+                self._start_retention()
                 
         except Exception as e:
             logger.error(f"❌ Index setup failed: {e}")
             # Create fallback index
             self.index = faiss.IndexFlatIP(self.dimension)
+            self.delta_index = faiss.IndexFlatIP(self.dimension) if self.mmap else None
+            self.documents = []
+            self.metadata_index = MetadataIndex()
+    
+    def _load_removed(self):
+        """Tombstones persisted since the last purge"""
+        removed = self.storage.read_removed()
+        self.removed = removed[removed < len(self.documents)]
+    
+    def _load_metadata_index(self):
+        """Use the metadata index saved with the base, then index the rows added since"""
+        metadata_index = self.storage.load_metadata()
+        if metadata_index is None or len(metadata_index) > len(self.documents):
+            metadata_index = MetadataIndex()
+        for row in range(len(metadata_index), len(self.documents)):
+            metadata_index.add(self.documents[row].get('metadata') or {})
+        self.metadata_index = metadata_index
+    
+    def _open_mapped(self):
+        """Memory-map the base segment; WAL rows go into an in-memory delta index"""
+        self.index, self.documents, wal_vectors = self.storage.open_mapped()
+        index_factory.configure_search(self.index)
+        self.delta_index = faiss.IndexFlatIP(self.dimension)
+        if len(wal_vectors):
+            self.delta_index.add(wal_vectors)
     
     def add_documents(self, documents: List[Dict[str, Any]]):
         """Add documents to vector store"""
         try:
-            if not documents:
+            embedding_matrix, valid_documents = self._prepare_documents(documents)
+            if not valid_documents:
                 return
-                
-            # Extract embeddings
-            embeddings = []
-            valid_documents = []
             
-            for doc in documents:
-                if 'embedding' in doc:
-                    embedding = doc['embedding']
-                else:
-                    embedding = self.embedder.embed(doc.get('content', ''))
-                
-                if len(embedding) == self.dimension:
-                    embeddings.append(embedding)
-                    valid_documents.append(doc)
+            with self._write_lock:
+                self._insert(embedding_matrix, valid_documents)
+            
+            self._after_write()
+            
+            logger.info(f"📚 Added {len(valid_documents)} documents to vector store")
             
-            if not embeddings:
+        except Exception as e:
+            logger.error(f"❌ Failed to add documents: {e}")
+    
+    def upsert_documents(self, documents: List[Dict[str, Any]], publish: Callable = None):
+        """Add documents, replacing any live document with the same (symbol, source).
+        
+        Documents without a symbol or source have no key and are simply added. When a
+        batch repeats a key, its last document wins, together with the other
+        chunks sharing its ``parent_id``. The replaced rows are
+        hidden from search in the same step the new ones become visible, and
+        reclaimed by the next purge. ``publish`` optionally returns a context
+        manager wrapped around that step, once the rows are persisted.
+        """
+        try:
+            embedding_matrix, valid_documents = self._prepare_documents(documents)
+            if not valid_documents:
                 return
-                
-            # Convert to numpy array
-            embedding_matrix = np.array(embeddings).astype('float32')
             
-            # Normalize for cosine similarity
-            faiss.normalize_L2(embedding_matrix)
+            latest = {}
+            groups = []
+            for position, doc in enumerate(valid_documents):
+                metadata = doc.get('metadata') or {}
+                key = (metadata.get('symbol'), metadata.get('source'))
+                groups.append(metadata.get('parent_id') or position)
+                latest[key if None not in key else position] = groups[-1]
+            winners = set(latest.values())
+            keep = [position for position, group in enumerate(groups) if group in winners]
+            if len(keep) < len(valid_documents):
+                embedding_matrix = embedding_matrix[keep]
+                valid_documents = [valid_documents[position] for position in keep]
             
-            # Add to index
-            self.index.add(embedding_matrix)
+            with self._write_lock:
+                replaced = [self._live_ids(self.metadata_index.select(symbol=key[0], source=key[1]))
+                            for key in latest if isinstance(key, tuple)]
+                replaced = self._insert(embedding_matrix, valid_documents,
+                                        np.concatenate(replaced) if replaced else None, publish)
             
-            # Store documents metadata
-            self.documents.extend(valid_documents)
+            self._after_write()
             
-            # Save index and documents
-            self._persist_data()
+            logger.info(f"📚 Upserted {len(valid_documents)} documents, replacing {len(replaced)}")
             
-            logger.info(f"📚 Added {len(valid_documents)} documents to vector store")
+        except Exception as e:
+            logger.error(f"❌ Failed to upsert documents: {e}")
+    
+    def remove_documents(self, symbol=None, source=None, since=None, until=None) -> int:
+        """Remove every live document matching the filters (same keys as ``search``).
+        
+        Returns the number of documents removed.
+        """
+        if symbol is None and source is None and since is None and until is None:
+            raise ValueError("remove_documents needs at least one filter; use clear() to remove everything")
+        try:
+            with self._write_lock:
+                ids = self.metadata_index.select(symbol=symbol, source=source, since=since, until=until)
+                removed = self._remove_rows(ids)
+            
+            self._after_write()
+            return len(removed)
             
         except Exception as e:
-            logger.error(f"❌ Failed to add documents: {e}")
+            logger.error(f"❌ Failed to remove documents: {e}")
+            return 0
+    
+    def _prepare_documents(self, documents: List[Dict[str, Any]]):
+        """Collect normalized embeddings, embedding documents that lack one"""
+        if not documents:
+            return None, []
+            
+        # Extract embeddings; documents without one are embedded in a single batch
+        missing = [doc.get('content', '') for doc in documents if 'embedding' not in doc]
+        computed = iter(self.embedder.embed_batch(missing) if missing else [])
+        embeddings = []
+        valid_documents = []
+        
+        for doc in documents:
+            embedding = doc['embedding'] if 'embedding' in doc else next(computed)
+            
+            if len(embedding) == self.dimension:
+                embeddings.append(embedding)
+                valid_documents.append(doc)
+        
+        if not embeddings:
+            return None, []
+            
+        # One contiguous float32 copy, owned by the store and normalized in place
+        embedding_matrix = np.array(embeddings, dtype='float32')
+        
+        # Normalize for cosine similarity
+        faiss.normalize_L2(embedding_matrix)
+        return embedding_matrix, valid_documents
+    
+    def _insert(self, embedding_matrix: np.ndarray, documents: List[Dict[str, Any]],
+                replaced: np.ndarray = None, publish: Callable = None) -> np.ndarray:
+        """Append rows to the WAL, then publish them to searches together with the
+        removal of ``replaced`` rows, inside ``publish()`` if given; caller holds
+        the write lock.
+        
+        Returns the rows newly removed.
+        """
+        # Append to the WAL instead of rewriting the whole store; searches keep running meanwhile
+        self._persist_data(embedding_matrix, documents)
+        replaced = np.setdiff1d(replaced if replaced is not None else [], self.removed).astype(np.int64)
+        if len(replaced):
+            self.storage.append_removed(replaced)
+        
+        # Store compact records, shared with the pipeline; vectors live only in the index and vector files
+        stored_documents = [shared_records.record(doc) for doc in documents]
+        
+        with publish() if publish else nullcontext(), self._state_lock.write():
+            # Add to index; a mapped base is read-only so new rows go to the delta
+            (self.delta_index if self.delta_index is not None else self.index).add(embedding_matrix)
+            self.documents.extend(stored_documents)
+            self.metadata_index.extend(stored_documents)
+            if len(replaced):
+                self.removed = np.union1d(self.removed, replaced)
+        return replaced
+    
+    def _remove_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Record tombstones, then hide the rows from searches; caller holds the write lock"""
+        rows = np.setdiff1d(rows, self.removed)
+        if len(rows):
+            self.storage.append_removed(rows)
+            with self._state_lock.write():
+                self.removed = np.union1d(self.removed, rows)
+        return rows
     
-    def search(self, query: str, k: int = 5, threshold: float = None) -> List[Dict[str, Any]]:
-        """Search for similar documents"""
+    def _after_write(self):
+        """Hand the write to the flusher, waking it early when enough rows are dirty
+        or compaction is due, then consider promotion"""
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._start_flusher()
+            if (self.storage.dirty_rows >= self.flush_rows or self.storage.needs_compaction()
+                    or self.storage.needs_purge(len(self.removed))):
+                self._flush_requested.set()
+        self._maybe_promote()
+    
+    def search(self, query: str, k: int = 5, threshold: float = None, symbol=None, source=None,
+               since=None, until=None) -> List[Dict[str, Any]]:
+        """Search for similar documents, optionally restricted by metadata.
+        
+        ``symbol``/``source`` take a value or list of values; ``since``/``until``
+        take ISO strings, datetimes or epoch seconds. Filters are applied inside
+        the FAISS search, so the top-k is drawn from matching documents only.
+        """
         try:
-            if threshold is None:
-                threshold = float(os.getenv('SIMILARITY_THRESHOLD', 0.7))
-                
             if not self.documents:
                 return []
             
-            # Generate query embedding
-            query_embedding = self.embedder.embed(query)
-            query_vector = np.array([query_embedding]).astype('float32')
+            # Generate the normalized query embedding unless it is cached
+            vectors, missing = self.query_cache.lookup([query])
+            query_vector = self.query_cache.complete([query], vectors, missing,
+                                                     [self.embedder.embed(text) for text in missing])
+            
+            results = self.search_vectors(query_vector, k, threshold, filters={
+                "symbol": symbol, "source": source, "since": since, "until": until})[0]
+            
+            logger.info(f"🔍 Search found {len(results)} results for query: {query}")
+            return results
+            
+        except Exception as e:
+            logger.error(f"❌ Search failed: {e}")
+            return []
+    
+    def search_batch(self, queries: List[str], k: int = 5, threshold: float = None,
+                     filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Search several queries at once, returning one result list per query.
+        
+        All queries are embedded with a single ``embed_batch`` call and
+        searched as one matrix, so per-query overhead is paid once per batch.
+        ``filters`` takes the same keys as ``search`` and applies to every query.
+        """
+        try:
+            if not queries:
+                return []
+            if not self.documents:
+                return [[] for _ in queries]
+            
+            vectors, missing = self.query_cache.lookup(queries)
+            query_matrix = self.query_cache.complete(queries, vectors, missing,
+                                                     self.embedder.embed_batch(missing) if missing else [])
+            results = self.search_vectors(query_matrix, k, threshold, filters)
             
-            # Normalize for cosine similarity
-            faiss.normalize_L2(query_vector)
+            logger.info(f"🔍 Batch search found {sum(len(r) for r in results)} results for {len(queries)} queries")
+            return results
             
-            # Search
-            scores, indices = self.index.search(query_vector, min(k, len(self.documents)))
+        except Exception as e:
+            logger.error(f"❌ Batch search failed: {e}")
+            return [[] for _ in queries]
+    
+    async def asearch(self, query: str, k: int = 5, threshold: float = None, symbol=None, source=None,
+                      since=None, until=None) -> List[Dict[str, Any]]:
+        """Async search: the query is embedded with ``aembed`` and the FAISS search
+        runs on the default executor, so the event loop is never blocked"""
+        try:
+            if not self.documents:
+                return []
+            vectors, missing = self.query_cache.lookup([query])
+            query_vector = self.query_cache.complete([query], vectors, missing,
+                                                     [await self.embedder.aembed(text) for text in missing])
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, self.search_vectors, query_vector, k, threshold,
+                {"symbol": symbol, "source": source, "since": since, "until": until})
+            return results[0]
             
-            # Format results
+        except Exception as e:
+            logger.error(f"❌ Search failed: {e}")
+            return []
+    
+    async def asearch_batch(self, queries: List[str], k: int = 5, threshold: float = None,
+                            filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Async search_batch, embedding with ``aembed_batch``"""
+        try:
+            if not queries:
+                return []
+            if not self.documents:
+                return [[] for _ in queries]
+            vectors, missing = self.query_cache.lookup(queries)
+            query_matrix = self.query_cache.complete(queries, vectors, missing,
+                                                     await self.embedder.aembed_batch(missing) if missing else [])
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.search_vectors, query_matrix, k, threshold, filters)
+            
+        except Exception as e:
+            logger.error(f"❌ Batch search failed: {e}")
+            return [[] for _ in queries]
+    
+    def search_vectors(self, query_vectors: np.ndarray, k: int = 5, threshold: float = None,
+                       filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Run one FAISS search for a matrix of normalized query embeddings and
+        format each row's hits; ``filters`` takes the same keys as ``search``.
+        
+        Runs under the shared state lock, so it sees either all or none of a
+        concurrent write and never waits on persistence.
+        """
+        if threshold is None:
+            threshold = float(os.getenv('SIMILARITY_THRESHOLD', 0.7))
+        
+        with self._state_lock.read():
+            return self._search_vectors(query_vectors, k, threshold, filters)
+    
+    def _search_vectors(self, query_vectors: np.ndarray, k: int, threshold: float,
+                        filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        ids = self._live_ids(self.metadata_index.select(**(filters or {})))
+        if not self.documents or (ids is not None and not len(ids)):
+            return [[] for _ in query_vectors]
+        
+        # Search; extra candidates leave k documents after chunks of one document are collapsed
+        fetch = min(k * self.chunk_overfetch, len(self.documents))
+        if self._reranking():
+            _, candidates = self._search_index(query_vectors, min(fetch * self.rerank_factor, len(self.documents)), ids)
+            scores, indices = index_factory.rerank(query_vectors, candidates, self.storage.read_rows, fetch)
+        else:
+            scores, indices = self._search_index(query_vectors, fetch, ids)
+        
+        # Format results
+        batch_results = []
+        for row_scores, row_indices in zip(scores, indices):
             results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self.documents) and score >= threshold:
+            for score, idx in zip(row_scores, row_indices):
+                if 0 <= idx < len(self.documents) and score >= threshold:
                     doc = self.documents[idx]
                     results.append({
                         **doc,
                         "similarity_score": float(score)
                     })
             
-            # Sort by score descending
+            # Sort by score descending, one hit per chunked document
             results.sort(key=lambda x: x['similarity_score'], reverse=True)
+            batch_results.append(collapse_chunks(results)[:k])
+        
+        return batch_results
+    
+    def _reranking(self) -> bool:
+        return self.rerank and index_factory.index_type_of(self.index) in index_factory.QUANTIZED_TYPES
+    
+    def _live_ids(self, ids: np.ndarray = None) -> np.ndarray:
+        """Drop removed rows from a filter selection"""
+        if ids is None or not len(self.removed):
+            return ids
+        return ids[~np.isin(ids, self.removed, assume_unique=True)]
+    
+    def _search_index(self, query_vectors: np.ndarray, k: int, ids: np.ndarray = None):
+        """Search the base index and, if present, the delta index, merging the top-k.
+        
+        ``ids`` restricts the search to those rows through FAISS ID selectors;
+        small candidate sets are scored exactly instead, which is cheaper and
+        avoids the recall loss of graph indexes under selective filters.
+        Without ``ids``, removed rows are excluded by a selector instead.
+        """
+        excluded = self.removed if ids is None and len(self.removed) else None
+        if ids is not None:
+            k = min(k, len(ids))
+            if len(ids) <= self.exact_filter_rows:
+                try:
+                    return self._score_rows(query_vectors, k, ids)
+                except RuntimeError:
+                    pass  # Index cannot reconstruct vectors (e.g. IVF without a direct map)
+        
+        base_rows = self.index.ntotal
+        parts = [self._search_part(self.index, query_vectors, k, None if ids is None else ids[ids < base_rows],
+                                   None if excluded is None else excluded[excluded < base_rows])]
+        if self.delta_index is not None and self.delta_index.ntotal:
+            delta_ids = None if ids is None else ids[ids >= base_rows] - base_rows
+            delta_excluded = None if excluded is None else excluded[excluded >= base_rows] - base_rows
+            delta_scores, delta_indices = self._search_part(self.delta_index, query_vectors, k, delta_ids,
+                                                            delta_excluded)
+            parts.append((delta_scores, np.where(delta_indices >= 0, delta_indices + base_rows, -1)))
+        if len(parts) == 1:
+            return parts[0]
+        
+        scores = np.hstack([part[0] for part in parts])
+        indices = np.hstack([part[1] for part in parts])
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+    
+    def _search_part(self, index, query_vectors: np.ndarray, k: int, ids: np.ndarray = None,
+                     excluded: np.ndarray = None):
+        if ids is None:
+            if excluded is None or not len(excluded):
+                return index.search(query_vectors, k)
+            selector = index_factory.exclusion_selector(excluded)
+            return index.search(query_vectors, k, params=index_factory.search_parameters(index, selector))
+        if not len(ids):
+            return (np.full((len(query_vectors), k), -np.inf, dtype='float32'),
+                    np.full((len(query_vectors), k), -1, dtype='int64'))
+        selector = index_factory.id_selector(ids)
+        return index.search(query_vectors, k, params=index_factory.search_parameters(index, selector))
+    
+    def _score_rows(self, query_vectors: np.ndarray, k: int, ids: np.ndarray):
+        """Exact inner-product top-k over the given rows"""
+        scores = query_vectors @ self._reconstruct_rows(ids).T
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(scores, order, axis=1), ids[order]
+    
+    def _persist_data(self, embedding_matrix: np.ndarray, documents: List[Dict[str, Any]]):
+        """Append new vectors and documents to the WAL buffer"""
+        try:
+            self.storage.append(embedding_matrix, documents)
+        except Exception as e:
+            logger.error(f"❌ Data persistence failed: {e}")
+    
+    def flush(self) -> int:
+        """Write buffered rows and tombstones to disk and fsync them, then compact
+        or purge if the WAL or tombstones have grown.
+        
+        Runs on the background flusher; call it on graceful shutdown so no
+        acknowledged write is lost. Returns the number of rows flushed.
+        """
+        try:
+            rows = self.storage.flush()
+            if self.storage.needs_compaction() or self.storage.needs_purge(len(self.removed)):
+                self.compact()
+            return rows
+        except Exception as e:
+            logger.error(f"❌ Flush failed: {e}")
+            return 0
+    
+    def _start_flusher(self):
+        """Start the background flusher on the first write"""
+        if self._flusher_thread is not None and self._flusher_thread.is_alive():
+            return
+        self._stop_flusher.clear()
+        self._flusher_thread = threading.Thread(target=self._flush_loop, name="vector-flusher", daemon=True)
+        self._flusher_thread.start()
+        if not self._exit_flush_registered:
+            # Once per instance; close() unregisters it so the store can be collected
+            atexit.register(self.flush)
+            self._exit_flush_registered = True
+    
+    def _flush_loop(self):
+        while not self._stop_flusher.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+    
+    def close(self):
+        """Flush pending writes and stop the background threads"""
+        self.stop_retention()
+        self._stop_flusher.set()
+        self._flush_requested.set()
+        if self._flusher_thread is not None:
+            self._flusher_thread.join()
+        if self._exit_flush_registered:
+            atexit.unregister(self.flush)
+            self._exit_flush_registered = False
+        self.flush()
+    
+    def compact(self):
+        """Fold the WAL into a new base segment, dropping removed rows"""
+        try:
+            with self._write_lock:
+                # Promotion copies rows by position, so removed rows wait until it is done
+                if len(self.removed) and not self._promoting():
+                    self._purge()
+                    purged = True
+                else:
+                    written = self.storage.write_generation(self._index_for_compaction(), self.metadata_index)
+                    with self._state_lock.write():
+                        self.storage.commit(*written)
+                        if self.mmap:
+                            # Re-map so the delta folded into the new base is released
+                            self._open_mapped()
+                    purged = False
+            if purged:
+                self._maybe_promote()
+        except Exception as e:
+            logger.error(f"❌ Compaction failed: {e}")
+    
+    def _purge(self):
+        """Rewrite the store without removed rows, renumbering the survivors.
+        
+        The new base is flat; an ANN target index is rebuilt by the usual
+        background promotion once the store is still large enough.
+        """
+        keep = np.setdiff1d(np.arange(len(self.documents)), self.removed, assume_unique=True)
+        metadata_index = self.metadata_index.take(keep)
+        generation, rows = self.storage.write_generation(None, metadata_index, keep=keep)
+        if not self.mmap:
+            index = index_factory.build_index('flat', self.dimension, self.storage.generation_vectors(generation))
+            documents = [self.documents[row] for row in keep]
+        
+        # Searches keep using the old rows until the renumbered ones are swapped in
+        with self._state_lock.write():
+            self.storage.commit(generation, rows)
+            if self.mmap:
+                self._open_mapped()
+            else:
+                self.index = index
+                self.documents = documents
+            self.metadata_index = metadata_index
+            purged = len(self.removed)
+            self.removed = np.empty(0, dtype=np.int64)
+            self._purges += 1
+        
+        logger.info(f"🧹 Purged {purged} removed documents, {len(keep)} remain")
+    
+    def evict_expired(self, now: float = None) -> int:
+        """Hide documents older than their source's retention window from search,
+        purging them from the index and storage once enough have expired.
+        
+        Returns the number of newly evicted documents.
+        """
+        if not self.retention_policy:
+            return 0
+        try:
+            now = time.time() if now is None else now
+            with self._write_lock:
+                expired = retention.expired_rows(self.metadata_index, self.retention_policy, now)
+                evicted = self._remove_rows(expired)
+                if len(evicted):
+                    logger.info(f"⏳ Evicted {len(evicted)} expired documents")
+                needs_purge = self.storage.needs_purge(len(self.removed))
             
-            logger.info(f"🔍 Search found {len(results)} results for query: {query}")
-            return results
+            if needs_purge:
+                self.compact()
+            return len(evicted)
             
         except Exception as e:
-            logger.error(f"❌ Search failed: {e}")
-            return []
+            logger.error(f"❌ Eviction failed: {e}")
+            return 0
     
-    def _persist_data(self):
-        """Persist index and documents to disk"""
+    def _start_retention(self):
+        """Run eviction periodically in the background"""
+        if self._retention_thread is not None and self._retention_thread.is_alive():
+            return
+        self._stop_retention.clear()
+        self._retention_thread = threading.Thread(target=self._retention_loop, name="vector-retention",
+                                                  daemon=True)
+        self._retention_thread.start()
+    
+    def _retention_loop(self):
+        while not self._stop_retention.wait(self.retention_interval):
+            self.evict_expired()
+    
+    def stop_retention(self):
+        """Stop the background eviction thread"""
+        self._stop_retention.set()
+    
+    def _index_for_compaction(self):
+        """Index to persist with the new base; flat indexes are rebuilt from vectors instead"""
+        if isinstance(self.index, faiss.IndexFlat):
+            return None
+        if self.delta_index is None or not self.delta_index.ntotal:
+            return self.index
+        # A mapped base is read-only, so fold the delta into a copy
+        index = faiss.clone_index(self.index)
+        index.add(self.delta_index.reconstruct_n(0, self.delta_index.ntotal))
+        return index
+    
+    def _maybe_promote(self):
+        """Start background promotion to the configured ANN index once the store is large enough"""
+        if (self.index_type == 'flat' or not isinstance(self.index, faiss.IndexFlat)
+                or self._index_size() < self.promotion_threshold or self._promoting()):
+            return
+        self._promotion_thread = threading.Thread(target=self._promote, name="vector-index-promotion",
+                                                  daemon=True)
+        self._promotion_thread.start()
+    
+    def _promoting(self) -> bool:
+        return self._promotion_thread is not None and self._promotion_thread.is_alive()
+    
+    def _promote(self):
+        """Train and fill the target index off the write path, then swap it in.
+
+        Rows are copied out in chunks under the write lock and added outside
+        it, so ingest keeps running; only the final catch-up and the swap
+        hold the lock.
+        """
         try:
-            # Create data directory if it doesn't exist
-            os.makedirs('./data', exist_ok=True)
+            started = time.time()
+            purges = self._purges
+            n_rows = self._index_size()
+            index = index_factory.create_index(self.index_type, self.dimension, n_rows)
+            if not index.is_trained:
+                with self._write_lock:
+                    if self._purges != purges:
+                        return
+                    sample = self._reconstruct_rows(index_factory.training_rows(n_rows))
+                index.train(sample)
             
-            # Save FAISS index
-            faiss.write_index(self.index, './data/vector_index.faiss')
+            start = 0
+            while True:
+                with self._write_lock:
+                    if self._purges != purges:
+                        # Rows were renumbered under us; the purge restarts promotion
+                        return
+                    end = self._index_size()
+                    if end - start <= index_factory.ADD_CHUNK_SIZE:
+                        if end > start:
+                            index.add(self._reconstruct_rows(np.arange(start, end)))
+                        with self._state_lock.write():
+                            self.index = index
+                            if self.delta_index is not None:
+                                self.delta_index = faiss.IndexFlatIP(self.dimension)
+                        break
+                    vectors = self._reconstruct_rows(np.arange(start, start + index_factory.ADD_CHUNK_SIZE))
+                index.add(vectors)
+                start += index_factory.ADD_CHUNK_SIZE
+            
+            logger.info(f"🚀 Promoted vector index to {self.index_type} with {index.ntotal} rows "
+                        f"in {time.time() - started:.1f}s")
             
-            # Save documents metadata
-            with open('./data/documents.json', 'w') as f:
-                json.dump(self.documents, f, indent=2)
-                
         except Exception as e:
-            logger.error(f"❌ Data persistence failed: {e}")
+            logger.error(f"❌ Index promotion failed: {e}")
+    
+    def _reconstruct_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Copy the stored vectors for sorted row ids out of the base and delta indexes"""
+        rows = np.asarray(rows, dtype='int64')
+        base_rows = self.index.ntotal
+        parts = [self.index.reconstruct_batch(rows[rows < base_rows])]
+        if self.delta_index is not None:
+            parts.append(self.delta_index.reconstruct_batch(rows[rows >= base_rows] - base_rows))
+        return np.ascontiguousarray(np.concatenate(parts), dtype='float32')
     
     def get_stats(self) -> Dict[str, Any]:
         """Get vector store statistics"""
         return {
             "total_documents": len(self.documents),
-            "index_size": self.index.ntotal if self.index else 0,
+            "index_size": self._index_size(),
             "dimension": self.dimension,
-            "storage_path": "./data/"
+            "storage_path": self.data_dir,
+            "storage": self.storage.get_stats(),
+            "metadata_index": self.metadata_index.get_stats(),
+            "mmap": self.mmap,
+            "index_type": index_factory.index_type_of(self.index),
+            "target_index_type": self.index_type,
+            "promoting": self._promoting(),
+            "rerank": self._reranking(),
+            "removed_documents": len(self.removed),
+            "retention_policy": self.retention_policy,
+            "flush_interval": self.flush_interval,
+            "query_cache": self.query_cache.get_stats()
         }
     
+    def _index_size(self) -> int:
+        if not self.index:
+            return 0
+        return self.index.ntotal + (self.delta_index.ntotal if self.delta_index is not None else 0)
+    
     def clear(self):
         """Clear all documents from vector store"""
         try:
-            self.index.reset()
-            self.documents.clear()
-            
-            # Remove persisted files
-            for file in ['./data/vector_index.faiss', './data/documents.json']:
-                if os.path.exists(file):
-                    os.remove(file)
+            with self._write_lock, self._state_lock.write():
+                if self.mmap:
+                    # The mapped base is read-only, so start from fresh indexes
+                    self.index = faiss.IndexFlatIP(self.dimension)
+                    self.delta_index = faiss.IndexFlatIP(self.dimension)
+                else:
+                    self.index.reset()
+                self.documents.clear()
+                self.metadata_index.clear()
+                self.removed = np.empty(0, dtype=np.int64)
+                
+                # Remove persisted segments and WAL
+                self.storage.clear()
             
             logger.info("🗑️ Vector store cleared")
             
@@ -4,6 +4,9 @@ Tests for RAG Components
 
 import pytest
 import numpy as np
+import os
+import time
+from datetime import datetime
 from backend.rag.embeddings import Embedder
 from backend.rag.vector_store import VectorStore
 from backend.rag.rag_engine import RAGEngine
@@ -21,9 +24,9 @@ def test_embedder_functionality():
     text = "Test financial market analysis"
     embedding = embedder.embed(text)
     
-    assert isinstance(embedding, list)
-    assert len(embedding) == embedder.dimension
-    assert all(isinstance(x, float) for x in embedding)
+    assert isinstance(embedding, np.ndarray)
+    assert embedding.shape == (embedder.dimension,)
+    assert embedding.dtype == np.float32
 
 def test_vector_store_initialization():
     """Test vector store initialization"""
@@ -127,4 +130,1070 @@ def test_batch_operations():
     
     embeddings = embedder.embed_batch(texts)
     assert len(embeddings) == 3
-    assert all(len(emb) == embedder.dimension for emb in embeddings)
\ No newline at end of file
+    assert all(len(emb) == embedder.dimension for emb in embeddings)
+
+def test_embedding_cache(tmp_path):
+    """Test repeated text is embedded once and cached embeddings survive a restart"""
+    from backend.rag.embedding_cache import EmbeddingCache
+    
+    class CountingModel:
+        def __init__(self):
+            self.encoded = []
+        
+        def encode(self, texts):
+            self.encoded.extend(texts)
+            return np.array([[float(len(text)), 1.0, 0.0] for text in texts])
+    
+    embedder = Embedder()
+    embedder.embedder_type = "local"
+    embedder.model = CountingModel()
+    embedder.cache = EmbeddingCache("local", "counting", max_entries=2, path=str(tmp_path / "cache.sqlite"))
+    
+    assert embedder.embed("AAPL beats estimates").tolist() == [20.0, 1.0, 0.0]
+    assert embedder.embed("AAPL beats estimates").tolist() == [20.0, 1.0, 0.0]
+    embeddings = embedder.embed_batch(["Fed holds rates", "AAPL beats estimates", "Fed holds rates", "Oil slips"])
+    assert embeddings.shape == (4, 3) and embeddings.dtype == np.float32
+    assert embeddings[0].tolist() == embeddings[2].tolist() == [15.0, 1.0, 0.0]
+    assert embedder.model.encoded == ["AAPL beats estimates", "Fed holds rates", "Oil slips"]
+    
+    stats = embedder.get_stats()["cache"]
+    assert (stats["hits"], stats["misses"], stats["memory_entries"]) == (2, 4, 2)
+    
+    # The least recently used entry was evicted from memory but is still on disk
+    reopened = EmbeddingCache("local", "counting", max_entries=2, path=str(tmp_path / "cache.sqlite"))
+    assert reopened.get("AAPL beats estimates").tolist() == [20.0, 1.0, 0.0]
+    assert reopened.get("Unseen headline") is None
+    assert EmbeddingCache("openai", "counting", path=str(tmp_path / "cache.sqlite")).get("Oil slips") is None
+    assert (reopened.get_stats()["disk_hits"], reopened.get_stats()["misses"]) == (1, 1)
+
+
+def test_batching_embedder():
+    """Test concurrent embed() calls are coalesced into batched calls"""
+    import asyncio
+    import threading
+    from backend.rag.embedding_batcher import BatchingEmbedder
+    
+    class RecordingEmbedder:
+        dimension = 2
+        
+        def __init__(self):
+            self.batches = []
+        
+        def embed_batch(self, texts):
+            self.batches.append(list(texts))
+            time.sleep(0.01)
+            return [[float(len(text)), 0.0] for text in texts]
+    
+    recording = RecordingEmbedder()
+    batcher = BatchingEmbedder(recording, max_batch_size=8, max_wait_ms=50)
+    assert batcher.dimension == 2
+    
+    results = {}
+    def worker(i):
+        results[i] = batcher.embed("x" * i)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(1, 21)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert results == {i: [float(i), 0.0] for i in range(1, 21)}
+    assert max(len(batch) for batch in recording.batches) <= 8
+    assert len(recording.batches) < 20
+    assert asyncio.run(batcher.aembed("abc")) == [3.0, 0.0]
+    
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.embed("closed")
+
+
+def test_async_embedding_path(tmp_path):
+    """Test aembed/aembed_batch stay within the concurrency limit and feed async search"""
+    import asyncio
+    
+    class SlowModel:
+        def __init__(self):
+            self.active = 0
+            self.peak = 0
+        
+        def encode(self, texts):
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            time.sleep(0.02)
+            self.active -= 1
+            return np.array([[1.0, float(len(text))] + [0.0] * 382 for text in texts])
+    
+    embedder = Embedder()
+    embedder.embedder_type = "local"
+    embedder.model = SlowModel()
+    embedder.max_concurrency = 2
+    
+    async def embed_concurrently():
+        # The event loop keeps running while the model works on the executor
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+        task = asyncio.create_task(ticker())
+        results = await asyncio.gather(*(embedder.aembed("x" * i) for i in range(6)),
+                                       embedder.aembed_batch(["ab", "abc"]))
+        task.cancel()
+        return results, ticks
+    
+    results, ticks = asyncio.run(embed_concurrently())
+    assert [result[1] for result in results[:6]] == [float(i) for i in range(6)]
+    assert [embedding[1] for embedding in results[6]] == [2.0, 3.0]
+    assert embedder.model.peak <= 2
+    assert ticks > 0
+    
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    vector_store.add_documents([{"content": "ab", "embedding": embedder.embed("ab"), "metadata": {"source": "test"}}])
+    results = asyncio.run(vector_store.asearch("ab", k=1, threshold=-1.0))
+    assert [doc["content"] for doc in results] == ["ab"]
+    assert asyncio.run(vector_store.asearch_batch(["ab", "abc"], k=1, threshold=-1.0))[1][0]["content"] == "ab"
+
+
+def test_query_cache(tmp_path, monkeypatch):
+    """Test repeated and equivalent queries skip the embedding call until the TTL expires"""
+    from backend.rag.query_cache import QueryCache
+    
+    cache = QueryCache(max_entries=2, ttl=60)
+    assert cache.normalize("  Apple   PRICE ") == cache.normalize("$AAPL price") == "aapl price"
+    assert cache.normalize("bitcoin outlook") == "btc-usd outlook"
+    
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    vector_store.add_documents([{"content": "AAPL rallies", "embedding": embedder.embed("AAPL rallies"),
+                                 "metadata": {"source": "test", "symbol": "AAPL"}}])
+    vector_store.query_cache = cache
+    
+    calls = []
+    query_embedding = embedder.embed("AAPL price")
+    def embed(text):
+        calls.append(text)
+        return query_embedding
+    monkeypatch.setattr(embedder, "embed", embed)
+    
+    first = vector_store.search("AAPL price", k=1, threshold=-1.0)
+    assert vector_store.search("apple  price", k=1, threshold=-1.0) == first
+    assert vector_store.search("$aapl PRICE", k=1, threshold=-1.0) == first
+    assert calls == ["AAPL price"]
+    assert cache.get_stats()["hits"] == 2
+    
+    # Size bound evicts the least recently used key, TTL expires the rest
+    cache.put("market overview", query_embedding)
+    cache.put("daily briefing", query_embedding)
+    assert cache.get("AAPL price") is None
+    cache.ttl = -1
+    cache.put("market overview", query_embedding)
+    assert cache.get("market overview") is None
+
+    # Vectors from the fallback after a provider error are served but not cached
+    from backend.rag.hashing_embedder import is_fallback
+    class FailingModel:
+        def encode(self, texts):
+            raise RuntimeError("provider down")
+    failing = Embedder()
+    failing.model = FailingModel()
+    failing.cache = None
+    assert is_fallback(failing.embed_batch(["TSLA price", "TSLA volume"]))
+    monkeypatch.setattr(embedder, "embed", lambda text: calls.append(text) or failing.embed(text))
+    cache.ttl = 60
+    assert len(vector_store.search("TSLA price", k=1, threshold=-1.0)) == 1
+    assert len(vector_store.search("TSLA price", k=1, threshold=-1.0)) == 1
+    assert calls[-2:] == ["TSLA price", "TSLA price"]
+    assert cache.get("TSLA price") is None
+
+
+def test_hashing_embedder(monkeypatch):
+    """Test the feature-hashing embedder is deterministic and ranks related text higher"""
+    from backend.rag.hashing_embedder import HashingEmbedder
+    
+    hashing = HashingEmbedder(dimension=256)
+    apple, apple_again, oil = hashing.embed_batch([
+        "Apple shares rise on strong iPhone sales",
+        "iPhone sales lift Apple shares",
+        "Oil prices slump as OPEC raises output"])
+    assert apple.shape == (256,) and apple.dtype == np.float32
+    assert np.linalg.norm(apple) == pytest.approx(1.0)
+    assert apple @ apple_again > apple @ oil + 0.3
+    assert np.array_equal(HashingEmbedder(dimension=256).embed("Oil prices slump as OPEC raises output"), oil)
+    
+    monkeypatch.setenv("EMBEDDER_TYPE", "hashing")
+    monkeypatch.setenv("VECTOR_DIMENSION", "64")
+    embedder = Embedder()
+    assert embedder.cache is None
+    assert len(embedder.embed("AAPL")) == 64
+    assert np.array_equal(embedder.embed("AAPL"), embedder.embed_batch(["AAPL"])[0])
+
+
+def test_embedding_pool():
+    """Test the process pool shards batches across workers and returns vectors in order"""
+    from functools import partial
+    from backend.rag.embedding_pool import EmbeddingPool
+    from backend.rag.hashing_embedder import HashingEmbedder
+    
+    pool = EmbeddingPool("hashing", dimension=32, workers=2, min_chunk=4,
+                         model_factory=partial(HashingEmbedder, 32))
+    try:
+        texts = [f"Pooled document {i} about {topic}" for i, topic in enumerate(["rates", "oil", "chips"] * 7)]
+        embeddings = pool.encode(texts)
+        assert embeddings.shape == (21, 32) and embeddings.dtype == np.float32
+        assert np.allclose(embeddings, HashingEmbedder(32).embed_batch(texts))
+        assert pool.encode([]).shape == (0, 32)
+        assert pool.get_stats()["texts"] == 21
+    finally:
+        pool.close()
+
+
+def test_vector_store_wal_persistence(tmp_path):
+    """Test WAL replay and compaction across restarts"""
+    embedder = Embedder()
+    # Flush on every write, so compaction does not depend on the background flusher's timing
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path), flush_interval=0)
+    vector_store.storage.min_compaction_rows = 3
+    
+    for i in range(5):
+        text = f"Document number {i} about market trends"
+        vector_store.add_documents([{
+            "content": text,
+            "embedding": embedder.embed(text),
+            "metadata": {"source": "test", "symbol": None}
+        }])
+    vector_store.flush()
+    
+    stats = vector_store.get_stats()["storage"]
+    assert stats["generation"] == 1
+    assert stats["dirty_rows"] == 0
+    assert stats["base_rows"] + stats["wal_rows"] == 5
+    
+    assert all("embedding" not in doc for doc in vector_store.documents)
+    assert (tmp_path / "vectors.1.npy").exists()
+    
+    reloaded = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    assert reloaded.get_stats()["total_documents"] == 5
+    assert reloaded.index.ntotal == 5
+    assert [doc["content"] for doc in reloaded.documents] == [doc["content"] for doc in vector_store.documents]
+
+
+def test_vector_store_write_behind_flush(tmp_path, monkeypatch):
+    """Test writes are searchable at once but only reach disk when flushed"""
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path),
+                               flush_interval=3600)
+    vector_store.storage.compact()
+    texts = [f"Buffered document {i} about rates" for i in range(4)]
+    embeddings = embedder.embed_batch(texts)
+    vector_store.add_documents([
+        {"content": text, "embedding": embedding, "metadata": {"source": "test"}}
+        for text, embedding in zip(texts, embeddings)
+    ])
+    
+    assert vector_store.get_stats()["storage"]["dirty_rows"] == 4
+    assert not (tmp_path / "documents.1.wal").exists()
+    assert len(VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path)).documents) == 0
+    # Unflushed rows are still readable for re-ranking
+    expected = np.array(embeddings, dtype='float32')
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.allclose(vector_store.storage.read_rows(np.arange(4)), expected, atol=1e-6)
+    
+    assert vector_store.flush() == 4
+    assert vector_store.get_stats()["storage"]["dirty_rows"] == 0
+    assert np.allclose(vector_store.storage.read_rows(np.arange(4)), expected, atol=1e-6)
+    reloaded = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    assert [doc["content"] for doc in reloaded.documents] == texts
+    vector_store.close()
+    assert not vector_store._flusher_thread.is_alive()
+    
+    # Writes after close restart the flusher, which registers one exit flush per instance
+    import atexit
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    monkeypatch.setattr(atexit, "unregister", registered.remove)
+    for cycle in range(2):
+        for text in texts[:2]:
+            vector_store.add_documents([{"content": text, "embedding": embedder.embed(text),
+                                         "metadata": {"source": "test"}}])
+        assert registered == [vector_store.flush]
+        vector_store.close()
+        assert registered == []
+
+
+def test_vector_store_mmap_startup(tmp_path, monkeypatch):
+    """Test memory-mapped startup serves the same documents and results"""
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    texts = [f"Mapped document {i} about earnings" for i in range(6)]
+    vector_store.add_documents([
+        {"content": text, "embedding": embedder.embed(text), "metadata": {"source": "test"}}
+        for text in texts
+    ])
+    vector_store.compact()
+    
+    mapped = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path), mmap=True)
+    assert mapped.get_stats()["index_size"] == 6
+    assert [doc["content"] for doc in mapped.documents] == texts
+    
+    # New rows land in the delta index and are searchable next to the mapped base
+    extra = "Mapped document 6 about earnings"
+    extra_embedding = embedder.embed(extra)
+    mapped.add_documents([{"content": extra, "embedding": extra_embedding, "metadata": {"source": "test"}}])
+    assert mapped.get_stats()["index_size"] == 7
+    monkeypatch.setattr(embedder, "embed", lambda text: extra_embedding)
+    results = mapped.search(extra, k=7, threshold=-1.0)
+    assert len(results) == 7
+    assert results[0]["content"] == extra
+
+    # A WAL beyond the mapped bound is folded in before serving, and the saved
+    # metadata index carries its postings and time order
+    mapped.close()
+    monkeypatch.setenv("VECTOR_MMAP_MAX_WAL_ROWS", "1")
+    reopened = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path), mmap=True)
+    assert reopened.storage.wal_rows == 0
+    assert "sorted_rows" in np.load(tmp_path / f"documents.{reopened.storage.generation}.meta.npz")
+    assert reopened.metadata_index.select(source="test").tolist() == list(range(7))
+
+
+def test_vector_store_index_promotion(tmp_path):
+    """Test background promotion from the flat index to HNSW"""
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path), index_type="hnsw")
+    vector_store.promotion_threshold = 50
+    
+    embeddings = embedder.embed_batch([f"Promotion document {i}" for i in range(60)])
+    vector_store.add_documents([
+        {"content": f"Promotion document {i}", "embedding": embedding, "metadata": {"source": "test"}}
+        for i, embedding in enumerate(embeddings)
+    ])
+    vector_store._promotion_thread.join(timeout=30)
+    
+    stats = vector_store.get_stats()
+    assert stats["index_type"] == "hnsw"
+    assert stats["index_size"] == 60
+    
+    # The promoted index is persisted with the next base generation
+    vector_store.compact()
+    reloaded = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path), index_type="hnsw")
+    assert reloaded.get_stats()["index_type"] == "hnsw"
+    assert reloaded.get_stats()["index_size"] == 60
+
+
+def test_vector_store_filtered_search(tmp_path, monkeypatch):
+    """Test symbol, source and time filters are applied inside the search"""
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    vector_store.exact_filter_rows = 0  # Exercise the FAISS ID selector path
+    
+    documents = []
+    for i in range(30):
+        symbol = ["AAPL", "TSLA", None][i % 3]
+        documents.append({
+            "content": f"Update {i}",
+            "embedding": embedder.embed(f"Update {i}"),
+            "metadata": {
+                "source": "market_data" if i % 2 else "Reuters",
+                "symbol": symbol,
+                "timestamp": f"2024-01-01T00:00:{i:02d}"
+            }
+        })
+    vector_store.add_documents(documents)
+    query_embedding = documents[0]["embedding"]
+    monkeypatch.setattr(embedder, "embed", lambda text: query_embedding)
+    
+    results = vector_store.search("TSLA news", k=30, threshold=-1.0, symbol="TSLA", source="Reuters")
+    assert results
+    assert all(doc["metadata"]["symbol"] == "TSLA" and doc["metadata"]["source"] == "Reuters" for doc in results)
+    assert len(results) == len([d for d in documents if d["metadata"]["symbol"] == "TSLA"
+                                and d["metadata"]["source"] == "Reuters"])
+    
+    results = vector_store.search("recent", k=30, threshold=-1.0,
+                                  since="2024-01-01T00:00:20", until="2024-01-01T00:00:24")
+    assert sorted(doc["content"] for doc in results) == [f"Update {i}" for i in range(20, 25)]
+    
+    assert vector_store.search("nothing", k=5, threshold=-1.0, symbol="MSFT") == []
+    
+    # The metadata index survives compaction and restart
+    vector_store.compact()
+    reloaded = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    results = reloaded.search("AAPL", k=30, threshold=-1.0, symbol=["AAPL"])
+    assert len(results) == 10
+
+def test_vector_store_search_batch(tmp_path, monkeypatch):
+    """Test batched search matches per-query search with one embedding call"""
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    
+    documents = [{
+        "content": f"Update {i}",
+        "embedding": embedder.embed(f"Update {i}"),
+        "metadata": {"source": "market_data", "symbol": ["AAPL", "TSLA"][i % 2]}
+    } for i in range(20)]
+    vector_store.add_documents(documents)
+    
+    queries = ["first", "second", "third"]
+    embeddings = {query: documents[i]["embedding"] for i, query in enumerate(queries)}
+    batch_calls = []
+    monkeypatch.setattr(embedder, "embed", lambda text: embeddings[text])
+    monkeypatch.setattr(embedder, "embed_batch",
+                        lambda texts: batch_calls.append(texts) or [embeddings[t] for t in texts])
+    
+    results = vector_store.search_batch(queries, k=3, threshold=-1.0)
+    assert len(batch_calls) == 1
+    assert [r[0]["content"] for r in results] == ["Update 0", "Update 1", "Update 2"]
+    for query, batch_result in zip(queries, results):
+        assert batch_result == vector_store.search(query, k=3, threshold=-1.0)
+    
+    filtered = vector_store.search_batch(queries, k=20, threshold=-1.0, filters={"symbol": "TSLA"})
+    assert all(doc["metadata"]["symbol"] == "TSLA" for result in filtered for doc in result)
+    assert vector_store.search_batch([], k=3) == []
+
+def test_batch_search_endpoint(tmp_path, monkeypatch):
+    """Test /search/batch validates filters and waits for the vector store"""
+    import sys
+    import types
+    from fastapi.testclient import TestClient
+    from backend.api import app as api
+    client = TestClient(api.app)
+
+    # A system that fails to start is not ready, rather than a server error
+    broken = types.ModuleType("backend.main")
+    def fail_startup(name):
+        raise RuntimeError("vector store failed to open")
+    broken.__getattr__ = fail_startup
+    monkeypatch.setitem(sys.modules, "backend.main", broken)
+    response = client.post("/search/batch", json={"queries": ["AAPL"]})
+    assert response.status_code == 503
+
+    monkeypatch.setattr(api, "get_vector_store", lambda: None)
+    response = client.post("/search/batch", json={"queries": ["AAPL"]})
+    assert response.status_code == 503
+
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    vector_store.add_documents([{
+        "content": f"{symbol} is trading higher",
+        "embedding": embedder.embed(f"{symbol} is trading higher"),
+        "metadata": {"source": "market_data", "symbol": symbol}
+    } for symbol in ["AAPL", "TSLA"]])
+    monkeypatch.setattr(api, "get_vector_store", lambda: vector_store)
+
+    response = client.post("/search/batch", json={"queries": ["trading", "higher"], "k": 5, "threshold": -1.0,
+                                                  "filters": {"symbol": "TSLA"}})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 2
+    assert all([doc["metadata"]["symbol"] for doc in result] == ["TSLA"] for result in results)
+
+    response = client.post("/search/batch", json={"queries": ["trading"], "filters": {"ticker": "TSLA"}})
+    assert response.status_code == 422
+    for k in (0, -1, 101):
+        assert client.post("/search/batch", json={"queries": ["trading"], "k": k}).status_code == 422
+
+def test_vector_store_retention(tmp_path, monkeypatch):
+    """Test expired documents are hidden from search and purged by compaction"""
+    now = time.time()
+    embedder = Embedder()
+    retention_policy = {"market_data": 3600, "*": 7 * 86400}
+    
+    def open_store(mmap):
+        return VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / str(mmap)),
+                           mmap=mmap, retention_policy=retention_policy)
+    
+    documents = []
+    for i in range(40):
+        age = [600, 7200, 86400, 10 * 86400][i // 2 % 4]
+        documents.append({
+            "content": f"Doc {i}",
+            "embedding": embedder.embed(f"Doc {i}"),
+            "metadata": {
+                "source": "market_data" if i % 2 else "Reuters",
+                "symbol": "AAPL",
+                "timestamp": datetime.fromtimestamp(now - age).isoformat()
+            }
+        })
+    # Ticks older than an hour and news older than a week expire
+    expected = sorted(f"Doc {i}" for i in range(40) if i // 2 % 4 == 0 or (i % 2 == 0 and i // 2 % 4 != 3))
+    query_embedding = documents[0]["embedding"]
+    monkeypatch.setattr(embedder, "embed", lambda text: query_embedding)
+    
+    for mmap in (False, True):
+        vector_store = open_store(mmap)
+        vector_store.stop_retention()
+        vector_store.storage.compaction_ratio = 1.0
+        vector_store.add_documents(documents)
+        
+        assert vector_store.evict_expired(now) == 20
+        assert vector_store.get_stats()["removed_documents"] == 20
+        results = vector_store.search("AAPL", k=40, threshold=-1.0)
+        assert sorted(doc["content"] for doc in results) == expected
+        results = vector_store.search("AAPL", k=40, threshold=-1.0, symbol="AAPL")
+        assert sorted(doc["content"] for doc in results) == expected
+        
+        # Enough expired rows to reclaim: the index and files shrink to the live set
+        vector_store.storage.compaction_ratio = 0.5
+        assert vector_store.evict_expired(now) == 0
+        assert len(vector_store.documents) == 20
+        assert vector_store._index_size() == 20
+        assert vector_store.get_stats()["removed_documents"] == 0
+        results = vector_store.search("AAPL", k=40, threshold=-1.0, source="Reuters")
+        assert sorted(doc["content"] for doc in results) == sorted(
+            c for c in expected if int(c.split()[1]) % 2 == 0)
+        
+        reloaded = open_store(mmap)
+        reloaded.stop_retention()
+        assert len(reloaded.documents) == 20
+        assert sorted(doc["content"] for doc in reloaded.search("AAPL", k=40, threshold=-1.0)) == expected
+
+def test_vector_store_upsert(tmp_path, monkeypatch):
+    """Test upserts keep one live document per (symbol, source)"""
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    query_embedding = embedder.embed("AAPL price")
+    monkeypatch.setattr(embedder, "embed", lambda text: query_embedding)
+    
+    def tick(symbol, price, source="market_data"):
+        return {
+            "content": f"{symbol} is trading at ${price}",
+            "embedding": query_embedding,
+            "metadata": {"source": source, "symbol": symbol}
+        }
+    
+    vector_store.add_documents([tick("AAPL", 180, source="Reuters")])
+    for price in range(100, 110):
+        vector_store.upsert_documents([tick("AAPL", price), tick("TSLA", price), tick("AAPL", price + 1000)])
+    
+    results = vector_store.search("AAPL price", k=50, threshold=-1.0)
+    assert sorted(doc["content"] for doc in results) == [
+        "AAPL is trading at $1109", "AAPL is trading at $180", "TSLA is trading at $109"]
+    
+    # Tombstones survive a restart until a purge reclaims the rows
+    vector_store.flush()
+    reloaded = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path))
+    assert len(reloaded.search("AAPL price", k=50, threshold=-1.0)) == 3
+    reloaded.compact()
+    assert len(reloaded.documents) == 3
+    assert len(reloaded.search("AAPL price", k=50, threshold=-1.0, symbol="AAPL")) == 2
+
+def test_sharded_vector_store(tmp_path, monkeypatch):
+    """Test time-bucketed shards, window pruning, cross-shard upserts and shard retention"""
+    import threading
+    from backend.rag.sharded_store import ShardedVectorStore
+    
+    embedder = Embedder()
+    hour = 3600
+    now = (time.time() // 86400) * 86400 + 12 * hour
+    sharded = ShardedVectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "sharded"),
+                                 shard_widths={"market_data": hour, "*": 86400},
+                                 retention_policy={"market_data": 6 * hour, "*": 30 * 86400})
+    plain = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "plain"))
+    sharded.stop_retention()
+    
+    documents = []
+    for i in range(48):
+        documents.append({
+            "content": f"Doc {i}",
+            "embedding": embedder.embed(f"Doc {i}"),
+            "metadata": {
+                "source": "market_data" if i % 2 else "Reuters",
+                "symbol": f"SYM{i}",
+                "timestamp": datetime.fromtimestamp(now - i * hour / 2).isoformat()
+            }
+        })
+    sharded.add_documents(documents)
+    plain.add_documents(documents)
+    # 24 hourly tick shards and two daily news shards
+    assert sharded.get_stats()["shard_count"] == 26
+    
+    query_embedding = documents[5]["embedding"]
+    monkeypatch.setattr(embedder, "embed", lambda text: query_embedding)
+    results = sharded.search("query", k=10, threshold=-1.0)
+    # Tied scores may come back in a different order
+    assert [doc["similarity_score"] for doc in results] == pytest.approx(
+        [doc["similarity_score"] for doc in plain.search("query", k=10, threshold=-1.0)])
+    assert results[0]["content"] == "Doc 5"
+    
+    since = datetime.fromtimestamp(now - 2 * hour).isoformat()
+    assert len(sharded._shards_for(since=since)) == 3
+    results = sharded.search("query", k=48, threshold=-1.0, since=since)
+    assert sorted(doc["content"] for doc in results) == sorted(f"Doc {i}" for i in range(5))
+    
+    # An upsert in the current bucket replaces the tick stored in an older one
+    sharded.upsert_documents([{**documents[5], "content": "Doc 5 updated",
+                               "metadata": {**documents[5]["metadata"], "timestamp": datetime.fromtimestamp(now).isoformat()}}])
+    results = sharded.search("query", k=48, threshold=-1.0, symbol="SYM5")
+    assert [doc["content"] for doc in results] == ["Doc 5 updated"]
+    # Only the shard holding the new version is tracked for the key
+    assert sharded.key_shards[("SYM5", "market_data")] == {f"market_data-{int(now // hour * hour)}"}
+    
+    # Searches wait only for the publish step of an upsert, not for its segment write
+    current = sharded.shards[f"market_data-{int(now // hour * hour)}"]
+    persist = current._persist_data
+    def slow_persist(*args):
+        time.sleep(0.5)
+        persist(*args)
+    monkeypatch.setattr(current, "_persist_data", slow_persist)
+    writer = threading.Thread(target=sharded.upsert_documents, args=([{
+        **documents[5], "content": "Doc 5 again",
+        "metadata": {**documents[5]["metadata"], "timestamp": datetime.fromtimestamp(now).isoformat()}}],))
+    writer.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    assert [doc["content"] for doc in sharded.search("query", k=48, threshold=-1.0, symbol="SYM5")] == [
+        "Doc 5 updated"]
+    assert time.monotonic() - started < 0.3
+    writer.join()
+    assert [doc["content"] for doc in sharded.search("query", k=48, threshold=-1.0, symbol="SYM5")] == [
+        "Doc 5 again"]
+    
+    # Shards entirely older than the tick retention are dropped, news shards are kept
+    assert sharded.evict_expired(now) == 18
+    assert sharded.get_stats()["shard_count"] == 9
+    
+    sharded.flush()
+    reopened = ShardedVectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "sharded"),
+                                  shard_widths={"market_data": hour, "*": 86400}, retention_policy={})
+    reopened.stop_retention()
+    assert reopened.get_stats()["shard_count"] == 9
+    assert ("SYM5", "market_data") in reopened.key_shards
+    assert reopened.get_stats()["total_documents"] - reopened.get_stats()["removed_documents"] == 48 - 18
+
+def test_vector_store_quantized_rerank(tmp_path, monkeypatch):
+    """Test int8 scalar quantization with exact float32 re-ranking from the segment files"""
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path),
+                               index_type="sq_int8", rerank=True)
+    vector_store.promotion_threshold = 50
+    
+    embeddings = embedder.embed_batch([f"Quantized document {i}" for i in range(80)])
+    vector_store.add_documents([
+        {"content": f"Quantized document {i}", "embedding": embedding, "metadata": {"source": "test"}}
+        for i, embedding in enumerate(embeddings[:60])
+    ])
+    vector_store._promotion_thread.join(timeout=30)
+    vector_store.compact()
+    vector_store.add_documents([
+        {"content": f"Quantized document {i}", "embedding": embedding, "metadata": {"source": "test"}}
+        for i, embedding in enumerate(embeddings[60:], start=60)
+    ])
+    
+    stats = vector_store.get_stats()
+    assert stats["index_type"] == "sq_int8"
+    assert stats["rerank"]
+    
+    # Re-ranked scores are exact, for rows in both the base segment and the WAL
+    for i in (7, 70):
+        monkeypatch.setattr(embedder, "embed", lambda text: embeddings[i])
+        results = vector_store.search(f"query {i}", k=3, threshold=-1.0)
+        assert results[0]["content"] == f"Quantized document {i}"
+        assert results[0]["similarity_score"] == pytest.approx(1.0, abs=1e-5)
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_vector_store_concurrent_ingest_and_search(tmp_path, mmap):
+    """Stress test: concurrent adds, upserts, compactions and purges never expose a torn state"""
+    import threading
+    
+    embedder = Embedder()
+    dimension = 32
+    vector_store = VectorStore(embedder, dimension=dimension, data_dir=str(tmp_path), mmap=mmap)
+    vector_store.storage.min_compaction_rows = 50
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(2400, dimension)).astype("float32")
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    errors = []
+    done = threading.Event()
+    
+    def document(i, symbol=None, source="news"):
+        return {"content": f"Doc {i}", "embedding": embeddings[i].tolist(),
+                "metadata": {"source": source, "symbol": symbol, "row": i}}
+    
+    def ingest(offset):
+        try:
+            for i in range(offset, offset + 800, 8):
+                vector_store.add_documents([document(j) for j in range(i, i + 8)])
+        except Exception as e:
+            errors.append(e)
+    
+    def upsert():
+        try:
+            for i in range(1600, 2400):
+                vector_store.upsert_documents([document(i, symbol=f"SYM{i % 4}", source="market_data")])
+        except Exception as e:
+            errors.append(e)
+    
+    def search():
+        try:
+            while not done.is_set():
+                rows = rng.integers(0, 2400, 4)
+                for row, results in zip(rows, vector_store.search_vectors(embeddings[rows], k=10, threshold=-1.0)):
+                    for doc in results:
+                        # Every hit's score must match its own document's vector
+                        expected = float(embeddings[doc["metadata"]["row"]] @ embeddings[row])
+                        assert doc["similarity_score"] == pytest.approx(expected, abs=1e-4)
+                for symbol in ("SYM0", "SYM1"):
+                    results = vector_store.search_vectors(embeddings[:1], k=10, threshold=-1.0,
+                                                          filters={"symbol": symbol})[0]
+                    assert len(results) <= 1
+        except Exception as e:
+            errors.append(e)
+    
+    readers = [threading.Thread(target=search) for _ in range(3)]
+    writers = [threading.Thread(target=ingest, args=(0,)), threading.Thread(target=ingest, args=(800,)),
+               threading.Thread(target=upsert)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join(timeout=120)
+    vector_store.compact()
+    done.set()
+    for thread in readers:
+        thread.join(timeout=30)
+    
+    assert not errors, errors
+    assert len(vector_store.documents) - len(vector_store.removed) == 1604
+    results = vector_store.search_vectors(embeddings[[5, 1700]], k=1, threshold=-1.0)
+    assert results[0][0]["content"] == "Doc 5"
+    assert [doc["content"] for doc in vector_store.search_vectors(
+        embeddings[2399:], k=10, threshold=-1.0, filters={"symbol": "SYM3"})[0]] == ["Doc 2399"]
+
+def test_document_chunking(tmp_path, monkeypatch):
+    """Test long documents are embedded as overlapping chunks and searched as one document"""
+    from backend.rag.chunking import TextChunker, pack_batches
+    chunker = TextChunker(chunk_tokens=8, overlap=2)
+    words = [chr(97 + i // 5) + chr(97 + i % 5) for i in range(20)]
+    text = " ".join(words)
+    chunks = chunker.split(text)
+    assert chunks == [" ".join(words[0:8]), " ".join(words[6:14]), " ".join(words[12:20])]
+    assert chunker.split("short text") == ["short text"]
+    assert chunker.truncate(text, 3) == " ".join(words[:3])
+    if chunker.encoding is None:
+        # Without tiktoken numbers, tickers and non-English text are not undercounted
+        assert chunker.count("1234567") == 3
+        assert chunker.count("NVDA") == 2
+        assert chunker.count("株価が上昇") == 5
+        filing = "Revenue rose 12.5% to $94,836 million in fiscal 2024 " * 50
+        assert chunker.count(filing) >= len(filing.replace(" ", "")) / 3
+        assert chunker.count(chunker.truncate(filing, 100)) == 100
+    assert pack_batches([3, 3, 3, 9, 1], max_items=2, max_tokens=8) == [slice(0, 2), slice(2, 3), slice(3, 4), slice(4, 5)]
+    
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    monkeypatch.setenv("CHUNK_TOKENS", "16")
+    monkeypatch.setenv("CHUNK_OVERLAP", "4")
+    monkeypatch.setenv("SIMILARITY_THRESHOLD", "-1")
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "data"))
+    pipeline = InMemoryPipeline(embedder, vector_store)
+    calls = []
+    embed_batch = embedder.embed_batch
+    monkeypatch.setattr(embedder, "embed_batch", lambda texts: calls.append(len(texts)) or embed_batch(texts))
+    
+    filing = ("Apple quarterly filing reports record iPhone revenue and services growth. " * 6
+              + "The board approved a new share buyback program and raised the dividend.")
+    parent_id = pipeline.add_document(filing, "sec_filings", "AAPL")
+    pipeline.add_document("Tesla deliveries beat estimates", "news", "TSLA")
+    assert calls == [len(pipeline.chunker.split(filing)), 1]
+    assert len(vector_store.documents) == calls[0] + 1
+    assert len(pipeline.documents) == 2 and pipeline.documents[0]["content"] == filing
+    
+    results = pipeline.query("Apple share buyback dividend", k=5)
+    hits = [doc for doc in results if doc["metadata"].get("parent_id") == parent_id]
+    assert len(hits) == 1
+    assert "buyback" in hits[0]["content"] and hits[0]["metadata"]["chunks"] == calls[0]
+    
+    # Upserting a chunked document replaces all of its chunks at once
+    pipeline.upsert_document(filing, "sec_filings", "AAPL")
+    pipeline.upsert_document(filing, "sec_filings", "AAPL")
+    live = len(vector_store.documents) - len(vector_store.removed)
+    assert live == calls[0] + 1
+
+def test_bulk_ingestion(tmp_path, monkeypatch):
+    """Test a batch of documents is embedded, indexed and logged in one call each"""
+    import asyncio
+    import json
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "data"))
+    pipeline = InMemoryPipeline(embedder, vector_store)
+    rag_engine = RAGEngine(pipeline, embedder, vector_store)
+    calls = []
+    for target, name in [(embedder, "embed_batch"), (embedder, "aembed_batch"),
+                         (vector_store, "add_documents"), (vector_store, "upsert_documents")]:
+        method = getattr(target, name)
+        monkeypatch.setattr(target, name, lambda items, method=method, name=name: calls.append(name) or method(items))
+    
+    news = [{"content": f"Article {i} about earnings", "source": "Reuters", "symbol": "AAPL"} for i in range(5)]
+    doc_ids = rag_engine.add_documents(news)
+    assert calls == ["embed_batch", "add_documents"]
+    assert len(set(doc_ids)) == 5 and len(vector_store.documents) == 5
+    with open(tmp_path / "data" / "pipeline.0.wal") as f:
+        assert [json.loads(line)["document"]["metadata"]["id"] for line in f] == doc_ids
+    
+    def tick(price):
+        return [{"content": f"{symbol} is trading at ${price}", "source": "market_data", "symbol": symbol}
+                for symbol in ["AAPL", "TSLA", "NVDA"]]
+    
+    calls.clear()
+    for price in range(100, 103):
+        asyncio.run(pipeline.aupsert_documents(tick(price)))
+    assert calls == ["aembed_batch", "upsert_documents"] * 3
+    assert len(pipeline.documents) == 5 + 3
+    assert sorted(doc["content"] for doc in pipeline.documents[5:]) == [
+        "AAPL is trading at $102", "NVDA is trading at $102", "TSLA is trading at $102"]
+    assert len(vector_store.documents) - len(vector_store.removed) == 5 + 3
+
+def test_ingestion_queue(tmp_path, monkeypatch):
+    """Test queued documents reach the pipeline in batches and full queues apply their policy"""
+    import asyncio
+    from backend.rag.ingestion_queue import IngestionQueue
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "data"))
+    pipeline = InMemoryPipeline(embedder, vector_store)
+    
+    def articles(start, count):
+        return [{"content": f"Article {i} on market volatility", "source": "Reuters", "symbol": None}
+                for i in range(start, start + count)]
+    
+    accepted = []
+    async def ingest(queue, cycles):
+        for start in range(0, 10 * cycles, 10):
+            accepted.append(await queue.asubmit(articles(start, 10)))
+        await asyncio.sleep(0.2)
+        accepted.append(await queue.asubmit([{"content": "AAPL is trading at $180", "source": "market_data",
+                                              "symbol": "AAPL"}], upsert=True))
+        await queue.stop()
+        return queue.get_stats()
+    
+    stats = asyncio.run(ingest(IngestionQueue(pipeline, max_size=100, workers=2, batch_size=16), 4))
+    assert stats["processed"] == 41 and stats["dropped"] == 0 and stats["failed"] == 0
+    assert stats["batches"] < 41 and stats["depth"] == 0 and stats["workers"] == 0
+    assert len(pipeline.documents) == 41
+    assert accepted == [10, 10, 10, 10, 1]
+    
+    # Without backpressure, a full queue drops documents instead of making the source wait
+    accepted.clear()
+    stats = asyncio.run(ingest(IngestionQueue(pipeline, max_size=5, policy="drop_newest"), 1))
+    assert stats["dropped"] == 5 and stats["processed"] == 6
+    assert accepted == [5, 1]
+    assert [doc["content"] for doc in pipeline.documents[-5:]] == [doc["content"] for doc in articles(0, 5)]
+    
+    stats = asyncio.run(ingest(IngestionQueue(pipeline, max_size=5, policy="drop_oldest"), 1))
+    assert stats["dropped"] == 5 and stats["processed"] == 6
+    assert [doc["content"] for doc in pipeline.documents[-5:]] == [doc["content"] for doc in articles(5, 5)]
+    
+    # Workers write on the executor, so a slow journal sync never stalls the event loop
+    append = pipeline.journal.append
+    def slow_append(batch, upsert):
+        time.sleep(0.3)
+        append(batch, upsert)
+    monkeypatch.setattr(pipeline.journal, "append", slow_append)
+    
+    async def ingest_while_ticking():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        task = asyncio.create_task(ticker())
+        queue = IngestionQueue(pipeline, workers=2)
+        await queue.asubmit(articles(100, 4))
+        await queue.stop()
+        task.cancel()
+        return ticks, queue.get_stats()
+    
+    ticks, stats = asyncio.run(ingest_while_ticking())
+    assert stats["processed"] == 4 and ticks >= 10
+    
+    with pytest.raises(ValueError):
+        IngestionQueue(pipeline, policy="ignore")
+
+def test_market_deadband_filter():
+    """Test unchanged ticks are held back until they move past a threshold or go stale"""
+    from backend.data_sources.market_data import DeadbandFilter
+    deadband = DeadbandFilter(price_pct=0.1, change_pct=0.25, volume_pct=25, max_staleness=60)
+    
+    def tick(price, change_percent=0.5, volume=1000000):
+        return {"price": price, "change_percent": change_percent, "volume": volume}
+    
+    def emit(ticks, now):
+        changed = deadband.filter(ticks, now=now)
+        deadband.commit(changed, now=now)
+        return changed
+    
+    assert list(emit({"AAPL": tick(180.0), "TSLA": tick(240.0)}, now=0)) == ["AAPL", "TSLA"]
+    assert emit({"AAPL": tick(180.1), "TSLA": tick(240.0, volume=1100000)}, now=10) == {}
+    # Drift is measured against the last emitted tick, not the previous one
+    assert list(emit({"AAPL": tick(180.2), "TSLA": tick(240.0, 0.9)}, now=20)) == ["AAPL", "TSLA"]
+    assert list(emit({"AAPL": tick(180.2), "TSLA": tick(240.0, 0.9, 2000000)}, now=30)) == ["TSLA"]
+    # Heartbeat once the last emitted tick is stale
+    assert list(emit({"AAPL": tick(180.2), "TSLA": tick(240.0, 0.9, 2000000)}, now=85)) == ["AAPL"]
+    
+    stats = deadband.get_stats()
+    assert stats["ticks"] == 10 and stats["emitted"] == 6
+    assert stats["embeddings_saved"] == 4 and stats["heartbeats"] == 1
+    
+    # A tick whose write failed is never committed, so the next one within the band still passes
+    assert list(deadband.filter({"AAPL": tick(181.0)}, now=90)) == ["AAPL"]
+    assert list(emit({"AAPL": tick(181.0)}, now=95)) == ["AAPL"]
+    assert emit({"AAPL": tick(181.0)}, now=100) == {}
+    assert deadband.get_stats()["embeddings_saved"] == 5
+
+def test_market_deadband_through_queue(tmp_path, monkeypatch):
+    """Test ticks evicted from the ingestion queue never become the deadband reference"""
+    import asyncio
+    from backend.data_sources.market_data import DeadbandFilter, MarketDataSource
+    from backend.rag.ingestion_queue import IngestionQueue
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "data"))
+    pipeline = InMemoryPipeline(embedder, vector_store)
+    queue = IngestionQueue(pipeline, max_size=1, policy="drop_oldest")
+    source = MarketDataSource(queue, DeadbandFilter(price_pct=0.1, change_pct=0.25, volume_pct=25,
+                                                    max_staleness=60))
+    
+    def tick(price):
+        return {"price": price, "change": 1.0, "change_percent": 0.5, "volume": 1000000,
+                "market_cap": 1000000000, "timestamp": "2024-01-02T10:00:00"}
+    
+    async def stream():
+        # The queue holds one document, so the AAPL tick is evicted by the TSLA one
+        await source.publish({"AAPL": tick(180.0), "TSLA": tick(240.0)}, now=0)
+        await queue.stop()
+        # AAPL was never stored, so its unchanged tick still passes; TSLA's is held back
+        changed = await source.publish({"AAPL": tick(180.0), "TSLA": tick(240.0)}, now=10)
+        await queue.stop()
+        return changed
+    
+    assert list(asyncio.run(stream())) == ["AAPL"]
+    assert [doc["metadata"]["symbol"] for doc in pipeline.documents] == ["TSLA", "AAPL"]
+    stats = source.get_stats()["deadband"]
+    assert stats["emitted"] == 2 and stats["embeddings_saved"] == 1
+    assert queue.get_stats()["dropped"] == 1
+
+def test_pipeline_snapshot_recovery(tmp_path, monkeypatch):
+    """Test pipeline documents survive restarts through snapshots plus the WAL"""
+    import json
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    monkeypatch.setenv("PIPELINE_SNAPSHOT_MIN_ROWS", "4")
+    legacy = [{"content": f"Legacy article {i}", "embedding": [0.1, 0.2],
+               "metadata": {"source": "Reuters", "symbol": None, "id": f"legacy_{i}"}} for i in range(3)]
+    with open(tmp_path / "data" / "processed_documents.json", "w") as f:
+        f.writelines(json.dumps(doc) + "\n" for doc in legacy)
+    
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "data"))
+    pipeline = InMemoryPipeline(embedder, vector_store)
+    assert not (tmp_path / "data" / "processed_documents.json").exists()
+    assert [doc["content"] for doc in pipeline.documents] == [doc["content"] for doc in legacy]
+    assert "embedding" not in pipeline.documents[0]
+    
+    for price in range(100, 106):
+        pipeline.upsert_documents([{"content": f"{symbol} is trading at ${price}", "source": "market_data",
+                                    "symbol": symbol} for symbol in ["AAPL", "TSLA"]])
+        pipeline.add_document(f"Market wrap {price}", "CNBC")
+        pipeline.journal.close()
+    assert pipeline.journal.snapshots >= 1
+    contents = [doc["content"] for doc in pipeline.documents]
+    assert contents[3:5] == ["AAPL is trading at $105", "TSLA is trading at $105"]
+    assert len(contents) == 3 + 2 + 6
+    
+    # A torn trailing WAL record is dropped on replay
+    with open(tmp_path / "data" / f"pipeline.{pipeline.journal.wal_generation}.wal", "a") as f:
+        f.write('{"upsert": false, "document": {"content": "torn')
+    restarted = InMemoryPipeline(embedder, vector_store)
+    assert [doc["content"] for doc in restarted.documents] == contents
+    
+    # Upserts after a restart still replace the snapshotted row of their key
+    restarted.upsert_document("AAPL is trading at $200", "market_data", "AAPL")
+    # Block scans of the mapped snapshot see replaced rows like row lookups do
+    assert list(restarted.documents) == restarted.documents[:]
+    restarted.journal.snapshot(wait=True)
+    reloaded = InMemoryPipeline(embedder, vector_store)
+    assert reloaded.journal.wal_rows == 0
+    assert [doc["content"] for doc in reloaded.documents] == ["AAPL is trading at $200" if c.startswith("AAPL") else c
+                                                              for c in contents]
+    assert sorted(name for name in os.listdir(tmp_path / "data") if name.startswith("pipeline.")) == [
+        f"pipeline.{reloaded.journal.generation}.jsonl", f"pipeline.{reloaded.journal.generation}.offsets.npy",
+        "pipeline.json"]
+    
+    # Without a source an upsert has no key, so both layers append it
+    for note in ("Trading halted", "Trading resumed"):
+        reloaded.upsert_documents([{"content": note, "source": None, "symbol": "NVDA"}])
+    hits = vector_store.search("Trading", k=10, threshold=-1.0, symbol="NVDA")
+    assert sorted(hit["content"] for hit in hits) == ["Trading halted", "Trading resumed"]
+    assert [doc["content"] for doc in InMemoryPipeline(embedder, vector_store).documents][-2:] == [
+        "Trading halted", "Trading resumed"]
+
+def test_shared_document_records(tmp_path, monkeypatch):
+    """Test the pipeline and vector store share one compact record per document"""
+    import json
+    import tracemalloc
+    from backend.rag.document_records import DocumentRecord, DocumentRecords, shared_records
+    monkeypatch.chdir(tmp_path)
+    embedder = Embedder()
+    vector_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "data"))
+    pipeline = InMemoryPipeline(embedder, vector_store)
+    
+    doc_id = pipeline.add_document("AAPL is trading at $150", "market_data", "AAPL")
+    record = pipeline.documents[-1]
+    assert isinstance(record, DocumentRecord)
+    assert vector_store.documents[-1] is record
+    assert record == {"content": "AAPL is trading at $150",
+                      "metadata": {"source": "market_data", "symbol": "AAPL",
+                                   "timestamp": record["metadata"]["timestamp"], "id": doc_id}}
+    assert json.loads(json.dumps(record, default=dict))["metadata"]["id"] == doc_id
+    
+    # After a restart both layers load the same document into one shared record,
+    # whether the pipeline replays it from the WAL or maps it from the snapshot
+    pipeline.journal.snapshot(wait=True)
+    pipeline.add_document("TSLA is trading at $240", "market_data", "TSLA")
+    vector_store.flush()
+    restarted_store = VectorStore(embedder, dimension=embedder.dimension, data_dir=str(tmp_path / "data"))
+    restarted = InMemoryPipeline(embedder, restarted_store)
+    assert restarted.journal.snapshot_rows == 1 and restarted.journal.wal_rows == 1
+    assert restarted.documents[0] is restarted_store.documents[0]
+    assert restarted.documents[-1] is restarted_store.documents[-1]
+    assert all(a is b for a, b in zip(restarted.documents, restarted_store.documents))
+    
+    # One shared record takes well under half of two separately decoded dicts
+    lines = [json.dumps({"content": f"AAPL is trading at ${i}",
+                         "metadata": {"source": "market_data", "symbol": "AAPL",
+                                      "timestamp": "2024-01-02T10:00:00", "id": f"doc_{i}"}})
+             for i in range(2000)]
+    tracemalloc.start()
+    copies = [json.loads(line) for line in lines], [json.loads(line) for line in lines]
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    del copies
+    tracemalloc.stop()
+    tracemalloc.start()
+    records = DocumentRecords()
+    shared = [records.record(json.loads(line)) for line in lines], [records.record(json.loads(line)) for line in lines]
+    record_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert all(a is b for a, b in zip(*shared))
+    assert record_bytes < dict_bytes / 2
+    
+    # Reusing an id and content with new metadata registers a new record
+    document = {"content": "Breaking news", "metadata": {"source": "news", "symbol": "AAPL", "id": "doc_news"}}
+    first = shared_records.record(document)
+    assert shared_records.record(dict(document)) is first
+    moved = shared_records.record({"content": "Breaking news",
+                                   "metadata": {"source": "news", "symbol": "MSFT", "id": "doc_news"}})
+    assert moved is not first and moved["metadata"]["symbol"] == "MSFT"
+    assert shared_records.record({"content": "Breaking news", "metadata": {"source": "news", "symbol": "MSFT",
+                                                                           "id": "doc_news"}}) is moved
+    
+    # The vector store indexes the new symbol, not the one of the cached record
+    embedding = embedder.embed("Breaking news")
+    vector_store.add_documents([dict(document, embedding=embedding)])
+    vector_store.add_documents([{"content": "Breaking news", "embedding": embedding,
+                                 "metadata": {"source": "filings", "symbol": "MSFT", "id": "doc_news"}}])
+    results = vector_store.search("Breaking news", k=5, symbol="MSFT")
+    assert [r["metadata"]["source"] for r in results if r["content"] == "Breaking news"] == ["filings"]